@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+module with the controller that adapts the number
+of snapshots running at the same time
+"""
+
+import logging
+import os
+import threading
+import time
+
+from cvmfsreplica.utils import WakeupPipe
+
+
+# =============================================================================
+#       CLASS ADAPTIVE CONCURRENCY
+# =============================================================================
+
+class AdaptiveConcurrency(threading.Thread):
+    """
+    class to change, time to time, the maximum number
+    of snapshots running at the same time,
+    between a minimum and a maximum.
+
+    The decision follows AIMD (additive increase,
+    multiplicative decrease):
+
+        -- if the host is congested, either because
+           the fraction of CPU time waiting for I/O or the load
+           per CPU are too high, or because the number of
+           snapshots completed dropped after the last increase,
+           the limit is multiplied by a factor smaller than 1.
+
+        -- otherwise, if all slots are busy and there are
+           requests waiting, the limit is increased by 1.
+    """
+
+    def __init__(self, queue, minimum, maximum, period=300,
+                 max_iowait=0.3, max_load=1.0, decrease_factor=0.5):
+        """
+        queue is the ReplicaRequestQueue( ) object whose limit is changed
+        minimum and maximum are the bounds for the limit
+        period is the time, in seconds, between decisions
+        max_iowait is the maximum fraction of CPU time waiting for I/O
+        max_load is the maximum 1 minute load average per CPU
+        decrease_factor multiplies the limit when there is congestion
+        """
+
+        threading.Thread.__init__(self) # init the thread
+        self.log = logging.getLogger('cvmfsreplica.adaptiveconcurrency')
+        self.stopevent = threading.Event()
+        self.wakeuppipe = WakeupPipe()
+
+        self.queue = queue
+        self.minimum = minimum
+        self.maximum = maximum
+        self.period = period
+        self.max_iowait = max_iowait
+        self.max_load = max_load
+        self.decrease_factor = decrease_factor
+
+        self.limit = minimum
+        self.increased = False
+        self.ncpus = os.sysconf('SC_NPROCESSORS_ONLN')
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+
+        self.log.debug('starting AdaptiveConcurrency thread main loop...')
+        self.queue.setlimit(self.limit)
+        cpustats = self._readcpustats()
+        completed = self.queue.completed
+        throughput = None
+
+        while not self.stopevent.isSet():
+            self.wakeuppipe.wait(self.period)
+            if self.stopevent.isSet():
+                break
+            self.log.trace('AdaptiveConcurrency loop')
+
+            newcpustats = self._readcpustats()
+            iowait = self._iowait(cpustats, newcpustats)
+            cpustats = newcpustats
+            load = os.getloadavg()[0] / self.ncpus
+            newcompleted = self.queue.completed
+            previous = throughput
+            throughput = newcompleted - completed
+            completed = newcompleted
+            saturated = len(self.queue.running) >= self.limit and self.queue.qsize() > 0
+
+            limit = self._decide(iowait, load, throughput, previous, saturated)
+            self.log.info('iowait=%.2f, load per cpu=%.2f, snapshots completed=%s, saturated=%s. Limit %s -> %s'
+                          %(iowait, load, throughput, saturated, self.limit, limit))
+            self.increased = limit > self.limit
+            if limit != self.limit:
+                self.limit = limit
+                self.queue.setlimit(limit)
+
+
+    def _decide(self, iowait, load, throughput, previous, saturated):
+        '''
+        returns the new limit
+        '''
+        congested = iowait > self.max_iowait or load > self.max_load
+        if self.increased and previous is not None and throughput < previous:
+            # the last increase did not help
+            congested = True
+
+        if congested:
+            return max(self.minimum, int(self.limit * self.decrease_factor))
+        if saturated:
+            return min(self.maximum, self.limit + 1)
+        return self.limit
+
+
+    def _readcpustats(self):
+        '''
+        returns (iowait, total) CPU time from /proc/stat
+        '''
+        try:
+            f = open('/proc/stat')
+            try:
+                fields = f.readline().split()[1:]
+            finally:
+                f.close()
+            values = [int(field) for field in fields]
+            return values[4], sum(values)
+        except Exception, ex:
+            self.log.warning('cannot read /proc/stat: %s' %ex)
+            return 0, 0
+
+
+    def _iowait(self, before, after):
+        '''
+        returns the fraction of CPU time waiting for I/O
+        between two reads of /proc/stat
+        '''
+        total = after[1] - before[1]
+        if total <= 0:
+            return 0.0
+        return float(after[0] - before[0]) / total
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread. Overriding this method required to handle Ctrl-C from console.
+        '''
+        self.stopevent.set()
+        self.wakeuppipe.wakeup()
+        self.log.debug('Stopping thread...')
+        threading.Thread.join(self, timeout)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+module with the control channel of the service,
+to ask for things to be done now, for example a snapshot,
+instead of waiting for the next cycle
+"""
+
+import BaseHTTPServer
+import httplib
+import json
+import logging
+import os
+import socket
+import SocketServer
+import threading
+import urllib
+import urlparse
+
+
+# =============================================================================
+class ControlHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    requests accepted:
+
+        POST /replicate/<repository>[?preempt=1]
+            starts a cycle for the repository now,
+            and queues its request with the priority for triggered requests.
+            With preempt=1, if all agents are busy, the running snapshot
+            with the lowest priority is stopped to free its slot,
+            and queued again later.
+
+        GET /queue
+            lists the requests running and pending, with their wait times
+
+        POST /priority/<repository>/<priority>
+            changes the priority of the pending request for the repository
+
+        POST /cancel/<repository>
+            removes the pending request for the repository from the queue
+    """
+
+    def _parse(self):
+        '''
+        returns the parts of the path, and the query string parameters
+        '''
+        url = urlparse.urlsplit(self.path)
+        parts = [urllib.unquote(part) for part in url.path.strip('/').split('/')]
+        return parts, urlparse.parse_qs(url.query)
+
+    def do_GET(self):
+        parts, query = self._parse()
+        if parts == ['queue']:
+            self._reply(200, self.server.manager.replicarequestqueue.requests())
+        else:
+            self._reply(404, {'error': 'unknown request %s' %self.path})
+
+    def do_POST(self):
+        parts, query = self._parse()
+        if len(parts) == 2 and parts[0] == 'replicate':
+            preempt = query.get('preempt', ['0'])[0].lower() in ('1', 'true', 'yes')
+            self._replicate(parts[1], preempt)
+        elif len(parts) == 3 and parts[0] == 'priority':
+            self._priority(parts[1], parts[2])
+        elif len(parts) == 2 and parts[0] == 'cancel':
+            self._cancel(parts[1])
+        else:
+            self._reply(404, {'error': 'unknown request %s' %self.path})
+
+    def _replicate(self, repositoryname, preempt=False):
+        repository = self.server.manager.getrepository(repositoryname)
+        if repository is None:
+            self._reply(404, {'error': 'unknown repository %s' %repositoryname})
+            return
+        state = repository.trigger(self.server.manager.service.controlpriority, preempt)
+        self.server.log.info('replication of repository %s requested: %s' %(repositoryname, state))
+        self._reply(202, {'repository': repositoryname, 'state': state})
+
+    def _priority(self, repositoryname, priority):
+        try:
+            priority = int(priority)
+        except ValueError:
+            self._reply(400, {'error': 'wrong priority %s' %priority})
+            return
+        changed = self.server.manager.replicarequestqueue.reprioritize(repositoryname, priority)
+        if not changed:
+            self._reply(404, {'error': 'no pending request for repository %s' %repositoryname})
+            return
+        self.server.log.info('priority of repository %s changed to %s' %(repositoryname, priority))
+        self._reply(200, {'repository': repositoryname, 'priority': priority})
+
+    def _cancel(self, repositoryname):
+        cancelled = self.server.manager.replicarequestqueue.cancel(repositoryname)
+        if not cancelled:
+            self._reply(404, {'error': 'no pending request for repository %s' %repositoryname})
+            return
+        self.server.log.info('pending request for repository %s cancelled' %repositoryname)
+        self._reply(200, {'repository': repositoryname, 'state': 'cancelled'})
+
+    def _reply(self, code, content):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # changes are logged by the methods handling them
+        pass
+
+
+class HTTPControlServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixControlServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+
+
+# =============================================================================
+#       CLASS CONTROL SERVER
+# =============================================================================
+
+class ControlServer(threading.Thread):
+    """
+    class to serve the control channel, HTTP,
+    either on a local TCP address or on a UNIX socket.
+    """
+
+    def __init__(self, manager, address):
+        """
+        manager is the ReplicaManager( ) object
+        address is either http://<host>:<port> or unix://<path>
+        """
+        threading.Thread.__init__(self) # init the thread
+        self.setDaemon(True)
+        self.log = logging.getLogger('cvmfsreplica.controlserver')
+
+        if address.startswith('unix://'):
+            self.server = UnixControlServer(address[7:], ControlHandler)
+        else:
+            if address.startswith('http://'):
+                address = address[7:]
+            host, port = address.rstrip('/').rsplit(':', 1)
+            self.server = HTTPControlServer((host, int(port)), ControlHandler)
+        self.server.manager = manager
+        self.server.log = self.log
+        self.log.info('serving control channel on %s' %address)
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+        self.server.serve_forever()
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread.
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+        threading.Thread.join(self, timeout)
+
+
+# =============================================================================
+#       CLIENT
+# =============================================================================
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    '''
+    HTTP connection over a UNIX socket
+    '''
+
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class ControlClient(object):
+    """
+    class to send requests to the control channel of a running service
+    """
+
+    def __init__(self, address, timeout=30):
+        """
+        address is either http://<host>:<port> or unix://<path>
+        """
+        self.address = address
+        self.timeout = timeout
+
+
+    def _connection(self):
+        if self.address.startswith('unix://'):
+            return UnixHTTPConnection(self.address[7:], self.timeout)
+        address = self.address
+        if address.startswith('http://'):
+            address = address[7:]
+        return httplib.HTTPConnection(address.rstrip('/'), timeout=self.timeout)
+
+
+    def request(self, method, path):
+        '''
+        returns the HTTP status code, and the content of the answer
+        '''
+        conn = self._connection()
+        try:
+            conn.request(method, path)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+
+    def replicate(self, repositoryname, preempt=False):
+        path = '/replicate/%s' %urllib.quote(repositoryname)
+        if preempt:
+            path += '?preempt=1'
+        return self.request('POST', path)
+
+    def queue(self):
+        return self.request('GET', '/queue')
+
+    def priority(self, repositoryname, priority):
+        return self.request('POST', '/priority/%s/%s' %(urllib.quote(repositoryname), priority))
+
+    def cancel(self, repositoryname):
+        return self.request('POST', '/cancel/%s' %urllib.quote(repositoryname))
@@ -45,3 +45,14 @@ class AcceptancePluginFailed(Exception):
         self.value = value
     def __str__(self):
         return repr(self.value)
+
+
+class HTTPRequestFailure(Exception):
+    """
+    Exception to be raised when an HTTP request
+    does not return the expected content
+    """
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
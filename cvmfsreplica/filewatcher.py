@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+"""
+module with the cache of the local files of the repositories,
+read again only when they change
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+
+from cvmfsreplica.utils import WakeupPipe, date2seconds, get_revision
+
+
+# inotify constants, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+# a file in a watched directory may have changed
+IN_CHANGED = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT = struct.Struct('iIII')
+
+
+def readrevision(f):
+    '''
+    parser for .cvmfspublished files
+    '''
+    return get_revision(f)
+
+
+def readtimestamp(f):
+    '''
+    parser for .cvmfs_last_snapshot files
+    '''
+    return date2seconds(f.readline().strip())
+
+
+class Inotify(object):
+    '''
+    minimal interface to the inotify API of Linux, with ctypes.
+    Raises OSError if it is not available.
+    '''
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError), ex:
+            raise OSError(errno.ENOSYS, 'inotify not available: %s' %ex)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, path, mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, '%s: %s' %(os.strerror(error), path))
+        return wd
+
+    def read(self):
+        '''
+        returns the list of (wd, mask, name) events available
+        '''
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError, ex:
+            if ex.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip('\0')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Entry(object):
+    '''
+    cached content of one file
+    '''
+    __slots__ = ('parser', 'callbacks', 'value', 'error', 'stamp', 'dirty', 'watched')
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.callbacks = []
+        self.value = None
+        self.error = None
+        # (st_ino, st_size, st_mtime) when it was read
+        self.stamp = None
+        # True if it has to be read again
+        self.dirty = True
+        # True if inotify watches its directory
+        self.watched = False
+
+
+# =============================================================================
+#       CLASS FILE WATCHER
+# =============================================================================
+
+class FileWatcher(threading.Thread):
+    """
+    class to keep in memory the values parsed from small local files,
+    like .cvmfspublished or .cvmfs_last_snapshot,
+    so they are read again only after they change.
+
+        -- with inotify, the directory of each file is watched,
+           and a file is read again only after an event for it.
+
+        -- when inotify is not available, or runs out of watches,
+           a file is read again only if its inode, size
+           or modification time are different.
+
+    Changes are noticed even if they are done outside the service,
+    for example a snapshot run by hand.
+    Functions registered with a file are called with the new value
+    when it changes: right away with inotify, or
+    every poll interval seconds otherwise.
+    """
+
+    def __init__(self, pollinterval=60, useinotify=True):
+        """
+        pollinterval is how often, in seconds, the files
+        not watched by inotify, and with callbacks, are checked
+        useinotify is False to always use os.stat()
+        """
+        threading.Thread.__init__(self) # init the thread
+        self.log = logging.getLogger('cvmfsreplica.filewatcher')
+        self.stopevent = threading.Event()
+        self.wakeuppipe = WakeupPipe()
+        self.lock = threading.Lock()
+        self.pollinterval = pollinterval
+
+        # path -> _Entry
+        self.entries = {}
+        # watch descriptor -> directory, and directory -> watch descriptor
+        self.directories = {}
+        self.descriptors = {}
+        # number of times a file has been read, for the record
+        self.nreads = 0
+
+        self.inotify = None
+        if useinotify:
+            try:
+                self.inotify = Inotify()
+            except OSError, ex:
+                self.log.warning('%s. Checking the files with os.stat()' %ex)
+
+
+    def watch(self, path, parser, callback=None):
+        '''
+        starts keeping the value of file path,
+        as returned by parser(open file).
+        If callback is given, callback(value) is called
+        every time the value changes.
+        '''
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(path)
+            if entry is None:
+                entry = _Entry(parser)
+                entry.watched = self._watchdirectory(os.path.dirname(path))
+                self.entries[path] = entry
+            if callback is not None and callback not in entry.callbacks:
+                entry.callbacks.append(callback)
+        finally:
+            self.lock.release()
+
+
+    def unwatch(self, path, callback=None):
+        '''
+        stops calling callback when the value of file path changes.
+        The value is not kept anymore once no callback is left.
+        '''
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(path)
+            if entry is None:
+                return
+            if callback in entry.callbacks:
+                entry.callbacks.remove(callback)
+            if not entry.callbacks:
+                del self.entries[path]
+        finally:
+            self.lock.release()
+
+
+    def _watchdirectory(self, directory):
+        '''
+        adds an inotify watch for a directory, if not there already.
+        Returns False if it could not be done.
+        Must be called with the lock acquired.
+        '''
+        if self.inotify is None:
+            return False
+        if directory in self.descriptors:
+            return True
+        try:
+            wd = self.inotify.add_watch(directory, IN_CHANGED)
+        except OSError, ex:
+            self.log.warning('failed to watch directory %s: %s. Checking its files with os.stat()' %(directory, ex))
+            return False
+        self.directories[wd] = directory
+        self.descriptors[directory] = wd
+        return True
+
+
+    def get(self, path, parser=None):
+        '''
+        returns the value of file path, reading it only if it changed.
+        If the file could not be read, or parsed, the exception is raised.
+        If path is not being watched yet, parser is required.
+        '''
+        if path not in self.entries:
+            self.watch(path, parser)
+        entry = self.entries[path]
+        self.lock.acquire()
+        try:
+            # events not seen yet by the thread,
+            # so a file just written is never read old
+            if self.inotify:
+                self._readevents()
+            self._refresh(path, entry)
+            error, value = entry.error, entry.value
+        finally:
+            self.lock.release()
+        if error is not None:
+            raise error
+        return value
+
+
+    def _refresh(self, path, entry):
+        '''
+        reads the file again if it may have changed.
+        Returns True if its value changed.
+        Must be called with the lock acquired.
+        '''
+        if entry.watched and not entry.dirty:
+            return False
+        try:
+            st = os.stat(path)
+            stamp = (st.st_ino, st.st_size, st.st_mtime)
+        except OSError, ex:
+            stamp = None
+        if not entry.dirty and stamp is not None and stamp == entry.stamp:
+            return False
+
+        # an event arriving from now on marks it dirty again
+        entry.dirty = False
+        previous = entry.value
+        try:
+            f = open(path)
+            try:
+                self.nreads += 1
+                entry.value = entry.parser(f)
+                entry.error = None
+            finally:
+                f.close()
+        except Exception, ex:
+            entry.value = None
+            entry.error = ex
+        entry.stamp = stamp
+        return entry.value != previous
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+        self.log.debug('starting FileWatcher thread main loop...')
+        while not self.stopevent.isSet():
+            fds = [self.wakeuppipe]
+            if self.inotify:
+                fds.append(self.inotify)
+            ready = select.select(fds, [], [], self.pollinterval)[0]
+            if self.wakeuppipe in ready:
+                self.wakeuppipe.clear()
+            if self.inotify in ready:
+                self.lock.acquire()
+                try:
+                    self._readevents()
+                finally:
+                    self.lock.release()
+            self._notify()
+
+
+    def _readevents(self):
+        '''
+        marks as dirty the files with an inotify event.
+        Must be called with the lock acquired.
+        '''
+        for wd, mask, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self.log.warning('inotify queue overflow. All files will be read again')
+                for entry in self.entries.values():
+                    entry.dirty = True
+                continue
+            directory = self.directories.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # the directory is gone
+                del self.directories[wd]
+                del self.descriptors[directory]
+                for path, entry in self.entries.items():
+                    if os.path.dirname(path) == directory:
+                        entry.watched = False
+                        entry.dirty = True
+                continue
+            entry = self.entries.get(os.path.join(directory, name))
+            if entry is not None:
+                entry.dirty = True
+
+
+    def _notify(self):
+        '''
+        reads the files with callbacks that may have changed,
+        and calls the callbacks if their value is different
+        '''
+        for path, entry in self.entries.items():
+            if not entry.callbacks:
+                continue
+            self.lock.acquire()
+            try:
+                changed = self._refresh(path, entry) and entry.error is None
+            finally:
+                self.lock.release()
+            if changed:
+                for callback in entry.callbacks:
+                    try:
+                        callback(entry.value)
+                    except Exception, ex:
+                        self.log.error('callback for file %s raised an exception: %s' %(path, ex))
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread. Overriding this method required to handle Ctrl-C from console.
+        '''
+        self.stopevent.set()
+        self.wakeuppipe.wakeup()
+        self.log.debug('Stopping thread...')
+        threading.Thread.join(self, timeout)
+        if self.inotify:
+            self.inotify.close()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+module with the free disk space, shared by all repositories
+"""
+
+import logging
+import os
+import threading
+import time
+
+
+# =============================================================================
+#       CLASS FREE SPACE CACHE
+# =============================================================================
+
+class FreeSpaceCache(object):
+    """
+    class to know the free space in the filesystems
+    hosting the directories of the repositories,
+    with as few calls to os.statvfs() as possible:
+
+        -- paths are grouped by filesystem, using st_dev,
+           so all repositories in the same filesystem
+           share one single value.
+
+        -- the value from os.statvfs() is reused for ttl seconds.
+
+        -- space can be reserved, for a snapshot that has been
+           accepted but not finished yet, so it is not counted as free.
+           When the snapshot is done, its reservations are released
+           and the value for the filesystem is read again.
+    """
+
+    def __init__(self, ttl=10):
+        """
+        ttl is, in seconds, for how long
+        a value from os.statvfs() is valid
+        """
+        self.log = logging.getLogger('cvmfsreplica.freespacecache')
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # path -> st_dev
+        self.devices = {}
+        # st_dev -> (time, free bytes)
+        self.values = {}
+        # owner -> {st_dev: reserved bytes}
+        self.reservations = {}
+        # number of calls to os.statvfs(), for the record
+        self.nstatvfs = 0
+
+
+    def _device(self, path):
+        if path not in self.devices:
+            self.devices[path] = os.stat(path).st_dev
+        return self.devices[path]
+
+
+    def _free(self, path, now):
+        '''
+        free space in the filesystem hosting path,
+        minus the space reserved in it.
+        Must be called with the lock acquired.
+        '''
+        device = self._device(path)
+        value = self.values.get(device)
+        if value is None or now - value[0] > self.ttl:
+            stats = os.statvfs(path)
+            self.nstatvfs += 1
+            value = (now, stats.f_frsize * stats.f_bfree)
+            self.values[device] = value
+        reserved = 0
+        for reservation in self.reservations.values():
+            reserved += reservation.get(device, 0)
+        return value[1] - reserved
+
+
+    def free(self, path):
+        '''
+        returns the free space, in bytes, in the filesystem hosting path,
+        not counting the space reserved
+        '''
+        self.lock.acquire()
+        try:
+            return self._free(path, time.time())
+        finally:
+            self.lock.release()
+
+
+    def claim(self, path, nbytes, owner):
+        '''
+        checks if the free space in the filesystem hosting path,
+        not counting the space reserved, is larger than nbytes.
+        If so, nbytes are reserved for owner, until release(owner).
+        Returns True or False, and the free space.
+        '''
+        self.lock.acquire()
+        try:
+            free = self._free(path, time.time())
+            if free <= nbytes:
+                return False, free
+            device = self._device(path)
+            reservation = self.reservations.setdefault(owner, {})
+            reservation[device] = reservation.get(device, 0) + nbytes
+            return True, free
+        finally:
+            self.lock.release()
+
+
+    def release(self, owner, written=True):
+        '''
+        releases all space reserved for owner.
+        If written is True, the values for those filesystems
+        are read again next time, since what the snapshot 
+        really used is already on disk.
+        '''
+        self.lock.acquire()
+        try:
+            reservation = self.reservations.pop(owner, {})
+            if written:
+                for device in reservation:
+                    self.values.pop(device, None)
+        finally:
+            self.lock.release()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+module with the persistent record of all snapshot attempts
+"""
+
+import errno
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+
+def percentile(values, p):
+    '''
+    returns the p-th percentile (0 < p <= 100)
+    of a list of values, using the nearest-rank method,
+    or None if the list is empty
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    rank = max(1, min(rank, len(values)))
+    return values[rank - 1]
+
+
+# =============================================================================
+#       CLASS SNAPSHOT HISTORY
+# =============================================================================
+
+class SnapshotHistory(object):
+    """
+    class to record every snapshot attempt in a SQLite database,
+    and to query statistics from it.
+
+    Each attempt records:
+        -- repository name
+        -- start time, in seconds since EPOCH
+        -- duration, in seconds
+        -- trial number
+        -- return code
+        -- whether it timed out
+    """
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS snapshots (
+               repository TEXT NOT NULL,
+               start REAL NOT NULL,
+               duration REAL NOT NULL,
+               trial INTEGER NOT NULL,
+               rc INTEGER,
+               timedout INTEGER NOT NULL
+           )''',
+        '''CREATE INDEX IF NOT EXISTS snapshots_start
+               ON snapshots (start)''',
+        '''CREATE INDEX IF NOT EXISTS snapshots_repository_start
+               ON snapshots (repository, start)''',
+    ]
+
+    def __init__(self, path, readonly=False):
+        """
+        path is the database file
+        readonly is True to only query an existing database,
+        which is never created nor modified
+        """
+        self.log = logging.getLogger('cvmfsreplica.snapshothistory')
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            if not os.path.isfile(path):
+                raise IOError(errno.ENOENT, 'database file %s does not exist' %path)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute('PRAGMA query_only = ON')
+            return
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # one connection shared by all threads,
+        # protected by a lock
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock.acquire()
+        try:
+            for statement in self.SCHEMA:
+                self.conn.execute(statement)
+            self.conn.commit()
+        finally:
+            self.lock.release()
+
+
+    def record(self, repository, start, duration, trial, rc, timedout):
+        '''
+        records one snapshot attempt
+        '''
+        self.lock.acquire()
+        try:
+            self.conn.execute('INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?)',
+                              (repository, start, duration, trial, rc, int(bool(timedout))))
+            self.conn.commit()
+        finally:
+            self.lock.release()
+
+
+    def attempts(self, since=None, until=None, repository=None):
+        '''
+        returns the list of attempts, as tuples
+            (repository, start, duration, trial, rc, timedout)
+        started in the time window [since, until),
+        optionally only for one repository
+        '''
+        conditions, args = self._conditions(since, until, repository)
+        query = 'SELECT repository, start, duration, trial, rc, timedout FROM snapshots'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY start'
+        return self._query(query, args)
+
+
+    def _conditions(self, since, until, repository):
+        '''
+        returns the list of SQL conditions, and their arguments,
+        to select the attempts in the time window [since, until),
+        optionally only for one repository
+        '''
+        conditions = []
+        args = []
+        if since is not None:
+            conditions.append('start >= ?')
+            args.append(since)
+        if until is not None:
+            conditions.append('start < ?')
+            args.append(until)
+        if repository is not None:
+            conditions.append('repository = ?')
+            args.append(repository)
+        return conditions, args
+
+
+    def _query(self, query, args):
+        self.lock.acquire()
+        try:
+            return self.conn.execute(query, args).fetchall()
+        finally:
+            self.lock.release()
+
+
+    def stats(self, since=None, until=None, repository=None):
+        '''
+        returns a dictionary, with one entry per repository,
+        with the statistics of the attempts in the time window:
+            -- attempts: number of attempts
+            -- failures: number of failed attempts
+            -- timeouts: number of attempts that timed out
+            -- failurerate: failures / attempts
+            -- p50, p95: percentiles of the duration of the attempts
+            -- throughput: successful snapshots per hour
+        The counts are done by the database, 
+        so the attempts are never all loaded in memory.
+        '''
+        if until is None:
+            until = time.time()
+
+        conditions, args = self._conditions(since, until, repository)
+        where = ''
+        if conditions:
+            where = ' WHERE ' + ' AND '.join(conditions)
+        query = ('SELECT repository, COUNT(*), '
+                 'SUM(CASE WHEN rc = 0 THEN 0 ELSE 1 END), '
+                 'SUM(timedout), MIN(start) '
+                 'FROM snapshots' + where + ' GROUP BY repository')
+
+        out = {}
+        for name, attempts, failures, timeouts, first in self._query(query, args):
+            if since is not None:
+                window = until - since
+            else:
+                window = until - first
+            successes = attempts - failures
+            throughput = None
+            if window > 0:
+                throughput = successes * 3600.0 / window
+            out[name] = {'attempts': attempts,
+                         'failures': failures,
+                         'timeouts': timeouts,
+                         'failurerate': float(failures) / attempts,
+                         'p50': self._percentile(conditions, args, name, attempts, 50),
+                         'p95': self._percentile(conditions, args, name, attempts, 95),
+                         'throughput': throughput}
+        return out
+
+
+    def _percentile(self, conditions, args, name, n, p):
+        '''
+        returns the p-th percentile of the duration of the n attempts 
+        of repository name selected by conditions,
+        with the same nearest-rank method as percentile( )
+        '''
+        rank = int(math.ceil(p / 100.0 * n))
+        rank = max(1, min(rank, n))
+        query = ('SELECT duration FROM snapshots WHERE ' + 
+                 ' AND '.join(conditions + ['repository = ?']) + 
+                 ' ORDER BY duration LIMIT 1 OFFSET ?')
+        return self._query(query, args + [name, rank - 1])[0][0]
+
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.conn.close()
+        finally:
+            self.lock.release()
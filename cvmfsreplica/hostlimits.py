@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+module with the limits for the snapshots
+of repositories from the same Stratum-0 host
+"""
+
+import logging
+import time
+
+
+# =============================================================================
+#       CLASS TOKEN BUCKET
+# =============================================================================
+
+class TokenBucket(object):
+    """
+    class to limit how often something can start.
+    Tokens are added at a constant rate, up to burst tokens.
+    Each start takes one token.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        rate is the number of tokens added per second
+        burst is the maximum number of tokens
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait(self, now):
+        '''
+        returns how many seconds until the next token is available
+        '''
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# =============================================================================
+#       CLASS HOST LIMITS
+# =============================================================================
+
+class HostLimits(object):
+    """
+    class to keep, per Stratum-0 host,
+    the number of snapshots running,
+    and to decide if a new one can start.
+
+    Each host can have:
+        -- a maximum number of snapshots running at the same time
+        -- a maximum rate of snapshots starting, as a token bucket
+
+    This class is not thread safe.
+    It is used while holding the lock of the ReplicaRequestQueue.
+    """
+
+    def __init__(self, maxconcurrent=None, rate=None, burst=1, overrides={}):
+        """
+        maxconcurrent, rate and burst are the limits for all hosts.
+        rate is in snapshots per second.
+        None means no limit.
+        overrides is a dictionary host -> (maxconcurrent, rate, burst)
+        with the limits for specific hosts.
+        """
+        self.log = logging.getLogger('cvmfsreplica.hostlimits')
+        self.default = (maxconcurrent, rate, burst)
+        self.overrides = overrides
+        self.running = {}
+        self.buckets = {}
+
+
+    def _limits(self, host):
+        return self.overrides.get(host, self.default)
+
+
+    def _bucket(self, host):
+        if host not in self.buckets:
+            maxconcurrent, rate, burst = self._limits(host)
+            if rate:
+                self.buckets[host] = TokenBucket(rate, burst)
+            else:
+                self.buckets[host] = None
+        return self.buckets[host]
+
+
+    def wait(self, host, now):
+        '''
+        returns 0 if a snapshot for the host can start now,
+        the number of seconds until it can start, if it is
+        only waiting for the rate limit, or None if there are
+        too many snapshots running for that host
+        '''
+        if host is None:
+            return 0
+        maxconcurrent = self._limits(host)[0]
+        if maxconcurrent and self.running.get(host, 0) >= maxconcurrent:
+            return None
+        bucket = self._bucket(host)
+        if bucket:
+            return bucket.wait(now)
+        return 0
+
+
+    def start(self, host, now):
+        '''
+        records a snapshot started for the host
+        '''
+        if host is None:
+            return
+        self.running[host] = self.running.get(host, 0) + 1
+        bucket = self._bucket(host)
+        if bucket:
+            bucket.take(now)
+
+
+    def finish(self, host):
+        '''
+        records a snapshot finished for the host
+        '''
+        if host is None:
+            return
+        self.running[host] -= 1
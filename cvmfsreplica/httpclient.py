@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+module with the HTTP client shared by all repositories
+to read the .cvmfspublished files from the Stratum-0 servers
+"""
+
+import httplib
+import logging
+import socket
+import threading
+import urlparse
+
+import cvmfsreplica.utils as utils
+from cvmfsreplica.cvmfsreplicaex import HTTPRequestFailure
+
+
+# =============================================================================
+#       CLASS HTTP CLIENT
+# =============================================================================
+
+class HTTPClient(object):
+    """
+    class to perform HTTP requests with:
+
+        -- a pool of keep-alive connections per host.
+           Connections are taken from the pool by one thread
+           at a time, and returned once the response
+           has been completely read.
+
+        -- explicit timeouts to connect and to read.
+
+        -- conditional requests. The ETag and Last-Modified
+           headers of each URL are recorded, so next time
+           the server can answer 304 Not Modified
+           and neither the transfer nor the parsing are needed.
+    """
+
+    # size of the blocks read from the responses
+    CHUNK = 1024
+
+    # if the rest of the body is not larger than this,
+    # it is read so the connection can be reused.
+    # Otherwise, the connection is closed.
+    DRAIN_LIMIT = 65536
+
+    def __init__(self, connect_timeout=10, read_timeout=30, maxidle=4):
+        """
+        connect_timeout and read_timeout are in seconds.
+        maxidle is the maximum number of idle connections
+        kept in the pool for each host.
+        """
+
+        self.log = logging.getLogger('cvmfsreplica.httpclient')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.maxidle = maxidle
+
+        # (scheme, netloc) -> list of idle connections
+        self.pools = {}
+        # url -> (etag, last-modified, revision)
+        self.validators = {}
+        self.lock = threading.Lock()
+
+
+    def getrevision(self, url):
+        '''
+        returns the revision number from the .cvmfspublished file at url.
+        If the file did not change since the last request,
+        the revision from that request is returned.
+        '''
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(url)
+        if query:
+            path = '%s?%s' %(path, query)
+        key = (scheme, netloc)
+
+        headers = {}
+        self.lock.acquire()
+        try:
+            validators = self.validators.get(url)
+        finally:
+            self.lock.release()
+        if validators:
+            etag, lastmodified, revision = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if lastmodified:
+                headers['If-Modified-Since'] = lastmodified
+
+        conn, reused = self._getconnection(key)
+        try:
+            response = self._request(conn, path, headers)
+        except (httplib.HTTPException, socket.error), ex:
+            conn.close()
+            if not reused:
+                raise
+            # the server may have closed the idle connection,
+            # let's try once with a new one
+            self.log.debug('request to reused connection for %s failed: %s. Trying again' %(url, ex))
+            conn, reused = self._getconnection(key, new=True)
+            response = self._request(conn, path, headers)
+
+        try:
+            if response.status == httplib.NOT_MODIFIED and validators:
+                self.log.debug('%s not modified' %url)
+                revision = validators[2]
+            elif response.status == httplib.OK:
+                revision = utils.get_revision(self._iterlines(response))
+                if revision is None:
+                    raise HTTPRequestFailure('no revision number in %s' %url)
+                self.lock.acquire()
+                try:
+                    self.validators[url] = (response.getheader('etag'),
+                                            response.getheader('last-modified'),
+                                            revision)
+                finally:
+                    self.lock.release()
+            else:
+                raise HTTPRequestFailure('request to %s returned status %s' %(url, response.status))
+        except:
+            conn.close()
+            raise
+        self._release(key, conn, response)
+        return revision
+
+
+    def _request(self, conn, path, headers):
+        '''
+        sends the GET request, and returns the response object
+        '''
+        if conn.sock is None:
+            conn.connect()
+            conn.sock.settimeout(self.read_timeout)
+        conn.request('GET', path, headers=headers)
+        return conn.getresponse()
+
+
+    def _iterlines(self, response):
+        '''
+        yields the lines of the response body, as they are read
+        '''
+        buffer = ''
+        while True:
+            chunk = response.read(self.CHUNK)
+            if not chunk:
+                break
+            buffer += chunk
+            lines = buffer.split('\n')
+            buffer = lines.pop()
+            for line in lines:
+                yield line
+        if buffer:
+            yield buffer
+
+
+    def _getconnection(self, key, new=False):
+        '''
+        returns an idle connection for the host,
+        or a new one if there is none.
+        Also returns whether the connection is being reused.
+        '''
+        if not new:
+            self.lock.acquire()
+            try:
+                pool = self.pools.get(key)
+                if pool:
+                    return pool.pop(), True
+            finally:
+                self.lock.release()
+
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(netloc, timeout=self.connect_timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout=self.connect_timeout)
+        return conn, False
+
+
+    def _release(self, key, conn, response):
+        '''
+        puts the connection back in the pool, if it can be reused
+        '''
+        if not response.isclosed():
+            if response.length is not None and response.length <= self.DRAIN_LIMIT:
+                response.read()
+            else:
+                conn.close()
+                return
+        if response.will_close:
+            conn.close()
+            return
+
+        self.lock.acquire()
+        try:
+            pool = self.pools.setdefault(key, [])
+            if len(pool) < self.maxidle:
+                pool.append(conn)
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+
+    def close(self):
+        '''
+        closes all idle connections
+        '''
+        self.lock.acquire()
+        try:
+            for pool in self.pools.values():
+                for conn in pool:
+                    conn.close()
+            self.pools = {}
+        finally:
+            self.lock.release()
@@ -1,16 +1,23 @@
 class RepositoryPluginReportInterface(object):
 
-    def notifyfailure(self, custommsg=None):
+    # when True, one single instance is created for all repositories
+    # with the same report.<plugin>. options.
+    # It must not keep anything about the repository passed to __init__
+    shared = False
+
+    def notifyfailure(self, repository, custommsg=None):
         '''
         notifies/reports when things go wrong.
         For example, when the "cvmfs_server snapshot"
         command fails.
+        repository is the Repository object failing.
         '''
         raise NotImplementedError
 
-    def notifysuccess(self):
+    def notifysuccess(self, repository):
         '''
         notifies/reports when replication worked.
+        repository is the Repository object replicated.
         '''
         raise NotImplementedError
 
@@ -32,6 +39,15 @@ class RepositoryPluginAcceptanceInterface(object):
         raise NotImplementedError
 
 
+    def close(self):
+        '''
+        releases what the plugin registered in the services
+        shared by all repositories, like the FileWatcher.
+        It is called when the repository is removed.
+        '''
+        pass
+
+
 class RepositoryPluginPostInterface(object):
 
     def run(self):
@@ -41,3 +57,11 @@ class RepositoryPluginPostInterface(object):
         '''
         raise NotImplementedError
 
+    def wait(self):
+        '''
+        blocks until the actions started by run( )
+        are done, if they run in background.
+        It is called before the next replication starts.
+        '''
+        pass
+
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+module with the poller that reads the .cvmfspublished files
+of all repositories from the Stratum-0 servers
+"""
+
+import logging
+import Queue
+import threading
+import time
+import urlparse
+
+from cvmfsreplica.utils import WakeupPipe, WorkerPool
+
+
+# =============================================================================
+#       CLASS MANIFEST POLLER
+# =============================================================================
+
+class ManifestPoller(threading.Thread):
+    """
+    class to read, time to time, the remote .cvmfspublished
+    files of all repositories, and keep their revision numbers
+    in a cache.
+
+    Each sweep groups the URLs by host.
+    Hosts are polled concurrently, and the URLs of the same host
+    one after another, reusing the keep-alive connections
+    of the shared HTTPClient.
+
+    Entries in the cache are valid for some time (TTL).
+    When there is no valid entry for a URL, it is read on demand.
+    """
+
+    def __init__(self, httpclient, interval, ttl, nworkers=4):
+        """
+        httpclient is the HTTPClient( ) object to perform the requests
+        interval is the time, in seconds, between sweeps
+        ttl is the time, in seconds, an entry in the cache is valid
+        nworkers is the maximum number of hosts polled at the same time
+        """
+
+        threading.Thread.__init__(self) # init the thread
+        self.log = logging.getLogger('cvmfsreplica.manifestpoller')
+        self.stopevent = threading.Event()
+        self.wakeuppipe = WakeupPipe()
+
+        self.httpclient = httpclient
+        self.interval = interval
+        self.ttl = ttl
+        self.nworkers = nworkers
+
+        self.urls = []
+        # same URLs, to check quickly if one is already registered
+        self.registered = set()
+        # url -> (revision, time it was read)
+        self.cache = {}
+        self.lock = threading.Lock()
+
+
+    def register(self, url):
+        '''
+        adds a URL to the list to be polled
+        '''
+        self.lock.acquire()
+        try:
+            if url not in self.registered:
+                self.registered.add(url)
+                self.urls.append(url)
+        finally:
+            self.lock.release()
+
+
+    def unregister(self, url):
+        '''
+        removes a URL from the list to be polled, 
+        and its entry from the cache
+        '''
+        self.lock.acquire()
+        try:
+            if url in self.registered:
+                self.registered.discard(url)
+                self.urls.remove(url)
+            self.cache.pop(url, None)
+        finally:
+            self.lock.release()
+
+
+    def getrevision(self, url):
+        '''
+        returns the revision number for the .cvmfspublished file at url,
+        from the cache if the entry is still valid
+        '''
+        self.lock.acquire()
+        try:
+            entry = self.cache.get(url)
+        finally:
+            self.lock.release()
+        if entry and time.time() - entry[1] < self.ttl:
+            return entry[0]
+
+        self.log.debug('no valid entry in the cache for %s, reading it now' %url)
+        return self._fetch(url)
+
+
+    def _fetch(self, url):
+        '''
+        reads the revision number and records it in the cache
+        '''
+        revision = self.httpclient.getrevision(url)
+        self.lock.acquire()
+        try:
+            self.cache[url] = (revision, time.time())
+        finally:
+            self.lock.release()
+        return revision
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+
+        self.log.debug('starting ManifestPoller thread main loop...')
+        self.pool = WorkerPool(self.nworkers, 'manifestpoller')
+        while not self.stopevent.isSet():
+            self.log.trace('ManifestPoller loop')
+            before = time.time()
+            self._sweep()
+            delta = time.time() - before
+            self.log.debug('sweep done in %.3f seconds' %delta)
+            self.wakeuppipe.wait(max(self.interval - delta, 0))
+        self.pool.stop()
+
+
+    def _sweep(self):
+        '''
+        reads all registered URLs, grouped by host,
+        and waits for all of them to be done
+        '''
+        self.lock.acquire()
+        try:
+            urls = list(self.urls)
+        finally:
+            self.lock.release()
+
+        hosts = {}
+        for url in urls:
+            netloc = urlparse.urlsplit(url)[1]
+            hosts.setdefault(netloc, []).append(url)
+
+        done = Queue.Queue()
+        def poll(host, urls):
+            for url in urls:
+                if self.stopevent.isSet():
+                    break
+                try:
+                    self._fetch(url)
+                except Exception, ex:
+                    self.log.warning('failed to read %s: %s' %(url, ex))
+            done.put(host)
+
+        for host, urls in hosts.items():
+            self.pool.submit(poll, host, urls)
+        for host in hosts:
+            done.get()
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread. Overriding this method required to handle Ctrl-C from console.
+        '''
+        self.stopevent.set()
+        self.wakeuppipe.wakeup()
+        self.log.debug('Stopping thread...')
+        threading.Thread.join(self, timeout)
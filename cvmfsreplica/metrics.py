@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+"""
+module with the metrics of the service,
+and the endpoint to expose them in Prometheus text format
+"""
+
+import BaseHTTPServer
+import logging
+import os
+import SocketServer
+import threading
+
+
+# default buckets for histograms, in seconds
+BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    '''
+    converts a list of (name, value) into the {name="value",...} string
+    '''
+    if not labels:
+        return ''
+    return '{%s}' %','.join(['%s="%s"' %(name, _escape(value)) for name, value in labels])
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+# =============================================================================
+#       CLASS METRICS
+# =============================================================================
+
+class Metrics(object):
+    """
+    class to keep the metrics of the service:
+
+        -- counters, increased with inc( )
+        -- histograms, updated with observe( )
+        -- gauges, whose values are read when the metrics
+           are rendered, by the functions registered with addcollector( )
+
+    Every metric must be described first with describe( ).
+    Labels are passed as dictionaries.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help, buckets)
+        self.descriptions = {}
+        # name -> {labels: value}
+        self.counters = {}
+        # name -> {labels: [counts per bucket, sum, count]}
+        self.histograms = {}
+        self.collectors = []
+
+
+    def describe(self, name, type, help, buckets=BUCKETS):
+        '''
+        type is "counter", "gauge" or "histogram"
+        buckets is only used for histograms
+        '''
+        self.lock.acquire()
+        try:
+            self.descriptions[name] = (type, help, buckets)
+            if type == 'counter':
+                self.counters.setdefault(name, {})
+            elif type == 'histogram':
+                self.histograms.setdefault(name, {})
+        finally:
+            self.lock.release()
+
+
+    def inc(self, name, labels={}, value=1):
+        key = tuple(sorted(labels.items()))
+        self.lock.acquire()
+        try:
+            counter = self.counters[name]
+            counter[key] = counter.get(key, 0) + value
+        finally:
+            self.lock.release()
+
+
+    def observe(self, name, value, labels={}):
+        key = tuple(sorted(labels.items()))
+        self.lock.acquire()
+        try:
+            buckets = self.descriptions[name][2]
+            histogram = self.histograms[name]
+            if key not in histogram:
+                histogram[key] = [[0] * len(buckets), 0.0, 0]
+            entry = histogram[key]
+            for i in range(len(buckets)):
+                if value <= buckets[i]:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+        finally:
+            self.lock.release()
+
+
+    def addcollector(self, collector):
+        '''
+        collector() must return a list of (name, labels, value)
+        for gauges, evaluated each time the metrics are rendered
+        '''
+        self.collectors.append(collector)
+
+
+    def render(self):
+        '''
+        returns all metrics in Prometheus text format
+        '''
+        gauges = {}
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+            except Exception, ex:
+                logging.getLogger('cvmfsreplica.metrics').error('metrics collector failed: %s' %ex)
+
+        lines = []
+        self.lock.acquire()
+        try:
+            for name in sorted(self.descriptions.keys()):
+                type, help, buckets = self.descriptions[name]
+                lines.append('# HELP %s %s' %(name, help))
+                lines.append('# TYPE %s %s' %(name, type))
+                if type == 'counter':
+                    for key, value in sorted(self.counters[name].items()):
+                        lines.append('%s%s %s' %(name, _labels(key), _number(value)))
+                elif type == 'gauge':
+                    for key, value in sorted(gauges.get(name, [])):
+                        lines.append('%s%s %s' %(name, _labels(key), _number(value)))
+                elif type == 'histogram':
+                    for key, (counts, sum, count) in sorted(self.histograms[name].items()):
+                        for le, n in zip(buckets, counts):
+                            lines.append('%s_bucket%s %s' %(name, _labels(key + (('le', _number(le)),)), n))
+                        lines.append('%s_bucket%s %s' %(name, _labels(key + (('le', '+Inf'),)), count))
+                        lines.append('%s_sum%s %s' %(name, _labels(key), _number(sum)))
+                        lines.append('%s_count%s %s' %(name, _labels(key), count))
+        finally:
+            self.lock.release()
+        return '\n'.join(lines) + '\n'
+
+
+# =============================================================================
+#       CLASS METRICS SERVER
+# =============================================================================
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # requests are not logged
+        pass
+
+
+class HTTPMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixMetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+
+
+class MetricsServer(threading.Thread):
+    """
+    class to serve the metrics, in Prometheus text format,
+    either on a local TCP address or on a UNIX socket.
+    """
+
+    def __init__(self, metrics, address):
+        """
+        metrics is the Metrics( ) object
+        address is either http://<host>:<port> or unix://<path>
+        """
+        threading.Thread.__init__(self) # init the thread
+        self.setDaemon(True)
+        self.log = logging.getLogger('cvmfsreplica.metricsserver')
+
+        if address.startswith('unix://'):
+            self.server = UnixMetricsServer(address[7:], MetricsHandler)
+        else:
+            if address.startswith('http://'):
+                address = address[7:]
+            host, port = address.rstrip('/').rsplit(':', 1)
+            self.server = HTTPMetricsServer((host, int(port)), MetricsHandler)
+        self.server.metrics = metrics
+        self.log.info('serving metrics on %s' %address)
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+        self.server.serve_forever()
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread.
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+        threading.Thread.join(self, timeout)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+"""
+module with the thread that sends the email notifications
+"""
+
+import logging
+import smtplib
+import socket
+import threading
+import time
+try:
+    from email.mime.text import MIMEText
+except:
+    from email.MIMEText import MIMEText
+
+from cvmfsreplica.hostlimits import TokenBucket
+from cvmfsreplica.utils import WakeupPipe
+
+
+# =============================================================================
+#       CLASS EMAIL DISPATCHER
+# =============================================================================
+
+class EmailDispatcher(threading.Thread):
+    """
+    class to send, from one single thread, the emails
+    of the report plugins, so a slow or unreachable SMTP server
+    never delays the replicas.
+
+        -- messages for the same SMTP server and recipients,
+           submitted within window seconds of the first one,
+           are sent together, as one single digest email.
+
+        -- one SMTP connection per server is kept open, and reused,
+           until it has not been used for idle seconds.
+
+        -- optionally, no more than rate emails per minute are sent,
+           with up to burst at once.
+           Messages keep being added to the digest while waiting.
+    """
+
+    def __init__(self, window=60, rate=None, burst=1, idle=60, timeout=30):
+        """
+        window is, in seconds, how long messages are collected
+        before sending them
+        rate is the maximum number of emails per minute. None means no limit
+        idle is, in seconds, how long an unused SMTP connection is kept
+        timeout is, in seconds, the timeout for the SMTP connections
+        """
+        threading.Thread.__init__(self) # init the thread
+        self.log = logging.getLogger('cvmfsreplica.emaildispatcher')
+        self.stopevent = threading.Event()
+        self.wakeuppipe = WakeupPipe()
+        self.lock = threading.Lock()
+
+        self.window = window
+        self.bucket = None
+        if rate:
+            self.bucket = TokenBucket(rate / 60.0, burst)
+        self.idle = idle
+        self.timeout = timeout
+
+        # (smtp server, recipients) -> (time of the first message, [(repositoryname, text)])
+        self.pending = {}
+        # smtp server -> [SMTP object, last time used]
+        self.connections = {}
+        self.emailfrom = 'root@%s' %socket.gethostname()
+
+
+    def submit(self, smtpserver, recipients, repositoryname, text):
+        '''
+        queues a message. It does not block.
+        recipients is a comma separated list of addresses
+        '''
+        self.lock.acquire()
+        try:
+            key = (smtpserver, recipients)
+            if key not in self.pending:
+                self.pending[key] = (time.time(), [])
+            self.pending[key][1].append((repositoryname, text))
+        finally:
+            self.lock.release()
+        self.wakeuppipe.wakeup()
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+        self.log.debug('starting EmailDispatcher thread main loop...')
+        while not self.stopevent.isSet():
+            timeout = self._flush()
+            self.wakeuppipe.wait(timeout)
+        # whatever is still pending is sent before leaving
+        self._flush(force=True)
+        for smtpserver in self.connections.keys():
+            self._close(smtpserver)
+
+
+    def _flush(self, force=False):
+        '''
+        sends the messages whose window is over,
+        and closes the connections not used for a while.
+        Returns the number of seconds until there is something to do,
+        or None if there is nothing.
+        '''
+        now = time.time()
+        timeout = None
+        due = []
+        self.lock.acquire()
+        try:
+            for key, (first, messages) in self.pending.items():
+                wait = first + self.window - now
+                if wait <= 0 and not force and self.bucket:
+                    wait = self.bucket.wait(now)
+                    if wait == 0:
+                        self.bucket.take(now)
+                if force or wait <= 0:
+                    due.append((key, messages))
+                    del self.pending[key]
+                elif timeout is None or wait < timeout:
+                    timeout = wait
+        finally:
+            self.lock.release()
+
+        for (smtpserver, recipients), messages in due:
+            self._send(smtpserver, recipients, messages)
+
+        now = time.time()
+        for smtpserver, (smtp, lastused) in self.connections.items():
+            wait = lastused + self.idle - now
+            if wait <= 0:
+                self._close(smtpserver)
+            elif timeout is None or wait < timeout:
+                timeout = wait
+        return timeout
+
+
+    def _message(self, recipients, messages):
+        if len(messages) == 1:
+            subject = 'ALERT: CVMFS replica failed'
+            body = messages[0][1]
+        else:
+            names = []
+            for repositoryname, text in messages:
+                if repositoryname not in names:
+                    names.append(repositoryname)
+            subject = 'ALERT: CVMFS replica failed for %s repositories' %len(names)
+            body = 'Failures for repositories: %s\n\n' %', '.join(names)
+            body += '\n'.join([text for repositoryname, text in messages])
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = self.emailfrom
+        msg['To'] = recipients
+        return msg
+
+
+    def _send(self, smtpserver, recipients, messages):
+        msg = self._message(recipients, messages).as_string()
+        tolist = recipients.split(',')
+        self.log.info('Sending email with %s messages to %s: %s' %(len(messages), recipients, msg))
+        # a kept connection may have been closed by the server,
+        # so it is tried a second time with a new one
+        for attempt in (1, 2):
+            try:
+                smtp = self._connection(smtpserver)
+                smtp.sendmail(self.emailfrom, tolist, msg)
+                self.connections[smtpserver][1] = time.time()
+                return
+            except (smtplib.SMTPServerDisconnected, socket.error), ex:
+                self.log.warning('connection to SMTP server %s failed: %s' %(smtpserver, ex))
+                self._close(smtpserver)
+            except Exception, ex:
+                self.log.error('failed to send email to %s: %s' %(recipients, ex))
+                self._close(smtpserver)
+                return
+        self.log.error('failed to send email to %s' %recipients)
+
+
+    def _connection(self, smtpserver):
+        if smtpserver not in self.connections:
+            smtp = smtplib.SMTP(smtpserver, timeout=self.timeout)
+            self.connections[smtpserver] = [smtp, time.time()]
+        return self.connections[smtpserver][0]
+
+
+    def _close(self, smtpserver):
+        smtp, lastused = self.connections.pop(smtpserver, (None, None))
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread. Overriding this method required to handle Ctrl-C from console.
+        '''
+        self.stopevent.set()
+        self.wakeuppipe.wakeup()
+        self.log.debug('Stopping thread...')
+        threading.Thread.join(self, timeout)
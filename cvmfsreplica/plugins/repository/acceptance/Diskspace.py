@@ -5,7 +5,6 @@ import os
 
 from cvmfsreplica.cvmfsreplicaex import PluginConfigurationFailure, AcceptancePluginFailed
 from cvmfsreplica.interfaces import RepositoryPluginAcceptanceInterface
-from cvmfsreplica.utils import check_disk_space
 import cvmfsreplica.pluginsmanagement as pm
 
 
@@ -18,10 +17,10 @@ class Diskspace(RepositoryPluginAcceptanceInterface):
         try:
            self.spool_size = self.conf.getint('diskspace.spool_size')
            self.storage_size = self.conf.getint('diskspace.storage_size')
-           self.reportplugins = pm.readplugins(self.repository, 
-                                               'repository', 
-                                               'report', 
-                                               self.conf.namespace('acceptance.diskspace.', 
+           self.reportplugins = pm.readplugins(self.repository,
+                                               'repository',
+                                               'report',
+                                               self.conf.namespace('acceptance.diskspace.',
                                                                    exclude=True)
                                                )
         except:
@@ -31,47 +30,46 @@ class Diskspace(RepositoryPluginAcceptanceInterface):
         except:
             self.should_abort = True #Default
 
+        # free space shared by all repositories
+        self.freespace = self.repository.manager.freespace
         self.log.debug('plugin Diskspace initialized properly')
 
 
     def verify(self):
         '''
-        checks if there is enough space in disk 
+        checks if there is enough space in disk.
+        If so, the space is reserved until the snapshot is done,
+        so the other repositories do not count it as free
         '''
 
         try:
-            return self._check_storage() & self._check_storage()
+            spool = self._check_spool()
+            storage = self._check_storage()
         except Exception, ex:
+            self.freespace.release(self.repository.repositoryname, written=False)
             raise ex
+        if not (spool and storage):
+            self.freespace.release(self.repository.repositoryname, written=False)
+        return spool and storage
 
 
     def _check_spool(self):
-        # FIXME: too much duplicated code
-
         SPOOL_DIR = self.repository.cvmfsconf.get('CVMFS_SPOOL_DIR')
-        if check_disk_space(SPOOL_DIR, self.spool_size):
-            self.log.trace('There is enough disk space for SPOOL directory')
-            return True
-        else:
-            msg = 'There is not enough disk space for SPOOL. Requested=%s, available=%s' %(self.spool_size, current_free_size)
-            self._notify_failure(msg)
-            self.log.error(msg)
-            if self.should_abort:
-                self.log.error('Raising exception')
-                raise AcceptancePluginFailed(msg)
-            else:
-                return False
+        return self._check('SPOOL', SPOOL_DIR, self.spool_size)
 
 
     def _check_storage(self):
-        # FIXME: too much duplicated code
-
         STORAGE_DIR = self.repository.cvmfsconf.get('CVMFS_UPSTREAM_STORAGE').split(',')[1]
-        if check_disk_space(STORAGE_DIR, self.storage_size):
-            self.log.trace('There is enough disk space for STORAGE directory')
+        return self._check('STORAGE', STORAGE_DIR, self.storage_size)
+
+
+    def _check(self, name, directory, size):
+        ok, current_free_size = self.freespace.claim(directory, size, self.repository.repositoryname)
+        if ok:
+            self.log.trace('There is enough disk space for %s directory' %name)
             return True
         else:
-            msg = 'There is not enough disk space for STORAGE. Requested=%s, available=%s' %(self.storage_size, current_free_size)
+            msg = 'There is not enough disk space for %s. Requested=%s, available=%s' %(name, size, current_free_size)
             self._notify_failure(msg)
             self.log.error(msg)
             if self.should_abort:
@@ -80,10 +78,9 @@ class Diskspace(RepositoryPluginAcceptanceInterface):
             else:
                 return False
 
-    
+
     def _notify_failure(self, msg):
         for report in self.reportplugins:
-            report.notifyfailure(msg)
+            report.notifyfailure(self.repository, msg)
 
-        
 
@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 
+import errno
 import logging
-import os
-import urllib
 
 from cvmfsreplica.cvmfsreplicaex import PluginConfigurationFailure
+from cvmfsreplica.filewatcher import readrevision
 from cvmfsreplica.interfaces import RepositoryPluginAcceptanceInterface
 import cvmfsreplica.pluginsmanagement as pm
 
@@ -26,6 +26,13 @@ class Updatedserver(RepositoryPluginAcceptanceInterface):
 
         except:
             raise PluginConfigurationFailure('failed to initialize Updatedserver plugin')
+        self.manifestpoller = self.repository.manager.manifestpoller
+        if self.manifestpoller:
+            self.manifestpoller.register('%s/.cvmfspublished' %self.url)
+        # the local revision is only read again when the file changes
+        self.filewatcher = self.repository.manager.filewatcher
+        self.localfile = '%s/.cvmfspublished' %self.repository._get_cvmfs_upstream_storage()
+        self.filewatcher.watch(self.localfile, readrevision)
         self.log.debug('plugin Updatedserver initialized properly')
 
 
@@ -55,29 +62,31 @@ class Updatedserver(RepositoryPluginAcceptanceInterface):
         '''
         checks if the revision number in local copy of .cvmfspublished
         is different that the revision number of remote .cvmfspublished
+        The revision from the ManifestPoller can be older than the 
+        local one, right after a snapshot, so then it must be newer.
         '''
         try:
             # FIXME
             # maybe we should try a couple of times in case of failures before failing definitely
-            for line in urllib.urlopen('%s/.cvmfspublished' %self.url).readlines():
-                if line.startswith('S'):
-                    serverrevision = int(line[1:-1])
-                    break
+            if self.manifestpoller:
+                serverrevision = self.manifestpoller.getrevision('%s/.cvmfspublished' %self.url)
+            else:
+                httpclient = self.repository.manager.httpclient
+                serverrevision = httpclient.getrevision('%s/.cvmfspublished' %self.url)
 
             # read the local revision number
-            cvmfs_upstream_storage = self.repository._get_cvmfs_upstream_storage() # FIXME, this should not be here
-            localfile = '%s/.cvmfspublished' %cvmfs_upstream_storage
-            if not os.path.isfile(localfile):
-                self.log.warning('local file %s does not exist. Returning True' %localfile)
+            try:
+                localrevision = self.filewatcher.get(self.localfile, readrevision)
+            except IOError, ex:
+                if ex.errno != errno.ENOENT:
+                    raise
+                self.log.warning('local file %s does not exist. Returning True' %self.localfile)
                 return True
-            else:
-                # FIXME: too much duplicated code
-                for line in open(localfile):
-                    if line.startswith('S'):
-                        localrevision = int(line[1:-1])
-                        break
 
-            out = (serverrevision != localrevision)
+            if self.manifestpoller:
+                out = (serverrevision > localrevision)
+            else:
+                out = (serverrevision != localrevision)
             if out == False:
                 self._notify_failure('No new content at the server for repository %s' \
                                       %self.repository.repositoryname)
@@ -87,8 +96,16 @@ class Updatedserver(RepositoryPluginAcceptanceInterface):
             return False
 
 
+    def close(self):
+        '''
+        stops polling the server, and watching the local file
+        '''
+        if self.manifestpoller:
+            self.manifestpoller.unregister('%s/.cvmfspublished' %self.url)
+        self.filewatcher.unwatch(self.localfile)
+
 
     def _notify_failure(self, msg):
         for report in self.reportplugins:
-            report.notifyfailure(msg)
+            report.notifyfailure(self.repository, msg)
 
@@ -2,7 +2,19 @@
 
 import logging
 import os
-import subprocess 
+import Queue
+import stat
+import threading
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        # directories are read at once with os.listdir()
+        scandir = None
 
 from cvmfsreplica.cvmfsreplicaex import PluginConfigurationFailure
 from cvmfsreplica.interfaces import RepositoryPluginPostInterface
@@ -10,6 +22,16 @@ from cvmfsreplica.interfaces import RepositoryPluginPostInterface
 
 
 class Cleanup(RepositoryPluginPostInterface):
+    """
+    removes the files left in the CVMFS_SRV_DIRECTORY
+    (the second field of CVMFS_UPSTREAM_STORAGE).
+
+    Entries are streamed from the directory, when package scandir
+    is available, and removed in batches by post.cleanup.workers threads,
+    at most post.cleanup.max_files_per_second files per second.
+    With post.cleanup.background = True, run() returns at once,
+    and the next snapshot of the repository waits for it to finish.
+    """
 
     def __init__(self, repository, conf):
         self.log = logging.getLogger('cvmfsreplica.cleanup')
@@ -23,15 +45,164 @@ class Cleanup(RepositoryPluginPostInterface):
             raise PluginConfigurationFailure(
                    'failed to initialize Cleanup plugin'
                   )
+        self._readoptions()
+        # background cleanup, if any. 
+        # The lock is held while it is started or waited for
+        self.thread = None
+        self.lock = threading.Lock()
+        # totals since the service started
+        self.filesremoved = 0
+        self.bytesfreed = 0
         self.log.debug('plugin Cleanup initialized properly')
 
+
+    def _readoptions(self):
+        try:
+            self.background = self.conf.getboolean('post.cleanup.background')
+        except:
+            self.background = False #Default
+        try:
+            self.workers = self.conf.getint('post.cleanup.workers')
+        except:
+            self.workers = 1 #Default
+        try:
+            self.batchsize = self.conf.getint('post.cleanup.batch_size')
+        except:
+            self.batchsize = 1000 #Default
+        try:
+            self.maxrate = self.conf.getint('post.cleanup.max_files_per_second')
+        except:
+            self.maxrate = None #Default, no limit
+
+
     def run(self):
         dir_exists = os.path.isdir(self.CVMFS_SRV_DIRECTORY)
         if not dir_exists:
             self.log.warning('directory %s does not exist. Nothing to do.' %self.CVMFS_SRV_DIRECTORY)
+        elif self.background:
+            self.lock.acquire()
+            try:
+                # only one cleanup at a time
+                self._join()
+                self.thread = threading.Thread(target=self._cleanup,
+                                               name='cleanup[%s]' %self.repository.repositoryname)
+                self.thread.setDaemon(True)
+                self.thread.start()
+            finally:
+                self.lock.release()
+        else:
+            self._cleanup()
+
+
+    def wait(self):
+        '''
+        blocks until the cleanup running in background, if any, is done
+        '''
+        self.lock.acquire()
+        try:
+            self._join()
+        finally:
+            self.lock.release()
+
+
+    def _join(self):
+        '''
+        Must be called with the lock acquired.
+        '''
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def _cleanup(self):
+        before = time.time()
+        files, nbytes = self._remove(self._batches())
+        self.filesremoved += files
+        self.bytesfreed += nbytes
+        self.log.info('removed %s files, %s bytes, from directory %s in %.1f seconds'
+                      %(files, nbytes, self.CVMFS_SRV_DIRECTORY, time.time() - before))
+        metrics = self.repository.manager.metrics
+        metrics.inc('cvmfsreplica_cleanup_files_removed_total', value=files)
+        metrics.inc('cvmfsreplica_cleanup_bytes_freed_total', value=nbytes)
+
+
+    def _batches(self):
+        '''
+        yields lists of, at most, batchsize paths
+        '''
+        if scandir is not None:
+            names = (entry.name for entry in scandir(self.CVMFS_SRV_DIRECTORY))
         else:
-            files = os.listdir(self.CVMFS_SRV_DIRECTORY) 
-            for file in files:
-                os.remove('%s/%s' %(self.CVMFS_SRV_DIRECTORY, file))
-      
+            names = os.listdir(self.CVMFS_SRV_DIRECTORY)
+        batch = []
+        for name in names:
+            batch.append(os.path.join(self.CVMFS_SRV_DIRECTORY, name))
+            if len(batch) >= self.batchsize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+    def _remove(self, batches):
+        '''
+        removes the files in all batches.
+        Returns the number of files removed, and the bytes freed.
+        '''
+        if self.workers <= 1:
+            return self._worker(iter(batches))
+
+        # bounded, so batches are not read much faster than they are removed
+        tasks = Queue.Queue(2 * self.workers)
+        results = []
+        lock = threading.Lock()
+
+        def work():
+            out = self._worker(iter(tasks.get, None))
+            lock.acquire()
+            results.append(out)
+            lock.release()
+
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=work)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        try:
+            for batch in batches:
+                tasks.put(batch)
+        finally:
+            for thread in threads:
+                tasks.put(None)
+            for thread in threads:
+                thread.join()
+        return sum([r[0] for r in results]), sum([r[1] for r in results])
+
 
+    def _worker(self, batches):
+        '''
+        removes the files in the batches,
+        throttled so all workers together do not remove
+        more than maxrate files per second
+        '''
+        files = 0
+        nbytes = 0
+        for batch in batches:
+            before = time.time()
+            for path in batch:
+                try:
+                    st = os.lstat(path)
+                    if stat.S_ISDIR(st.st_mode):
+                        self.log.debug('%s is a directory, not removed' %path)
+                        continue
+                    os.remove(path)
+                    files += 1
+                    nbytes += st.st_size
+                except OSError, ex:
+                    self.log.warning('failed to remove %s: %s' %(path, ex))
+            if self.maxrate:
+                pause = len(batch) * self.workers / float(self.maxrate) - (time.time() - before)
+                if pause > 0:
+                    time.sleep(pause)
+        return files, nbytes
@@ -1,13 +1,7 @@
 #!/usr/bin/env python
 
 import logging
-import smtplib
-import socket
 import time
-try:
-    from email.mime.text import MIMEText
-except:
-    from email.MIMEText import MIMEText
 
 from cvmfsreplica.cvmfsreplicaex import PluginConfigurationFailure
 from cvmfsreplica.interfaces import RepositoryPluginReportInterface
@@ -16,15 +10,20 @@ from cvmfsreplica.interfaces import RepositoryPluginReportInterface
 
 class Email(RepositoryPluginReportInterface):
 
+    # one instance per admin_email and smtp_server
+    shared = True
+
     def __init__(self, repository, conf):
         self.log = logging.getLogger('cvmfsreplica.email')
-        self.repository = repository
         self.conf = conf
         try:
             self._readadminemail()
             self._readsmtpserver()
         except:
             raise PluginConfigurationFailure('failed to initialize Email plugin')
+
+        # emails are sent from one thread shared by all repositories
+        self.dispatcher = repository.manager.emaildispatcher
     
         self.log.debug('plugin Email initialized properly')
 
@@ -56,34 +55,26 @@ class Email(RepositoryPluginReportInterface):
             self.log.error(msg)
             raise PluginConfigurationFailure(msg)
 
-    def notifyfailure(self, custommsg=None):
+    def notifyfailure(self, repository, custommsg=None):
         '''
         if configured for that, 
-        sends an email to the sys admin when things go wrong
+        sends an email to the sys admin when things go wrong.
+        It does not wait for the email to be sent.
+        Failures close in time are sent together in one single email.
         '''
 
         message = "ALERT: CVMFS replica failed\n" 
-        message += "repository: %s\n" %self.repository.repositoryname
+        message += "repository: %s\n" %repository.repositoryname
         message += "time: %s\n" %int(time.time())
         if custommsg:
             message += "%s\n" %custommsg
         message += 'Log files should contain more information.\n'
-        msg = MIMEText(message)
-        msg['Subject'] = "ALERT: CVMFS replica failed" 
-        host = socket.gethostname()
-        email_from = "root@%s" %host
-        msg['From'] = email_from
-        msg['To'] = self.adminemail
-        tolist = self.adminemail.split(",")
-        
-        # Send the message via our own SMTP server, but don't include the
-        # envelope header.
-        s = smtplib.SMTP(self.smtpserver)
-        self.log.info("Sending email: %s" % msg.as_string())
-        s.sendmail(email_from , tolist , msg.as_string())
-        s.quit()
-
-    def notifysuccess(self):
+        self.dispatcher.submit(self.smtpserver, 
+                               self.adminemail, 
+                               repository.repositoryname, 
+                               message)
+
+    def notifysuccess(self, repository):
         # we do not send email just to say it worked
         # at least for now
         pass
@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 
 import logging
+import threading
 log = logging.getLogger('cvmfsreplica.plugindispatcher')
 
+# plugin path -> plugin class
+_classes = {}
+_lock = threading.RLock()
+
 ###class PluginDispatcher(object):
 ###
 ###    def __init__(self, repository):
@@ -53,7 +58,11 @@ def readplugins(parent, level, type, conf):
             pluginnames = conf.get(option)
             for pluginname in pluginnames.split(','):
                 pluginname = pluginname.strip()
-                plugin = getplugin(level, type, pluginname)(parent, conf)
+                plugin_class = getplugin(level, type, pluginname)
+                if getattr(plugin_class, 'shared', False):
+                    plugin = _sharedplugin(plugin_class, parent, type, pluginname, conf)
+                else:
+                    plugin = plugin_class(parent, conf)
                 plugins.append(plugin)
         return plugins
     except Exception, ex:
@@ -62,16 +71,65 @@ def readplugins(parent, level, type, conf):
         raise ex
 
 
+def _sharedplugin(plugin_class, parent, type, name, conf):
+    '''
+    returns the instance of a plugin with class attribute shared = True,
+    creating it only the first time for each different configuration.
+    The configuration of a plugin are the options starting
+    by <type>.<name>. , for example report.email.smtp_server
+    Instances are kept by the ReplicaManager, in dictionary sharedplugins,
+    so they are shared by all its repositories.
+    '''
+    manager = getattr(parent, 'manager', None)
+    cache = getattr(manager, 'sharedplugins', None)
+    if cache is None:
+        return plugin_class(parent, conf)
+
+    prefix = '%s.%s.' %(type, name.lower())
+    options = [option for option in conf.options() if option.startswith(prefix)]
+    options.sort()
+    key = (plugin_class, tuple([(option, conf.get(option)) for option in options]))
+    _lock.acquire()
+    try:
+        if key not in cache:
+            cache[key] = plugin_class(parent, conf)
+        return cache[key]
+    finally:
+        _lock.release()
+
+
+def evictsharedplugins(cache, plugins):
+    '''
+    removes from cache, the dictionary sharedplugins of the ReplicaManager,
+    the instances that are not in list plugins, 
+    because no repository uses them anymore.
+    Repositories still holding one can keep using it.
+    '''
+    inuse = set([id(plugin) for plugin in plugins])
+    _lock.acquire()
+    try:
+        for key, plugin in cache.items():
+            if id(plugin) not in inuse:
+                del cache[key]
+    finally:
+        _lock.release()
+
+
 def getplugin(level, action, name):
     '''
     level is the high-level type of plugin: repository or service
     action is the type of plugin to be delivered
     name is the actual plugin to be delivered
+    Classes are imported only the first time.
     '''
 
-    log.debug('Starting for level=%s, action=%s, name=%s' %(level, action, name))
-
     plugin_path = 'cvmfsreplica.plugins.%s.%s.%s' %(level, action, name)
+    try:
+        return _classes[plugin_path]
+    except KeyError:
+        pass
+
+    log.debug('Starting for level=%s, action=%s, name=%s' %(level, action, name))
     try:
         plugin_module = __import__(plugin_path,
                                globals(),
@@ -82,5 +140,6 @@ def getplugin(level, action, name):
         log.debug(ex)
 
     plugin_class = getattr(plugin_module, name) # name of the class is the same as the module
+    _classes[plugin_path] = plugin_class
     log.debug('return plugin %s.%s.%s' %(level, action, name))
     return plugin_class
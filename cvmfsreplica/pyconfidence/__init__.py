@@ -7,7 +7,10 @@ __version__ ='0.9.0'
 
 from cvmfsreplica.pyconfidence.config import Config
 from cvmfsreplica.pyconfidence.single import SingleSectionConfig
+from cvmfsreplica.pyconfidence.view import SectionView, NamespaceView
 
 
 __all__ = ['Config',
-           'SingleSectionConfig']
+           'SingleSectionConfig',
+           'SectionView',
+           'NamespaceView']
@@ -26,6 +26,24 @@ class Config(ConfigParser.SafeConfigParser, object):
 
     def __init__(self):
         ConfigParser.SafeConfigParser.__init__(self)
+        # values from [DEFAULT] shared by all SectionView objects,
+        # built the first time they are needed
+        self._shareddefaults = None
+        # converted values, shared by all SectionView objects,
+        # and gone with this object
+        self._converted = {}
+
+    def _read(self, fp, fpname):
+        self._shareddefaults = None
+        ConfigParser.SafeConfigParser._read(self, fp, fpname)
+
+    def set(self, section, option, value=None):
+        self._shareddefaults = None
+        ConfigParser.SafeConfigParser.set(self, section, option, value)
+
+    def remove_option(self, section, option):
+        self._shareddefaults = None
+        return ConfigParser.SafeConfigParser.remove_option(self, section, option)
 
     def getlist(self, section, option, conv=str):
         '''
@@ -38,16 +56,38 @@ class Config(ConfigParser.SafeConfigParser, object):
 
     def getSection(self, section):
         '''
-        creates and returns a new Config object, 
-        with the content of a single section
+        creates and returns a read-only SectionView object,
+        with the content of a single section.
+        Values from [DEFAULT] are not copied, but shared
+        by the views of all sections, unless they need interpolation.
         '''
-    
-        conf = cvmfsreplica.pyconfidence.single.SingleSectionConfig()
+
+        defaults = self._getshareddefaults()
+        values = {}
         if self.has_section(section):
-                #conf.add_section(section)
-                for item in self.items(section, raw=True):
-                    conf.set(item[0], item[1])
-        return conf
+            options = [o for o in self._sections[section] if o != '__name__']
+            # values from [DEFAULT] that depend on the section 
+            options += [o for o in self._defaults if o not in defaults and o not in options]
+            for option in options:
+                try:
+                    value = self.get(section, option)
+                except ConfigParser.InterpolationError:
+                    value = self.get(section, option, raw=True)
+                values[option] = intern(value)
+        return cvmfsreplica.pyconfidence.view.SectionView(section, values, defaults, self._converted)
+
+
+    def _getshareddefaults(self):
+        '''
+        values from [DEFAULT] with no interpolation, 
+        the same for all sections
+        '''
+        if self._shareddefaults is None:
+            self._shareddefaults = {}
+            for option, value in self._defaults.items():
+                if '%' not in value:
+                    self._shareddefaults[option] = intern(value)
+        return self._shareddefaults
 
 
     def __str__(self):
@@ -45,9 +45,9 @@ class SingleSectionConfig(object):
 
     def getboolean(self, option):
         v = self.get(option)
-        if v.lower() not in self._boolean_states:
+        if v.lower() not in self.conf._boolean_states:
             raise ValueError, 'Not a boolean: %s' % v
-        return self._boolean_states[v.lower()]
+        return self.conf._boolean_states[v.lower()]
 
     def items(self, raw=False, vars=None):
         return self.conf.items(self.section, raw, vars)
@@ -55,6 +55,9 @@ class SingleSectionConfig(object):
     def has_option(self, option):
         return self.conf.has_option(self.section, option)
 
+    def options(self):
+        return self.conf.options(self.section)
+
     #def setsection(self, section):
     #    '''
     #    changes the section name from the default 
@@ -126,34 +129,12 @@ class SingleSectionConfig(object):
 
     def namespace(self, name, replace=None, exclude=False):
         '''
-        creates a new SingleSectionConfig object
+        returns a read-only view of this object
         where string <name> has been stripped from the 
         beginning of options, when present.
         If replace is provided, it substitutes string <name>
         If exclude is True, other (option, value) pairs are ignored.
         If exclude is False, other (option, value) pairs are also included.
+        Nothing is copied.
         '''
-        new_conf = SingleSectionConfig()
-        # FIXME new_conf.conf has a different section name than self.conf
-
-        items = self.items()
-
-        # 1st, let's deal with the other options
-        # if needed
-        # reason is that this way, and option,key pair
-        # can be overriden if another one becomes the same after
-        # namespace manipulation
-        if not exclude:
-            for option, value in items:
-                if not option.startswith(name):
-                    new_conf.set(option, value)
- 
-        # 2nd, deal with options that are expected to change
-        for option, value in items:
-            if option.startswith(name):
-                option = option[len(name):]
-                if replace:
-                    option = '%s%s' %(replace, option)
-                new_conf.set(option, value)
-
-        return new_conf
+        return cvmfsreplica.pyconfidence.view.NamespaceView(self, name, replace, exclude)
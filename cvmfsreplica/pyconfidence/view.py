@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+read-only views of the configuration of one section
+"""
+
+import ConfigParser
+
+
+def _boolean(value):
+    states = ConfigParser.RawConfigParser._boolean_states
+    if value.lower() not in states:
+        raise ValueError, 'Not a boolean: %s' % value
+    return states[value.lower()]
+
+
+class _View(object):
+    """
+    methods common to all views.
+    Subclasses implement get(), has_option() and options(),
+    and have attribute converted, the dictionary
+        (conversion function, string) -> converted value
+    shared with the views of the same Config object,
+    so each distinct string is only parsed once
+    """
+
+    __slots__ = ()
+
+    def _convert(self, conv, value):
+        key = (conv, value)
+        try:
+            return self.converted[key]
+        except KeyError:
+            out = conv(value)
+            self.converted[key] = out
+            return out
+
+    def getint(self, option):
+        return self._convert(int, self.get(option))
+
+    def getfloat(self, option):
+        return self._convert(float, self.get(option))
+
+    def getboolean(self, option):
+        return self._convert(_boolean, self.get(option))
+
+    def getlist(self, option, conv=str):
+        return [conv(i.strip()) for i in self.get(option).split(',')]
+
+    def items(self, raw=False, vars=None):
+        return [(option, self.get(option)) for option in self.options()]
+
+    def namespace(self, name, replace=None, exclude=False):
+        '''
+        returns a view where string <name> has been stripped from the
+        beginning of options, when present, without copying anything.
+        If replace is provided, it substitutes string <name>
+        If exclude is True, other options are ignored.
+        If exclude is False, other options are also included.
+        '''
+        return NamespaceView(self, name, replace, exclude)
+
+
+class SectionView(_View):
+    """
+    immutable content of one section of a Config object.
+
+    It only keeps the options that are specific to the section.
+    The values from [DEFAULT] are kept in one dictionary,
+    shared by the views of all sections.
+    Interpolation is done once, when the view is created.
+    """
+
+    __slots__ = ('section', 'values', 'defaults', 'converted')
+
+    def __init__(self, section, values, defaults, converted=None):
+        """
+        values is a dictionary with the options of this section
+        defaults is the dictionary with the options shared by all sections
+        converted is the dictionary with the converted values 
+        shared by all sections
+        """
+        self.section = section
+        self.values = values
+        self.defaults = defaults
+        if converted is None:
+            converted = {}
+        self.converted = converted
+
+    def get(self, option, raw=False, vars=None):
+        option = option.lower()
+        try:
+            return self.values[option]
+        except KeyError:
+            pass
+        try:
+            return self.defaults[option]
+        except KeyError:
+            raise ConfigParser.NoOptionError(option, self.section)
+
+    def has_option(self, option):
+        option = option.lower()
+        return option in self.values or option in self.defaults
+
+    def options(self):
+        out = list(self.values.keys())
+        for option in self.defaults.keys():
+            if option not in self.values:
+                out.append(option)
+        return out
+
+
+class NamespaceView(_View):
+    """
+    view of the options of another view, or SingleSectionConfig object,
+    with a prefix removed or replaced.
+    Nothing is copied: every lookup goes to the parent.
+    """
+
+    __slots__ = ('parent', 'name', 'replace', 'exclude', 'converted')
+
+    def __init__(self, parent, name, replace=None, exclude=False):
+        self.parent = parent
+        self.name = name
+        self.replace = replace
+        self.exclude = exclude
+        # the one of the parent, if it is a view
+        self.converted = getattr(parent, 'converted', None)
+        if self.converted is None:
+            self.converted = {}
+
+    def _source(self, option):
+        '''
+        returns the name of the option in the parent, or None
+        '''
+        option = option.lower()
+        prefix = self.replace or ''
+        if option.startswith(prefix):
+            source = self.name + option[len(prefix):]
+            if self.parent.has_option(source):
+                return source
+        if not self.exclude and not option.startswith(self.name) and self.parent.has_option(option):
+            return option
+        return None
+
+    def get(self, option, raw=False, vars=None):
+        source = self._source(option)
+        if source is None:
+            raise ConfigParser.NoOptionError(option, self.name)
+        return self.parent.get(source)
+
+    def has_option(self, option):
+        return self._source(option) is not None
+
+    def options(self):
+        out = []
+        for option in self.parent.options():
+            if option.startswith(self.name):
+                option = (self.replace or '') + option[len(self.name):]
+            elif self.exclude:
+                continue
+            if option not in out:
+                out.append(option)
+        return out
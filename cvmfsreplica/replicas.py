@@ -4,18 +4,36 @@
 module with all code to manage the replica threads
 """
 
+import heapq
 import logging
+import os
 import Queue
+import random
+import shlex
 import subprocess
 import threading
 import time
+import urlparse
+import zlib
 
 import cvmfsreplica.pluginsmanagement as pm
 import cvmfsreplica.utils as utils
+from cvmfsreplica.adaptive import AdaptiveConcurrency
+from cvmfsreplica.freespace import FreeSpaceCache
+from cvmfsreplica.history import SnapshotHistory
+from cvmfsreplica.hostlimits import HostLimits
+from cvmfsreplica.httpclient import HTTPClient
+from cvmfsreplica.manifestpoller import ManifestPoller
+from cvmfsreplica.filewatcher import FileWatcher, readtimestamp
+from cvmfsreplica.notifier import EmailDispatcher
+from cvmfsreplica.scheduler import Scheduler
+from cvmfsreplica.supervisor import ProcessSupervisor
+from cvmfsreplica.tracing import RequestTrace, Tracer
+from cvmfsreplica.statejournal import StateJournal
 from cvmfsreplica.cvmfsreplicaex import PluginConfigurationFailure, AcceptancePluginFailed
 
 #from pyconfidence import SingleSectionConfig
-from cvmfsreplica.pyconfidence import SingleSectionConfig
+from cvmfsreplica.pyconfidence import Config, SingleSectionConfig
 from cvmfsreplica.cvmfsreplicaex import RepositoriesConfigurationFailure
 
 
@@ -37,7 +55,10 @@ class ReplicaManager:
            There is one instance per section in 
            the repositories configuration file
            (that is not disabled). 
-           Each one of these objects is a thread.
+           Each one of these objects is a thread,
+           unless the scheduler mode is "loop".
+           In that case, they are not started,
+           and one single Scheduler thread drives all of them.
         
         -- the [only] one instance of the 
            class that acts as a pipe to serialize
@@ -49,6 +70,8 @@ class ReplicaManager:
            N is the maximum number of concurrent 
            snapshots we allow to happens simultaneously.
            Each one of these objects is a thread.
+           In adaptive mode, only some of them are 
+           allowed to run snapshots at a given time.
     """
 
     def __init__(self, service):
@@ -63,17 +86,163 @@ class ReplicaManager:
         self.service = service
         self.conf = service.conf
         self.repositoriesconf = service.repositoriesconf
+        self.metrics = service.metrics
+        # command to run the snapshots, without the arguments
+        self.cvmfsservercmd = shlex.split(service.cvmfsserver)
 
         # list with all Repository( ) objects
         self.repositories = []
 
+        # list with the Repository( ) objects removed 
+        # from the configuration while running 
+        self.retiredrepositories = []
+
         # list with all ReplicaAgent( ) objects
         self.replicaagents = []
 
-        self.replicarequestqueue = ReplicaRequestQueue()
+        hostlimits = None
+        if self.service.hostlimitsparameters:
+            hostlimits = HostLimits(**self.service.hostlimitsparameters)
+        self.replicarequestqueue = ReplicaRequestQueue(hostlimits)
+
+        # threads shared by all repositories 
+        # to run the acceptance plugins
+        self.acceptancepool = utils.WorkerPool(self.service.acceptanceworkers, 'acceptancepool')
+        # acceptance plugins past their deadline, still holding a thread
+        self.acceptanceoverdue = OverdueCounter()
+
+        # HTTP client, with keep-alive connections, 
+        # shared by all repositories
+        self.httpclient = HTTPClient(self.service.httpconnecttimeout,
+                                     self.service.httpreadtimeout)
+
+        # sends the emails of all report plugins.
+        # It must exist before the report plugins are created
+        self.emaildispatcher = EmailDispatcher(self.service.notificationwindow,
+                                               self.service.notificationrate,
+                                               self.service.notificationburst)
+
+        # free disk space, shared by all repositories.
+        # It must exist before the acceptance plugins are created
+        self.freespace = FreeSpaceCache(self.service.freespacettl)
+
+        # AdaptiveConcurrency() object, only in adaptive mode
+        self.adaptiveconcurrency = None
+        if self.service.adaptiveconcurrency:
+            self.adaptiveconcurrency = AdaptiveConcurrency(self.replicarequestqueue,
+                                                           self.service.minthreads,
+                                                           self.service.maxthreads,
+                                                           **self.service.adaptiveparameters)
+
+        # SnapshotHistory() object, only if a database is configured
+        self.history = None
+        if self.service.historydb:
+            self.history = SnapshotHistory(self.service.historydb)
+
+        # Tracer() object, only if a trace file is configured
+        self.tracer = None
+        if self.service.tracefile:
+            self.tracer = Tracer(self.service.tracefile,
+                                 self.service.tracefilemaxbytes,
+                                 self.service.tracefilebackups)
+
+        # StateJournal() object, only if a journal file is configured.
+        # It must exist before the repositories are created
+        self.journal = None
+        if self.service.statejournal:
+            self.journal = StateJournal(self.service.statejournal)
+
+        # supervises all snapshot commands from one single thread
+        self.supervisor = ProcessSupervisor(self.service.killgraceperiod)
+
+        # ManifestPoller() object, only if a polling interval is set.
+        # It must exist before the acceptance plugins are created
+        self.manifestpoller = None
+        if self.service.manifestpollinterval:
+            self.manifestpoller = ManifestPoller(self.httpclient,
+                                                 self.service.manifestpollinterval,
+                                                 self.service.manifestcachettl)
+
+        # keeps the values of the local files of all repositories,
+        # read again only when they change.
+        # It must exist before the repositories are created
+        self.filewatcher = FileWatcher(self.service.filewatcherpollinterval,
+                                       self.service.filewatcherinotify)
+
+        # Scheduler() object, only in "loop" mode
+        self.scheduler = None
+        if self.service.scheduler == 'loop':
+            self.scheduler = Scheduler(self, self.service.schedulerworkers)
+
+        # set from the SIGHUP handler to reload the repositories configuration
+        self.reloadrequested = False
+
+        # instances of the plugins shared by all repositories,
+        # see pluginsmanagement.readplugins()
+        self.sharedplugins = {}
 
         self._create_repositories()
+        self._admit_overdue()
         self._create_replica_agents()
+        self._setup_metrics()
+
+
+    def _setup_metrics(self):
+        """
+        describes the metrics of the service, 
+        and registers the function to read the gauges 
+        """
+        describe = self.metrics.describe
+        describe('cvmfsreplica_queue_depth', 'gauge', 
+                 'Number of snapshot requests waiting in the queue')
+        describe('cvmfsreplica_agents', 'gauge', 
+                 'Number of ReplicaAgent threads, by state (busy or idle)')
+        describe('cvmfsreplica_concurrency_limit', 'gauge', 
+                 'Maximum number of snapshots running at the same time')
+        describe('cvmfsreplica_seconds_since_last_success', 'gauge', 
+                 'Seconds since the last successful snapshot, per repository')
+        describe('cvmfsreplica_snapshot_duration_seconds', 'histogram', 
+                 'Duration of the snapshot attempts, by result (success, failure or timeout)')
+        describe('cvmfsreplica_acceptance_latency_seconds', 'histogram', 
+                 'Time to get an answer from the acceptance plugins, per plugin')
+        describe('cvmfsreplica_snapshot_attempts_total', 'counter', 
+                 'Number of snapshot attempts, by result (success, failure or timeout)')
+        describe('cvmfsreplica_snapshot_retries_total', 'counter', 
+                 'Number of snapshot attempts after the first one of a request')
+        describe('cvmfsreplica_snapshot_timeouts_total', 'counter', 
+                 'Number of snapshot attempts killed after timing out')
+        describe('cvmfsreplica_acceptance_timeouts_total', 'counter', 
+                 'Number of acceptance plugins that did not answer before their deadline')
+        describe('cvmfsreplica_acceptance_overdue', 'gauge', 
+                 'Number of acceptance plugins still running after their deadline, each one holding a thread of the acceptance pool')
+        describe('cvmfsreplica_cleanup_files_removed_total', 'counter', 
+                 'Number of files removed by the Cleanup post plugin')
+        describe('cvmfsreplica_cleanup_bytes_freed_total', 'counter', 
+                 'Number of bytes freed by the Cleanup post plugin')
+        self.metrics.addcollector(self._collect_metrics)
+
+
+    def _collect_metrics(self):
+        """
+        returns the current value of the gauges
+        """
+        queue = self.replicarequestqueue
+        busy = len(queue.running)
+        limit = queue.limit
+        if limit is None:
+            limit = len(self.replicaagents)
+        out = [('cvmfsreplica_queue_depth', {}, queue.qsize()),
+               ('cvmfsreplica_agents', {'state': 'busy'}, busy),
+               ('cvmfsreplica_agents', {'state': 'idle'}, len(self.replicaagents) - busy),
+               ('cvmfsreplica_concurrency_limit', {}, limit),
+               ('cvmfsreplica_acceptance_overdue', {}, self.acceptanceoverdue.value)]
+        now = time.time()
+        for repository in self.repositories:
+            if repository.last_success:
+                out.append(('cvmfsreplica_seconds_since_last_success', 
+                            {'repository': repository.repositoryname}, 
+                            now - repository.last_success))
+        return out
 
 
     def _create_repositories(self):
@@ -82,16 +251,181 @@ class ReplicaManager:
         all Repository() thread objects
         """
 
-        for section in self.repositoriesconf.sections():
-            if self.repositoriesconf.getboolean(section, 'enabled'):
-                repositoryname = self.repositoriesconf.get(section, 'repositoryname')
-                self.log.debug('creating Repository() thread for %s' %repositoryname)
-                singlerepositoryconf = self.repositoriesconf.getSection(section)
-                try:
-                    repository = Repository(self, repositoryname, singlerepositoryconf)
-                except RepositoriesConfigurationFailure, ex:
-                    self.log.critical(ex)
+        enabled = self._enabled_repositories(self.repositoriesconf)
+        before = time.time()
+        # most of the time is spent reading files,
+        # so several repositories are created at the same time
+        pool = utils.WorkerPool(min(self.service.startupworkers, len(enabled)) or 1, 'startuppool')
+        try:
+            repositories = pool.map(lambda item: self._create_repository(*item), enabled)
+        finally:
+            pool.stop(wait=True)
+        for repository in repositories:
+            if repository:
                 self.repositories.append(repository)
+        self.log.info('%s repositories created in %.1f seconds' %(len(self.repositories), time.time() - before))
+
+
+    def _admit_overdue(self):
+        """
+        after a (re)start, the repositories already overdue
+        are not all started at once.
+        They are spread over the next cold_start_window seconds,
+        the ones without a successful snapshot for longer first,
+        each one at a random time within its own slot.
+        """
+        window = self.service.coldstartwindow
+        now = int(time.time())
+        overdue = [repository for repository in self.repositories if repository.next_due <= now]
+        if not window or not overdue:
+            return
+        overdue.sort(key=lambda repository: repository.last_success)
+        slot = float(window) / len(overdue)
+        for i, repository in enumerate(overdue):
+            repository.next_due = now + int(slot * (i + random.random()))
+        self.log.info('%s repositories overdue, starting them in the next %s seconds' %(len(overdue), window))
+
+
+    def _enabled_repositories(self, repositoriesconf):
+        """
+        returns a list of (repositoryname, conf) 
+        for all enabled sections in the repositories configuration
+        """
+        out = []
+        for section in repositoriesconf.sections():
+            if repositoriesconf.getboolean(section, 'enabled'):
+                repositoryname = repositoriesconf.get(section, 'repositoryname')
+                out.append((repositoryname, repositoriesconf.getSection(section)))
+        return out
+
+
+    def _create_repository(self, repositoryname, conf):
+        """
+        creates, but does not start, one Repository() thread object.
+        Returns None if its configuration is wrong
+        """
+        self.log.debug('creating Repository() thread for %s' %repositoryname)
+        try:
+            repository = Repository(self, repositoryname, conf)
+        except RepositoriesConfigurationFailure, ex:
+            self.log.critical(ex)
+            return None
+        if self.journal:
+            state = self.journal.get(repositoryname)
+            if state:
+                repository.restore(state)
+        return repository
+
+
+    def preempt(self, req):
+        """
+        if all agents are busy, preempts the running request
+        with the lowest priority, if lower than the one of req,
+        so req can take its slot
+        """
+        queue = self.replicarequestqueue
+        slots = len(self.replicaagents)
+        if queue.limit is not None:
+            slots = min(slots, queue.limit)
+        if len(queue.running) < slots:
+            return
+        victim = queue.preempt(req.priority)
+        if victim is not None:
+            self.log.warning('preempting request for repository %s, to run the one for repository %s' %(victim.repositoryname, req.repositoryname))
+
+
+    def getrepository(self, repositoryname):
+        """
+        returns the Repository() object for a repository name,
+        or None if there is not such repository
+        """
+        for repository in self.repositories:
+            if repository.repositoryname == repositoryname:
+                return repository
+        return None
+
+
+    def _start_repository(self, repository):
+        """
+        starts one Repository() thread object, 
+        or gives it to the Scheduler
+        """
+        if self.scheduler:
+            self.scheduler.schedule(repository)
+        else:
+            repository.start()
+
+
+    def reload(self):
+        """
+        reads again the repositories configuration file,
+        and applies only the differences with the running repositories:
+            -- new sections are started
+            -- removed, or disabled, sections are drained: 
+               no new cycles are started, but their requests 
+               already queued or running finish normally
+            -- changed sections get the new configuration,
+               (interval, priority, plugins, ...) from their next cycle
+        Requests queued or running are never interrupted.
+        """
+        self.log.info('reloading repositories configuration file %s' %self.service.repositoriesconffile)
+        try:
+            repositoriesconf = Config()
+            f = open(self.service.repositoriesconffile)
+            try:
+                repositoriesconf.readfp(f)
+            finally:
+                f.close()
+            enabled = self._enabled_repositories(repositoriesconf)
+        except Exception, ex:
+            self.log.error('failed to read repositories configuration: %s. Nothing changed' %ex)
+            return
+
+        current = dict([(repository.repositoryname, repository) for repository in self.repositories])
+        repositories = []
+        for repositoryname, conf in enabled:
+            repository = current.pop(repositoryname, None)
+            if repository is None:
+                try:
+                    repository = self._create_repository(repositoryname, conf)
+                except Exception, ex:
+                    self.log.error('failed to create repository %s: %s' %(repositoryname, ex))
+                    continue
+                if repository is None:
+                    continue
+                self.log.info('adding repository %s' %repositoryname)
+                self._start_repository(repository)
+            elif dict(repository.conf.items()) != dict(conf.items()):
+                self.log.info('reconfiguring repository %s' %repositoryname)
+                try:
+                    repository.reconfigure(conf)
+                except Exception, ex:
+                    self.log.error('failed to reconfigure repository %s: %s. Keeping the previous configuration' %(repositoryname, ex))
+            repositories.append(repository)
+
+        for repositoryname, repository in current.items():
+            self.log.info('draining repository %s' %repositoryname)
+            repository.stopevent.set()
+            repository.close()
+            self.retiredrepositories.append(repository)
+
+        self.repositories = repositories
+        self.repositoriesconf = repositoriesconf
+        self.service.repositoriesconf = repositoriesconf
+        self._evict_shared_plugins()
+
+
+    def _evict_shared_plugins(self):
+        """
+        forgets the shared plugins no repository uses anymore,
+        including the report plugins of the acceptance plugins
+        """
+        plugins = []
+        for repository in self.repositories:
+            for plugin in repository.reportplugins + repository.acceptanceplugins + repository.postplugins:
+                plugins.append(plugin)
+                plugins.extend(getattr(plugin, 'reportplugins', []))
+        pm.evictsharedplugins(self.sharedplugins, plugins)
             
 
     def _create_replica_agents(self):
@@ -108,7 +442,8 @@ class ReplicaManager:
     def run(self):
         """
         starts all threads:
-            -- Repository object threads
+            -- Repository object threads, 
+               or the Scheduler thread
             -- ReplicaAgent object threads
 
         and then wait, for ever, unless the daemon is stop
@@ -119,9 +454,33 @@ class ReplicaManager:
 
     def _start_threads(self):
 
-        self.log.debug('starting all Repository() threads') 
-        for repository in self.repositories:
-            repository.start()
+        self.log.debug('starting ProcessSupervisor() thread') 
+        self.supervisor.start()
+
+        self.log.debug('starting EmailDispatcher() thread') 
+        self.emaildispatcher.start()
+
+        if self.adaptiveconcurrency:
+            self.log.debug('starting AdaptiveConcurrency() thread') 
+            self.adaptiveconcurrency.start()
+
+        if self.manifestpoller:
+            self.log.debug('starting ManifestPoller() thread') 
+            self.manifestpoller.start()
+
+        self.log.debug('starting FileWatcher() thread') 
+        self.filewatcher.start()
+
+        if self.scheduler:
+            self.log.debug('scheduling all Repository() objects') 
+            for repository in self.repositories:
+                self._start_repository(repository)
+            self.log.debug('starting Scheduler() thread') 
+            self.scheduler.start()
+        else:
+            self.log.debug('starting all Repository() threads') 
+            for repository in self.repositories:
+                self._start_repository(repository)
 
         self.log.debug('starting all ReplicaAgent() threads') 
         for replicaagent in self.replicaagents:
@@ -132,8 +491,12 @@ class ReplicaManager:
 
         try:
             while True:
+                # a signal interrupts the sleep
                 time.sleep(10)
                 self.log.trace('Checking for interrupt.')
+                if self.reloadrequested:
+                    self.reloadrequested = False
+                    self.reload()
 
         except (KeyboardInterrupt):
             self.log.info("Shutdown via Ctrl-C or -INT signal.")
@@ -147,18 +510,51 @@ class ReplicaManager:
     def shutdown(self):
         """
         stopts all threads:
-            -- Repository object threads
+            -- Repository object threads,
+               or the Scheduler thread
             -- ReplicaAgent object threads
         """
         
-        self.log.debug('stoping all Repository() threads') 
-        for repository in self.repositories:
-            repository.join()
+        if self.scheduler:
+            self.log.debug('stoping Scheduler() thread') 
+            for repository in self.repositories:
+                repository.stopevent.set()
+            self.scheduler.join()
+        else:
+            self.log.debug('stoping all Repository() threads') 
+            for repository in self.repositories + self.retiredrepositories:
+                repository.join()
 
         self.log.debug('stoping all ReplicaAgent() threads') 
+        # closing the queue wakes up the agents blocked on it
+        self.replicarequestqueue.close()
         for replicaagent in self.replicaagents:
             replicaagent.join()
 
+        if self.adaptiveconcurrency:
+            self.log.debug('stoping AdaptiveConcurrency() thread') 
+            self.adaptiveconcurrency.join()
+
+        self.log.debug('stoping ProcessSupervisor() thread') 
+        self.supervisor.join()
+
+        self.log.debug('stoping EmailDispatcher() thread') 
+        self.emaildispatcher.join()
+
+        if self.manifestpoller:
+            self.log.debug('stoping ManifestPoller() thread') 
+            self.manifestpoller.join()
+
+        self.log.debug('stoping FileWatcher() thread') 
+        self.filewatcher.join()
+
+        self.acceptancepool.stop()
+        self.httpclient.close()
+        if self.history:
+            self.history.close()
+        if self.tracer:
+            self.tracer.close()
+
 
 
 # =============================================================================
@@ -199,20 +595,84 @@ class Repository(threading.Thread):
 
         self.manager = manager
         self.repositoryname = repositoryname
-        self.conf = conf
         #self.repositoryname = self.conf.get("repositoryname") 
-        self.interval = self.conf.getint("interval")
-        self.ntrials = self.conf.getint("ntrials")
-        if self.conf.has_option("priority"):
-            self.priority = self.conf.getint("priority")
-        else:
-            self.priority = 0
+        # held while the configuration changes, see reconfigure()
+        self.configlock = threading.Lock()
+        self._readconfig(conf)
+        self.last_attempt = self.last_published = self._snapshotdate()
+        # the timestamp file is only updated by successful snapshots
+        self.last_success = self.last_attempt
+        # number of consecutive failed snapshots
+        self.failures = 0
+        # when the next cycle should start
+        self.next_due = self._due(self.last_attempt)
+        # for the cycles started from the control channel:
+        #   -- only one cycle at a time, in "threads" mode
+        #   -- a cycle was asked while another one was running
+        #   -- priority for the next request
+        #   -- the next request can preempt another one
+        self.cyclelock = threading.Lock()
+        self.triggered = False
+        self.triggerpriority = None
+        self.triggerpreempt = False
+
+
+    def state(self):
+        """
+        returns the scheduler state, as a dictionary, 
+        to be recorded in the StateJournal
+        """
+        return {'last_attempt': self.last_attempt,
+                'last_success': self.last_success,
+                'failures': self.failures,
+                'next_due': self.next_due}
+
+
+    def restore(self, state):
+        """
+        resumes from the scheduler state recorded before a restart.
+        The timestamp file wins if it is more recent,
+        for example after a snapshot run by hand.
+        """
+        self.last_success = max(self.last_success, state.get('last_success', 0))
+        self.failures = state.get('failures', 0)
+        if state.get('last_attempt', 0) >= self.last_attempt:
+            self.last_attempt = state['last_attempt']
+            # the interval may have changed since then
+            self.next_due = self._due(self.last_attempt)
+            if state.get('next_due'):
+                self.next_due = min(self.next_due, state['next_due'])
+
+
+    # attributes set by _readconfig()
+    CONFIGATTRIBUTES = ['conf', 'interval', 'ntrials', 'priority', 'cvmfsconf', 
+                        'reportplugins', 'acceptanceplugins', 'postplugins', 
+                        'timeout', 'acceptancetimeouts', 'acceptancelatency',
+                        'snapshotoutputlines', 'snapshotlog', 
+                        'upstreamhost', 'timestampfilename',
+                        'schedule', 'phase', 'jitter']
+
+    def _readconfig(self, conf):
+        """
+        reads the configuration of the repository, 
+        and creates its plugins
+        """
+        self.conf = conf
         try:
+            self.interval = self.conf.getint("interval")
+            self.ntrials = self.conf.getint("ntrials")
+            if self.conf.has_option("priority"):
+                self.priority = self.conf.getint("priority")
+            else:
+                self.priority = 0
             self._get_cvmfs_config()
             self.reportplugins = pm.readplugins(self, 'repository', 'report', self.conf)
             self.acceptanceplugins = pm.readplugins(self, 'repository', 'acceptance', self.conf)
             self.postplugins = pm.readplugins(self, 'repository', 'post', self.conf)
             self._readtimeout()
+            self._readscheduleconfig()
+            self._readacceptancetimeouts()
+            self._readsnapshotoutputconfig()
         except:
             raise RepositoriesConfigurationFailure(
                   'configuration for repository %s cannot be read' %self.repositoryname)
@@ -220,8 +680,38 @@ class Repository(threading.Thread):
         # CMFS configuration:
         # getting the file with the time stampt for the last snapshot
         cvmfs_upstream_storage = self._get_cvmfs_upstream_storage()
+        self.upstreamhost = self._get_cvmfs_stratum0_host()
         self.timestampfilename = '%s/.cvmfs_last_snapshot' %cvmfs_upstream_storage
-        self.last_attempt = self.last_published = self._snapshotdate()
+        self.manager.filewatcher.watch(self.timestampfilename, readtimestamp, self._timestampchanged)
+
+
+    def reconfigure(self, conf):
+        """
+        changes the configuration of the repository while it runs.
+        Post plugins still running in background finish first.
+        A request already queued or running is not affected.
+        If the new configuration is wrong, the previous one is kept,
+        and RepositoriesConfigurationFailure is raised.
+        A cycle running meanwhile sees either the old acceptance 
+        plugins or the new ones, with their timeouts, never a mix.
+        """
+        self._waitpost()
+        self.configlock.acquire()
+        try:
+            previous = dict([(attr, getattr(self, attr)) for attr in self.CONFIGATTRIBUTES])
+            try:
+                self._readconfig(conf)
+            except Exception:
+                for attr, value in previous.items():
+                    setattr(self, attr, value)
+                self._readsnapshotoutputconfig()
+                raise
+            for attr in ['interval', 'schedule', 'jitter']:
+                if getattr(self, attr) != previous[attr]:
+                    self.next_due = self._due(self.last_attempt)
+                    break
+        finally:
+            self.configlock.release()
 
 
     def _readtimeout(self):
@@ -234,11 +724,104 @@ class Repository(threading.Thread):
             self.timeout = self.conf.getint('timeout')
 
 
+    def _readscheduleconfig(self):
+        """
+        gets how the next due time is calculated:
+            -- schedule = interval (default): 
+               interval seconds after the last cycle
+            -- schedule = phase: 
+               at a fixed offset within each interval,
+               calculated from the repository name,
+               so repositories with the same interval are spread evenly
+        plus, with schedule_jitter, a random delay up to that many seconds,
+        never longer than the interval
+        """
+        self.schedule = 'interval'
+        if self.conf.has_option('schedule'):
+            self.schedule = self.conf.get('schedule')
+        if self.schedule not in ['interval', 'phase']:
+            raise RepositoriesConfigurationFailure('wrong value for schedule: %s' %self.schedule)
+        # the same for every run of the service
+        self.phase = (zlib.crc32(self.repositoryname) & 0xffffffff) % max(self.interval, 1)
+        self.jitter = 0
+        if self.conf.has_option('schedule_jitter'):
+            self.jitter = min(self.conf.getint('schedule_jitter'), self.interval)
+
+
+    def _due(self, last):
+        '''
+        returns, in seconds since EPOCH, when the next cycle should start,
+        after a cycle finished at time last
+        '''
+        if self.schedule == 'phase' and self.interval > 0:
+            # first time after last with the phase of this repository
+            due = last - (last - self.phase) % self.interval + self.interval
+        else:
+            due = last + self.interval
+        if self.jitter:
+            due += random.randint(0, self.jitter)
+        return due
+
+
+    def _readacceptancetimeouts(self):
+        """
+        gets the deadline for each acceptance plugin.
+        The default is "acceptance_timeout", 120 seconds if not specified,
+        and it can be overriden for each plugin 
+        with "acceptance.<plugin>.timeout".
+        A value of 0 means no deadline.
+        """
+        default = 120
+        if self.conf.has_option('acceptance_timeout'):
+            default = self.conf.getint('acceptance_timeout')
+        self.acceptancetimeouts = {}
+        for acceptance in self.acceptanceplugins:
+            name = acceptance.__class__.__name__
+            option = 'acceptance.%s.timeout' %name.lower()
+            timeout = default
+            if self.conf.has_option(option):
+                timeout = self.conf.getint(option)
+            self.acceptancetimeouts[name] = timeout or None
+        # latency, in seconds, of the last call to each acceptance plugin
+        self.acceptancelatency = {}
+
+
+    def _readsnapshotoutputconfig(self):
+        """
+        gets where the output of the snapshots goes,
+        and how many lines of it are kept for the failure reports.
+        The output goes to a logger for this repository,
+        that also writes into a dedicated file if "snapshotlog" is specified.
+        """
+        self.snapshotoutputlines = 50
+        if self.conf.has_option('snapshot_output_lines'):
+            self.snapshotoutputlines = self.conf.getint('snapshot_output_lines')
+
+        self.snapshotlog = logging.getLogger('cvmfsreplica.repository[%s].snapshot' %self.repositoryname)
+        filename = None
+        if self.conf.has_option('snapshotlog'):
+            filename = self.conf.get('snapshotlog')
+            if filename.startswith('file:'):
+                filename = filename[7:]
+            filename = os.path.abspath(filename)
+        # after a reconfiguration, the file may be a different one
+        for handler in self.snapshotlog.handlers[:]:
+            if getattr(handler, 'baseFilename', None) != filename:
+                self.snapshotlog.removeHandler(handler)
+                handler.close()
+        if filename and not self.snapshotlog.handlers:
+            handler = logging.FileHandler(filename)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.snapshotlog.addHandler(handler)
+        # do not repeat the output in the main log file
+        self.snapshotlog.propagate = filename is None
+
+
     def _get_cvmfs_config(self):
 
         self.cvmfsconf = SingleSectionConfig()
         self.cvmfsconf.ascii(
-            open('/etc/cvmfs/repositories.d/%s/server.conf' %self.repositoryname)
+            open('%s/%s/server.conf' %(self.manager.service.cvmfsrepositoriesdir, self.repositoryname))
         )
 
 
@@ -251,22 +834,60 @@ class Repository(threading.Thread):
         return CVMFS_UPSTREAM_STORAGE
 
 
+    def _get_cvmfs_stratum0_host(self):
+        '''
+        returns the Stratum-0 host name, 
+        or None if it cannot be found
+        '''
+        try:
+            return urlparse.urlsplit(self.cvmfsconf.get('CVMFS_STRATUM0')).hostname
+        except:
+            self.log.warning('failed to get the Stratum-0 host for repository %s' %self.repositoryname)
+            return None
+
+
     def _snapshotdate(self):
         '''
         returns, in seconds since EPOCH, last time a repository was updated
         '''
         try:
-            timestamp = open(self.timestampfilename)\
-                        .readlines()\
-                        [0]\
-                        [:-1]
-            secs = utils.date2seconds(timestamp)
-            return secs
+            return self.manager.filewatcher.get(self.timestampfilename, readtimestamp)
         except:
             self.log.warning('failed to open file %s. Returning 0' %self.timestampfilename)
             return 0
 
 
+    def close(self):
+        '''
+        releases what the repository, and its acceptance plugins,
+        registered in the FileWatcher and the ManifestPoller,
+        once it is removed from the configuration.
+        Its requests already queued or running are not affected.
+        '''
+        self.manager.filewatcher.unwatch(self.timestampfilename, self._timestampchanged)
+        self.configlock.acquire()
+        try:
+            plugins = list(self.acceptanceplugins)
+        finally:
+            self.configlock.release()
+        for acceptance in plugins:
+            try:
+                acceptance.close()
+            except Exception, ex:
+                self.log.warning('failed to close acceptance plugin %s: %s' %(acceptance, ex))
+
+
+    def _timestampchanged(self, timestamp):
+        '''
+        called by the FileWatcher when the timestamp file changes,
+        also for snapshots done outside the service
+        '''
+        if timestamp > self.last_success:
+            self.log.info('new snapshot for repository %s, done at %s' %(self.repositoryname, timestamp))
+            self.last_success = timestamp
+            self.last_published = max(self.last_published, timestamp)
+
+
     def run(self):
         '''
         Method called by thread.start()
@@ -276,83 +897,415 @@ class Repository(threading.Thread):
         self.log.debug('starting Repository thread main loop...')
         while not self.stopevent.isSet():
             self.log.trace('Repository loop')
-            age = int(time.time()) - self.last_attempt
-
-            if self.last_attempt == 0:
-                self.log.info('Repository %s never been replicated yet' %self.repositoryname)
-            else:
-                self.log.info('Last time repository %s was updated (or tried) was %s seconds ago' %(self.repositoryname, age))
-
-            if self.interval > age:
-                t_wait = self.interval - age
+            t_wait = self._next_due() - int(time.time())
+            if t_wait > 0 and not self.triggered:
                 self.log.info('waiting %s seconds for repository %s' %(t_wait, self.repositoryname))
                 time.sleep(t_wait)
+                # a triggered cycle may have run meanwhile
+                continue
+
+            self.cyclelock.acquire()
+            try:
+                if self.triggered or self.next_due <= int(time.time()):
+                    self._runcycle()
+            finally:
+                self.cyclelock.release()
+
+
+    def _runcycle(self):
+        '''
+        one iteration of the main loop, blocking.
+        Must be called with the cyclelock acquired.
+        '''
+        self.triggered = False
+        trigger = self._taketrigger()
+        try:
+            req = None
+            if self._verify_acceptance():
+                req = self._request(trigger)
+            self._cycledone(req)
+        except AcceptancePluginFailed, ex:
+            self._abort(ex)
+        except Exception, ex:
+            # as in "loop" mode, the thread keeps running
+            self.log.error('cycle for repository %s raised an exception: %s' %(self.repositoryname, ex))
+            self._cycledone()
+
+
+    def trigger(self, priority=None, preempt=False):
+        '''
+        starts a cycle now, instead of waiting for the next due time.
+        Its request, if accepted, is queued with priority, if higher.
+        If preempt is True, and all agents are busy, 
+        the running snapshot with the lowest priority, if lower,
+        is stopped to free its slot.
+        If a cycle is already running, another one starts after it.
+        Returns "scheduled", "pending" (after the current cycle), 
+        or "stopped".
+        '''
+        if self.stopevent.isSet():
+            return 'stopped'
+        self.triggerpriority = priority
+        self.triggerpreempt = preempt
+        if self.manager.scheduler:
+            return self.manager.scheduler.trigger(self)
+        # the flag is set before trying the lock, 
+        # so the thread running a cycle always sees it 
+        self.triggered = True
+        if not self.cyclelock.acquire(False):
+            return 'pending'
+        def run():
+            # triggers arriving while the cycle runs 
+            # find the lock taken, so they are run here
+            while True:
+                try:
+                    self._runcycle()
+                finally:
+                    self.cyclelock.release()
+                if self.stopevent.isSet() or not self.triggered or not self.cyclelock.acquire(False):
+                    break
+        thread = threading.Thread(target=run, name='trigger[%s]' %self.repositoryname)
+        thread.setDaemon(True)
+        thread.start()
+        return 'scheduled'
+
+
+    def _taketrigger(self):
+        '''
+        returns, and clears, the priority and the preempt flag 
+        of the trigger, if any, at the start of a cycle.
+        So they only apply to the request of this cycle,
+        even if it is not accepted
+        '''
+        trigger = (self.triggerpriority, self.triggerpreempt)
+        self.triggerpriority = None
+        self.triggerpreempt = False
+        return trigger
+
 
+    def _newrequest(self, trigger=(None, False)):
+        '''
+        returns a new ReplicaRequest, 
+        with the priority of the trigger, if any and higher,
+        once the post plugins of the previous one are done.
+        trigger is what _taketrigger() returned
+        '''
+        triggerpriority, preempt = trigger
+        priority = self.priority
+        if triggerpriority is not None:
+            priority = max(priority, triggerpriority)
+        req = ReplicaRequest(self, priority)
+        req.urgent = preempt
+        # post plugins still running in background 
+        # from the previous request must finish first,
+        # before it is queued, so it does not hold an agent meanwhile
+        span = req.trace.begin('postwait')
+        self._waitpost()
+        req.trace.end(span)
+        return req
+
+
+    def _enqueue(self, req):
+        '''
+        puts a request in the queue.
+        If it is urgent, a running request may be preempted
+        '''
+        self.manager.replicarequestqueue.put(req)
+        if req.urgent:
+            self.manager.preempt(req)
+
+
+    def _next_due(self):
+        '''
+        returns, in seconds since EPOCH, 
+        when the next replication cycle should start
+        '''
+        age = int(time.time()) - self.last_attempt
+
+        if self.last_attempt == 0:
+            self.log.info('Repository %s never been replicated yet' %self.repositoryname)
+        else:
+            self.log.info('Last time repository %s was updated (or tried) was %s seconds ago' %(self.repositoryname, age))
+
+        return self.next_due
+
+
+    def _cycledone(self, req=None):
+        '''
+        records the end of one replication cycle.
+        req is the ReplicaRequest, 
+        or None if the acceptance plugins did not accept it.
+        A merged request does not count: the one it was merged into does
+        '''
+        self.last_attempt = int(time.time())
+        if req is not None and req.merged:
+            req = None
+        if req is not None and not (req.cancelled or req.preempted):
+            if req.status == 0:
+                self.failures = 0
+            else:
+                self.failures += 1
+        self.next_due = self._due(self.last_attempt)
+        journal = self.manager.journal
+        if journal:
             try:
-                if self._verify_acceptance():
-                    self._request()
-                    self._runpost()
-                self.last_attempt = int(time.time())
-            except AcceptancePluginFailed, ex:
-                msg = 'An AcceptancePluginFailed exception was raised with message '
-                msg += '"%s".' %ex
-                msg += ' Stopping thread for repository %s' %self.repositoryname
-                self.log.critical(msg)
-                self.stopevent.set()
+                journal.record(self.repositoryname, self.state())
+            except Exception, ex:
+                self.log.error('failed to record the state in the journal: %s' %ex)
+        if req is not None and req.preempted:
+            # another cycle right after this one, with the usual priority
+            self.trigger()
+
+
+    def cycle(self, callback):
+        '''
+        non-blocking version of one iteration 
+        of the main loop, used by the Scheduler.
+        It checks the acceptance plugins, and 
+        if they all say OK, queues a request.
+        callback(self) is called once the cycle is complete,
+        from the pool of threads of the Scheduler, 
+        unless the repository has to be stopped.
+        '''
+        trigger = self._taketrigger()
+        try:
+            accepted = self._verify_acceptance()
+        except AcceptancePluginFailed, ex:
+            self._abort(ex)
+            return
+
+        if not accepted:
+            self._cycledone()
+            callback(self)
+            return
+
+        def done(req):
+            self.log.info('Request for repository %s processed with final status %s' %(self.repositoryname, req.status)) 
+            self._process_request(req)
+            self._cycledone(req)
+            callback(self)
+
+        def handoff(req):
+            # called by the agent that ran the snapshot, which is free 
+            # for another request once the report and post plugins 
+            # and the journal are left to the pool of the scheduler
+            self.manager.scheduler.cyclepool.submit(done, req)
+
+        req = self._newrequest(trigger)
+        req.add_done_callback(handoff)
+        self._enqueue(req)
+
+
+    def _abort(self, ex):
+        '''
+        stops handling this repository 
+        after an AcceptancePluginFailed exception
+        '''
+        msg = 'An AcceptancePluginFailed exception was raised with message '
+        msg += '"%s".' %ex
+        msg += ' Stopping thread for repository %s' %self.repositoryname
+        self.log.critical(msg)
+        self.stopevent.set()
 
 
     def _verify_acceptance(self):
         '''
-        checks all acceptance plugins say OK
+        checks all acceptance plugins say OK.
+        If not, the disk space reserved by them, if any, is released
+        once all of them have finished. 
         '''
-        for acceptance in self.acceptanceplugins:
-            if not acceptance.verify():
+        release = lambda: self.manager.freespace.release(self.repositoryname, written=False)
+        acceptanceround = AcceptanceRound(release, self.manager.acceptanceoverdue)
+        accepted = False
+        try:
+            accepted = self._run_acceptance(acceptanceround)
+            return accepted
+        finally:
+            if not accepted:
+                acceptanceround.reject()
+
+
+    def _run_acceptance(self, acceptanceround):
+        '''
+        runs all acceptance plugins.
+        
+        All plugins run at the same time in the pool of threads
+        shared by all repositories. 
+        Answer is False as soon as one of them returns False,
+        raises an exception, or does not answer before its deadline.
+        The deadline counts from the moment the plugin starts running,
+        not while it waits for a free thread in the pool.
+        A plugin past its deadline keeps its thread until it returns.
+        acceptanceround is the AcceptanceRound( ) told when each plugin finishes,
+        including those still running after the answer.
+        '''
+        # the same plugins and timeouts for the whole round,
+        # even if the configuration is reloaded meanwhile
+        self.configlock.acquire()
+        try:
+            plugins = list(self.acceptanceplugins)
+            timeouts = self.acceptancetimeouts
+            latencies = self.acceptancelatency
+        finally:
+            self.configlock.release()
+
+        results = Queue.Queue()
+
+        # messages from the pool are
+        #   ('started', plugin, start time)
+        #   ('done', plugin, (answer, exception, latency))
+        def verify(acceptance):
+            before = time.time()
+            results.put(('started', acceptance, before))
+            out = False
+            error = None
+            try:
+                out = acceptance.verify()
+            except Exception, ex:
+                error = ex
+            results.put(('done', acceptance, (out, error, time.time() - before)))
+            acceptanceround.finish(acceptance)
+
+        # plugin -> deadline, None until it starts or if it has no timeout
+        pending = {}
+        started = {}
+        for acceptance in plugins:
+            pending[acceptance] = None
+            acceptanceround.start(acceptance)
+            self.manager.acceptancepool.submit(verify, acceptance)
+
+        while pending:
+            deadlines = [d for d in pending.values() if d is not None]
+            try:
+                if deadlines:
+                    remaining = min(deadlines) - time.time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    kind, acceptance, value = results.get(True, remaining)
+                else:
+                    kind, acceptance, value = results.get()
+            except Queue.Empty:
+                now = time.time()
+                for acceptance, deadline in pending.items():
+                    if deadline is not None and deadline <= now:
+                        name = acceptance.__class__.__name__
+                        latencies[name] = now - started[acceptance]
+                        acceptanceround.expire(acceptance)
+                        self.manager.metrics.inc('cvmfsreplica_acceptance_timeouts_total', {'plugin': name})
+                        self.log.warning('acceptance plugin %s did not answer in %s seconds' %(acceptance, timeouts.get(name)))
+                return False
+
+            name = acceptance.__class__.__name__
+            if kind == 'started':
+                started[acceptance] = value
+                if timeouts.get(name) is not None:
+                    pending[acceptance] = value + timeouts[name]
+                continue
+
+            out, error, latency = value
+            del pending[acceptance]
+            latencies[name] = latency
+            self.manager.metrics.observe('cvmfsreplica_acceptance_latency_seconds', latency, {'plugin': name})
+            self.log.debug('acceptance plugin %s answered in %.3f seconds' %(acceptance, latency))
+            if error is not None:
+                if isinstance(error, AcceptancePluginFailed):
+                    raise error
+                self.log.error('acceptance plugin %s raised an exception: %s' %(acceptance, error))
+                return False
+            if not out:
                 self.log.info('acceptance plugin %s returned False' %acceptance)
                 return False
+
         self.log.info('all acceptance plugins returned True. Ready to try snapshot')
         return True
 
 
-    def _request(self):
+    def _request(self, trigger=(None, False)):
         '''
         proceed with the request, 
         and post-request steps
         '''
-        rc = self._put_request()
-        if rc == 0:
+        req = self._put_request(trigger)
+        self._process_request(req)
+        return req
+
+
+    def _process_request(self, req):
+        '''
+        reports the final status of a request,
+        runs the post plugins, and writes the trace of the request.
+        A request merged into another one is only traced:
+        the other one is reported, and runs the post plugins
+        '''
+        req.trace.mark('noticed')
+        if req.merged:
+            self.log.info('request for repository %s was merged, nothing else to do' %self.repositoryname)
+            if self.manager.tracer:
+                self.manager.tracer.write(req.trace)
+            return
+        span = req.trace.begin('report')
+        self._process_status(req)
+        req.trace.end(span)
+        span = req.trace.begin('post')
+        self._runpost()
+        req.trace.end(span)
+        if self.manager.tracer:
+            self.manager.tracer.write(req.trace)
+
+
+    def _process_status(self, req):
+        '''
+        reports the final status of a request.
+        Cancelled and preempted requests are not reported as failures.
+        '''
+        if req.cancelled:
+            self.log.info('request for repository %s cancelled' %self.repositoryname)
+            # it never got to an agent, which would have released it
+            self.manager.freespace.release(self.repositoryname, written=False)
+            return
+        if req.preempted:
+            self.log.info('request for repository %s preempted' %self.repositoryname)
+            return
+        if req.status == 0:
+            self.last_success = time.time()
             self._notify_success()
         else:
-            self._notify_failure()
+            msg = None
+            if req.outputtail:
+                msg = 'Last lines of output from cvmfs_server snapshot:\n%s' %req.outputtail
+            self._notify_failure(msg)
         self.last_published = int(time.time())
 
 
-    def _put_request(self):
+    def _put_request(self, trigger=(None, False)):
         '''
         puts a request object in the queue, 
         and waits for it to be done
         '''
 
-        req = ReplicaRequest(self)
-        self.manager.replicarequestqueue.put(req)
-        while not req.done:
-            time.sleep(1)
-        rc = req.status
+        req = self._newrequest(trigger)
+        self._enqueue(req)
+        rc = req.wait()
         self.log.info('Request for repository %s processed with final status %s' %(self.repositoryname, rc)) 
-        return rc
+        return req
 
 
     def _notify_success(self):
          for report in self.reportplugins:
-             report.notifysuccess() 
+             report.notifysuccess(self) 
 
-    def _notify_failure(self):
+    def _notify_failure(self, msg=None):
          for report in self.reportplugins:
-             report.notifyfailure() 
+             report.notifyfailure(self, msg) 
 
     def _runpost(self):
          for post in self.postplugins:
              post.run() 
 
+    def _waitpost(self):
+         for post in self.postplugins:
+             post.wait() 
+
 
     def join(self,timeout=None):
         '''
@@ -363,6 +1316,117 @@ class Repository(threading.Thread):
         threading.Thread.join(self, timeout)
 
 
+# =============================================================================
+#       CLASS ACCEPTANCE ROUND
+# =============================================================================
+
+class AcceptanceRound(object):
+    """
+    class to keep track of the acceptance plugins of one cycle 
+    still running in the shared pool.
+
+    When the snapshot is not accepted, the answer is known as soon as 
+    one plugin says no, or misses its deadline, but others may still 
+    be running, and reserve disk space afterwards.
+    The space is released only once all of them have finished.
+
+    It also counts the plugins still running after their deadline,
+    each one holding a thread of the pool.
+    """
+
+    def __init__(self, release, overdue=None):
+        """
+        release is the function that releases the space reserved
+        overdue, if given, is an OverdueCounter( ) object
+        """
+        self.release = release
+        self.overdue = overdue
+        self.lock = threading.Lock()
+        # plugins submitted and not finished yet
+        self.running = set()
+        # plugins still running after their deadline
+        self.expired = set()
+        self.rejected = False
+
+
+    def start(self, acceptance):
+        '''
+        records one plugin submitted to the pool
+        '''
+        self.lock.acquire()
+        try:
+            self.running.add(acceptance)
+        finally:
+            self.lock.release()
+
+
+    def finish(self, acceptance):
+        '''
+        records one plugin finished.
+        The last one releases the space, if not accepted
+        '''
+        self.lock.acquire()
+        try:
+            self.running.discard(acceptance)
+            expired = acceptance in self.expired
+            self.expired.discard(acceptance)
+            release = not self.running and self.rejected
+        finally:
+            self.lock.release()
+        if expired and self.overdue:
+            self.overdue.add(-1)
+        if release:
+            self.release()
+
+
+    def expire(self, acceptance):
+        '''
+        records that a plugin did not answer before its deadline
+        '''
+        self.lock.acquire()
+        try:
+            expired = acceptance in self.running and acceptance not in self.expired
+            if expired:
+                self.expired.add(acceptance)
+        finally:
+            self.lock.release()
+        if expired and self.overdue:
+            self.overdue.add(1)
+
+
+    def reject(self):
+        '''
+        records that the snapshot was not accepted.
+        The space is released now, if no plugin is running
+        '''
+        self.lock.acquire()
+        try:
+            self.rejected = True
+            release = not self.running
+        finally:
+            self.lock.release()
+        if release:
+            self.release()
+
+
+class OverdueCounter(object):
+    """
+    number of acceptance plugins, from all repositories,
+    still running after their deadline
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def add(self, n):
+        self.lock.acquire()
+        try:
+            self.value += n
+        finally:
+            self.lock.release()
+
+
 # =============================================================================
 #       CLASS REPLICA REQUEST 
 # =============================================================================
@@ -378,16 +1442,35 @@ class ReplicaRequest(object):
     and grabbed by ReplicaThreadAgent( ) threads. 
     """
 
-    def __init__(self, repository):
+    def __init__(self, repository, priority=None):
+        '''
+        priority is, if different from the one of the repository,
+        the priority of this request
+        '''
 
         self.log = logging.getLogger('cvmfsreplica.replicarequest')
         self.repository = repository
         self.repositoryname = self.repository.repositoryname
         self.priority = self.repository.priority
+        if priority is not None:
+            self.priority = priority
         self.ntrials = self.repository.ntrials
+        self.host = self.repository.upstreamhost
         self.done = False
         self.status = None 
+        self.doneevent = threading.Event()
+        self.callbacks = []
         self.timestamp = int( time.time() )  # the time this Request object was created
+        self.enqueued = None  # the time it was put in the queue
+        self.dequeued = None  # the time an agent got it from the queue
+        self.outputtail = None  # last lines of output from the last snapshot attempt
+        self.exitreason = None  # why the last snapshot attempt finished: exit, signal, timeout or preempted
+        self.trace = RequestTrace(self.repositoryname)  # timeline of the request
+        self.urgent = False  # True if it can preempt a running request with lower priority
+        self.process = None  # SupervisedProcess of the snapshot attempt running, if any
+        self.cancelled = False  # True if removed from the queue before running
+        self.preempted = False  # True if stopped to free its slot for a more urgent request
+        self.merged = False  # True if merged into another request, which is the one processed
 
 
     def __cmp__(self, other):
@@ -410,17 +1493,25 @@ class ReplicaRequest(object):
     def run(self):
 
         self.log.info('running snapshot for repository %s' %self.repositoryname)    
+        rc = None
         trial = 1 
-        while trial <= self.ntrials:
+        while trial <= self.ntrials and not self.preempted:
             self.log.info('attempt %s to snapshot for repository %s' %(trial, self.repositoryname))
-            rc = self._run_snapshot()
+            span = self.trace.begin('trial-%s' %trial)
+            rc = self._run_snapshot(trial)
+            self.trace.end(span)
             if rc == 0: 
                 self.log.info('snapshot for repository %s done successfully' %self.repositoryname)
                 break
             else:
                 self.log.error('attempt %s to snapshot for repository %s failed' %(trial, self.repositoryname))
+                if self.preempted:
+                    self.log.warning('snapshot for repository %s preempted, no more attempts' %self.repositoryname)
+                    break
                 if trial < self.ntrials:
+                    span = self.trace.begin('backoff-%s' %trial)
                     self._wait_between_trials(trial)
+                    self.trace.end(span)
                 trial += 1
         else:
             self.log.critical('snapshot for repository %s failed' %self.repositoryname)
@@ -438,30 +1529,143 @@ class ReplicaRequest(object):
         time.sleep(waittime)
 
 
-    def _run_snapshot(self):
+    def _run_snapshot(self, trial=1):
 
         self.log.info('attempt to do a snapshot')
 
         before = time.time()
 
-        cmd = 'cvmfs_server snapshot %s' %self.repositoryname
-        #p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        #(out, err) = p.communicate()
-        #rc = p.returncode
-        tcommand = utils.TimeoutCommand(cmd)
-        tcommand.run(self.repository.timeout)
-        out = tcommand.out
-        err = tcommand.err
-        rc = tcommand.rc
-
-        self.log.info('out, err and rc from cvmfs_server snapshot command = %s, %s, %s' %(out, err, rc))
+        cmd = self.repository.manager.cvmfsservercmd + ['snapshot', self.repositoryname]
+        # the output is streamed to the repository snapshot logger,
+        # and only the last lines are kept in memory
+        sp = self.repository.manager.supervisor.submit(cmd,
+                                                       self.repository.timeout,
+                                                       self.repository.snapshotlog.info,
+                                                       self.repository.snapshotoutputlines)
+        self.process = sp
+        # preempt() may have been called before the process existed
+        if self.preempted:
+            self.repository.manager.supervisor.terminate(sp)
+        rc = sp.wait()
+        self.process = None
+        self.outputtail = '\n'.join([l for l in (sp.out, sp.err) if l])
+        self.exitreason = sp.reason
+
+        if self.preempted:
+            self.exitreason = 'preempted'
+            self.log.warning('cvmfs_server snapshot command for repository %s preempted' %self.repositoryname)
+        elif sp.reason == 'timeout':
+            self.log.error('cvmfs_server snapshot command for repository %s timed out after %s seconds' %(self.repositoryname, self.repository.timeout))
+        elif sp.reason == 'signal':
+            self.log.error('cvmfs_server snapshot command for repository %s killed by signal %s' %(self.repositoryname, sp.signal))
+        else:
+            self.log.info('rc from cvmfs_server snapshot command = %s' %rc)
         delta = time.time() - before
         self.log.info('It took %s seconds to perform the snapshot for repository %s' %(delta, self.repositoryname))
+        self._record(before, delta, trial, rc, sp.timedout)
 
         return rc
 
-    def setdone(self):
+
+    def _record(self, start, duration, trial, rc, timedout):
+        '''
+        records the snapshot attempt in the metrics,
+        and in the history database, if any
+        '''
+        metrics = self.repository.manager.metrics
+        if timedout:
+            result = 'timeout'
+            metrics.inc('cvmfsreplica_snapshot_timeouts_total')
+        elif rc == 0:
+            result = 'success'
+        else:
+            result = 'failure'
+        metrics.inc('cvmfsreplica_snapshot_attempts_total', {'result': result})
+        metrics.observe('cvmfsreplica_snapshot_duration_seconds', duration, {'result': result})
+        if trial > 1:
+            metrics.inc('cvmfsreplica_snapshot_retries_total')
+
+        history = self.repository.manager.history
+        if history is None:
+            return
+        try:
+            history.record(self.repositoryname, start, duration, trial, rc, timedout)
+        except Exception, ex:
+            self.log.error('failed to record the snapshot attempt in the history database: %s' %ex)
+
+
+    def merge(self, other):
+        '''
+        merges other, a new request for the same repository, 
+        into this one, still in the queue.
+        This one keeps the higher priority and the earlier timestamp,
+        and other is done when this one is done, with the same result.
+        '''
+        self.priority = max(self.priority, other.priority)
+        self.timestamp = min(self.timestamp, other.timestamp)
+        self.urgent = self.urgent or other.urgent
+        other.merged = True
+        other.trace.mark('merged')
+        self.add_done_callback(other._follow)
+
+
+    def _follow(self, req):
+        '''
+        done callback of the request this one has been merged into
+        '''
+        self.outputtail = req.outputtail
+        self.exitreason = req.exitreason
+        self.cancelled = req.cancelled
+        self.preempted = req.preempted
+        self.setdone(req.status)
+
+
+    def preempt(self):
+        '''
+        stops the running snapshot, to free its slot 
+        for a more urgent request. 
+        No more attempts are done.
+        '''
+        self.preempted = True
+        self.trace.mark('preempted')
+        sp = self.process
+        if sp is not None:
+            self.repository.manager.supervisor.terminate(sp)
+
+
+    def setdone(self, status=None):
+        '''
+        records the final status of the request
+        and wakes up whoever is waiting for it
+        '''
+        self.status = status
         self.done = True
+        self.trace.status = status
+        self.trace.mark('done')
+        self.doneevent.set()
+        for callback in self.callbacks:
+            try:
+                callback(self)
+            except Exception, ex:
+                self.log.error('callback for repository %s raised an exception: %s' %(self.repositoryname, ex))
+
+
+    def add_done_callback(self, callback):
+        '''
+        callback(req) will be called once the request is done,
+        from the thread that processed it
+        '''
+        self.callbacks.append(callback)
+
+
+    def wait(self):
+        '''
+        blocks, with no periodic wake ups, 
+        until the request has been processed.
+        Returns the final status.
+        '''
+        self.doneevent.wait()
+        return self.status
 
 
 # =============================================================================
@@ -479,12 +1683,330 @@ class ReplicaRequest(object):
 class ReplicaRequestQueue(Queue.PriorityQueue):
     """
     Pipe where ReplicaRequest objects are being queue'ed.
+
+    It also keeps track of the requests being run by the agents,
+    so the number of them running at the same time can be limited.
+    Agents must call release( ) once a request is done.
+
+    Optionally, there are also limits per Stratum-0 host.
+    Requests for hosts that cannot start a new snapshot
+    are skipped, and the next request, by priority, 
+    for another host is given instead.
+
+    There is never more than one request per repository in the queue:
+
+        -- a new request for a repository already pending
+           is merged into the one in the queue, see ReplicaRequest.merge( )
+
+        -- a new request for a repository whose snapshot is running
+           is deferred, and only queued once that snapshot is done,
+           so it sees the revisions published meanwhile
     """
 
-    def __init__(self):
+    def __init__(self, hostlimits=None):
+        """
+        hostlimits is a HostLimits( ) object, if any
+        """
 
         Queue.PriorityQueue.__init__(self)
         self.log = logging.getLogger('cvmfsreplica.replicarequestqueue')
+        self.closed = False
+        # maximum number of requests running at the same time.
+        # None means no limit, other than the number of agents
+        self.limit = None
+        # requests given to the agents and not released yet
+        self.running = []
+        # repository name -> request in the queue
+        self.pending = {}
+        # repository name -> request waiting for the one running
+        self.deferred = {}
+        # number of requests released so far
+        self.completed = 0
+        self.hostlimits = hostlimits
+
+
+    def put(self, req):
+        '''
+        queues a new request, unless it is merged
+        into another one for the same repository, or deferred.
+        If the queue has been closed already, 
+        the request is marked as done with no status.
+        '''
+        name = req.repositoryname
+        self.not_empty.acquire()
+        try:
+            if not self.closed:
+                req.enqueued = time.time()
+                req.trace.mark('enqueued')
+                if name in self.pending:
+                    self.log.info('request for repository %s merged with the one already queued' %name)
+                    self.pending[name].merge(req)
+                    heapq.heapify(self.queue)
+                    self.not_empty.notify()
+                elif name in self.deferred:
+                    self.log.info('request for repository %s merged with the one already deferred' %name)
+                    self.deferred[name].merge(req)
+                elif [r for r in self.running if r.repositoryname == name]:
+                    self.log.info('snapshot for repository %s running, request deferred until it is done' %name)
+                    req.trace.mark('deferred')
+                    self.deferred[name] = req
+                else:
+                    self._queue(req)
+                return
+        finally:
+            self.not_empty.release()
+        self.log.warning('queue is closed, request for repository %s is discarded' %name)
+        req.setdone()
+
+
+    def _queue(self, req):
+        '''
+        puts a request in the heap.
+        Must be called with the lock acquired.
+        '''
+        self._put(req)
+        self.pending[req.repositoryname] = req
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+
+
+    def get(self):
+        '''
+        blocks until a request is available, 
+        with no periodic wake ups.
+        Returns None when the queue has been closed.
+        '''
+        self.not_empty.acquire()
+        try:
+            while not self.closed:
+                timeout = None
+                if self._qsize() and self._canrun():
+                    req, timeout = self._next()
+                    if req is not None:
+                        del self.pending[req.repositoryname]
+                        req.dequeued = time.time()
+                        req.trace.mark('dequeued')
+                        self.running.append(req)
+                        self.not_full.notify()
+                        return req
+                # the timeout is only set when the requests
+                # are waiting for the rate limit of their hosts
+                self.not_empty.wait(timeout)
+            return None
+        finally:
+            self.not_empty.release()
+
+
+    def _canrun(self):
+        return self.limit is None or len(self.running) < self.limit
+
+
+    def _next(self):
+        '''
+        removes and returns the request with the highest priority
+        whose host can start a new snapshot.
+        If there is none, returns None and how many seconds 
+        until one of them is allowed by the rate limit of its host,
+        or None if they are all limited by the number of 
+        snapshots running on their hosts.
+        '''
+        if self.hostlimits is None:
+            return self._get(), None
+
+        now = time.time()
+        timeout = None
+        for req in sorted(self.queue):
+            wait = self.hostlimits.wait(req.host, now)
+            if wait == 0:
+                self._remove(self.queue, req)
+                heapq.heapify(self.queue)
+                self.hostlimits.start(req.host, now)
+                return req, None
+            if wait is not None and (timeout is None or wait < timeout):
+                timeout = wait
+        return None, timeout
+
+
+    def _remove(self, requests, req):
+        '''
+        removes req from the list requests.
+        It looks for the object itself: list.remove() would take 
+        the first request equal to it, as for __cmp__(), 
+        that is, any other with the same priority and timestamp.
+        '''
+        for i in range(len(requests)):
+            if requests[i] is req:
+                del requests[i]
+                return
+        raise ValueError('request for repository %s not found' %req.repositoryname)
+
+
+    def release(self, req):
+        '''
+        records that a request given by get() is done
+        '''
+        self.not_empty.acquire()
+        try:
+            self._remove(self.running, req)
+            self.completed += 1
+            if self.hostlimits is not None:
+                self.hostlimits.finish(req.host)
+            deferred = self.deferred.pop(req.repositoryname, None)
+            if deferred is not None and not self.closed:
+                deferred.trace.mark('enqueued')
+                self._queue(deferred)
+            self.not_empty.notifyAll()
+        finally:
+            self.not_empty.release()
+
+
+    def requests(self):
+        '''
+        returns a list of dictionaries, one per request: 
+        first the running ones, then the pending ones, 
+        in the order they will be given to the agents 
+        when their hosts allow it.
+        Each dictionary has:
+
+            -- repository
+            -- host: the Stratum-0 host
+            -- priority
+            -- state: "running", "pending" or "deferred"
+               (waiting for the snapshot of the same repository running)
+            -- waited: seconds in the queue
+            -- running: seconds since an agent got it, or None
+        '''
+        now = time.time()
+        self.not_empty.acquire()
+        try:
+            running = list(self.running)
+            pending = sorted(self.queue)
+            deferred = sorted(self.deferred.values())
+        finally:
+            self.not_empty.release()
+
+        out = []
+        for req in running:
+            out.append({'repository': req.repositoryname,
+                        'host': req.host,
+                        'priority': req.priority,
+                        'state': 'running',
+                        'waited': req.dequeued - req.enqueued,
+                        'running': now - req.dequeued})
+        for state, requests in (('pending', pending), ('deferred', deferred)):
+            for req in requests:
+                out.append({'repository': req.repositoryname,
+                            'host': req.host,
+                            'priority': req.priority,
+                            'state': state,
+                            'waited': now - req.enqueued,
+                            'running': None})
+        return out
+
+
+    def reprioritize(self, repositoryname, priority):
+        '''
+        changes the priority of the pending, or deferred, 
+        request for a repository, and re-orders the queue.
+        Returns the number of requests changed.
+        '''
+        self.not_empty.acquire()
+        try:
+            changed = 0
+            req = self.deferred.get(repositoryname)
+            if req is not None:
+                req.priority = priority
+                changed += 1
+            req = self.pending.get(repositoryname)
+            if req is not None:
+                req.priority = priority
+                heapq.heapify(self.queue)
+                self.not_empty.notifyAll()
+                changed += 1
+            return changed
+        finally:
+            self.not_empty.release()
+
+
+    def cancel(self, repositoryname):
+        '''
+        removes the pending, or deferred, request for a repository 
+        from the queue, and marks it as done with no status.
+        Requests already running are not affected.
+        Returns the number of requests cancelled.
+        '''
+        self.not_empty.acquire()
+        try:
+            cancelled = []
+            req = self.deferred.pop(repositoryname, None)
+            if req is not None:
+                cancelled.append(req)
+            req = self.pending.pop(repositoryname, None)
+            if req is not None:
+                self._remove(self.queue, req)
+                heapq.heapify(self.queue)
+                self.not_full.notify()
+                cancelled.append(req)
+        finally:
+            self.not_empty.release()
+        for req in cancelled:
+            req.cancelled = True
+            req.trace.mark('cancelled')
+            req.setdone()
+        return len(cancelled)
+
+
+    def preempt(self, priority):
+        '''
+        preempts the running request with the lowest priority,
+        if lower than priority.
+        If several have the same one, the newest is chosen.
+        Returns that request, or None.
+        '''
+        self.not_empty.acquire()
+        try:
+            candidates = [req for req in self.running if req.priority < priority and not req.preempted]
+        finally:
+            self.not_empty.release()
+        if not candidates:
+            return None
+        req = max(candidates)
+        req.preempt()
+        return req
+
+
+    def setlimit(self, limit):
+        '''
+        changes the maximum number of requests running at the same time.
+        Requests already running are not affected.
+        '''
+        self.not_empty.acquire()
+        try:
+            self.limit = limit
+            self.not_empty.notifyAll()
+        finally:
+            self.not_empty.release()
+
+
+    def close(self):
+        '''
+        closes the queue.
+        Requests still pending are marked as done with no status,
+        and all threads blocked in get() are woken up.
+        '''
+        self.not_empty.acquire()
+        try:
+            self.closed = True
+            pending = self.deferred.values()
+            while self._qsize():
+                pending.append(self._get())
+            self.pending.clear()
+            self.deferred.clear()
+            self.not_empty.notifyAll()
+        finally:
+            self.not_empty.release()
+        for req in pending:
+            req.setdone()
 
 
 # =============================================================================
@@ -526,20 +2048,25 @@ class ReplicaAgent(threading.Thread):
         '''
         
         self.log.debug('starting ReplicaAgent thread main loop...')    
-        ### FIXME
-        ### FAKE IMPLEMENTATION FOR NOW
 
         while not self.stopevent.isSet():
-            time.sleep(1)
             self.log.trace('ReplicaAgent loop') 
-            if not self.manager.replicarequestqueue.empty():
-                req = self.manager.replicarequestqueue.get()
-                self.log.info('got a replica request object for repository %s' %req.repositoryname)
+            # blocks until there is something to do
+            req = self.manager.replicarequestqueue.get()
+            if req is None:
+                self.log.debug('request queue closed')
+                break
+            self.log.info('got a replica request object for repository %s' %req.repositoryname)
+            rc = None
+            try:
                 rc = req.run()
-                self.log.info('request processed')
-                req.setdone()
-                req.status = rc
-            
+            except Exception, ex:
+                self.log.error('request for repository %s raised an exception: %s' %(req.repositoryname, ex))
+            self.log.info('request processed')
+            # the disk space used by the snapshot is already on disk
+            self.manager.freespace.release(req.repositoryname)
+            self.manager.replicarequestqueue.release(req)
+            req.setdone(rc)
 
 
     def join(self,timeout=None):
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""
+module with the single-loop scheduler,
+an alternative to one thread per repository
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+from cvmfsreplica.utils import WakeupPipe, WorkerPool
+
+
+# =============================================================================
+#       CLASS SCHEDULER
+# =============================================================================
+
+class Scheduler(threading.Thread):
+    """
+    class to drive all Repository( ) objects
+    from a single thread.
+
+    It keeps a heap with the next due time
+    of every repository. When a repository is due,
+    its cycle( ) is run, in a small pool of threads, 
+    which checks the acceptance plugins
+    and queues a ReplicaRequest for the ReplicaAgent( ) pool.
+    So a slow cycle, for example for a Stratum-0 that takes 
+    long to answer, does not delay the other repositories.
+    Once the request is done, the repository
+    is scheduled again.
+
+    While there is nothing due, the thread is blocked
+    in select( ), either until the next due time
+    or until a new entry is scheduled.
+    """
+
+    def __init__(self, manager, nworkers=10):
+        """
+        manager is a reference to the ReplicaManager class
+        that created object Scheduler
+        nworkers is the number of threads to run the cycles
+        """
+
+        threading.Thread.__init__(self) # init the thread
+        self.log = logging.getLogger('cvmfsreplica.scheduler')
+        self.stopevent = threading.Event()
+
+        self.manager = manager
+
+        # entries are (due time, sequence number, Repository object)
+        # the sequence number keeps the order for equal due times
+        self.heap = []
+        self.sequence = 0
+        self.lock = threading.Lock()
+        # Repository object -> sequence number of its entry in the heap.
+        # Other entries for the same repository are outdated
+        self.pending = {}
+        # repositories triggered while running a cycle
+        self.triggered = set()
+
+        # to wake up the main loop from other threads
+        self.wakeuppipe = WakeupPipe()
+
+        # threads running the cycles of the repositories due
+        self.cyclepool = WorkerPool(nworkers, 'cyclepool')
+
+
+    def schedule(self, repository, due=None):
+        '''
+        adds a repository to the heap.
+        due is the time, in seconds since EPOCH,
+        when the repository should run next.
+        By default, it is calculated by the repository itself.
+        '''
+        if repository.stopevent.isSet():
+            self.log.debug('repository %s is stopped, not scheduling it' %repository.repositoryname)
+            return
+
+        if due is None:
+            due = repository._next_due()
+
+        self.lock.acquire()
+        try:
+            if repository in self.triggered:
+                self.triggered.discard(repository)
+                due = int(time.time())
+            self._push(repository, due)
+        finally:
+            self.lock.release()
+        t_wait = due - int(time.time())
+        if t_wait > 0:
+            self.log.info('waiting %s seconds for repository %s' %(t_wait, repository.repositoryname))
+        self.wakeuppipe.wakeup()
+
+
+    def _push(self, repository, due):
+        '''
+        Must be called with the lock acquired.
+        '''
+        heapq.heappush(self.heap, (due, self.sequence, repository))
+        self.pending[repository] = self.sequence
+        self.sequence += 1
+
+
+    def trigger(self, repository):
+        '''
+        makes a repository due now.
+        If it is running a cycle, it is due again as soon as it finishes.
+        Returns "scheduled" or "pending"
+        '''
+        self.lock.acquire()
+        try:
+            if repository in self.pending:
+                # the entry already in the heap becomes outdated
+                self._push(repository, int(time.time()))
+                state = 'scheduled'
+            else:
+                self.triggered.add(repository)
+                state = 'pending'
+        finally:
+            self.lock.release()
+        self.wakeuppipe.wakeup()
+        return state
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+
+        self.log.debug('starting Scheduler thread main loop...')
+        while not self.stopevent.isSet():
+            self.log.trace('Scheduler loop')
+            due, timeout = self._pop_due()
+            for repository in due:
+                self._dispatch(repository)
+            if not due:
+                self.wakeuppipe.wait(timeout)
+
+
+    def _pop_due(self):
+        '''
+        returns the list of repositories that are due,
+        and how long to wait for the next one
+        (None if the heap is empty)
+        '''
+        now = time.time()
+        due = []
+        timeout = None
+        self.lock.acquire()
+        try:
+            while self.heap and self.heap[0][0] <= now:
+                t, sequence, repository = heapq.heappop(self.heap)
+                if self.pending.get(repository) != sequence:
+                    # outdated entry
+                    continue
+                del self.pending[repository]
+                due.append(repository)
+            if self.heap:
+                timeout = self.heap[0][0] - now
+        finally:
+            self.lock.release()
+        return due, timeout
+
+
+    def _dispatch(self, repository):
+        '''
+        starts a new cycle for a repository that is due, 
+        without waiting for it
+        '''
+        if repository.stopevent.isSet():
+            return
+        self.cyclepool.submit(self._cycle, repository)
+
+
+    def _cycle(self, repository):
+        '''
+        runs the cycle of a repository, from the pool
+        '''
+        try:
+            repository.cycle(self.schedule)
+        except Exception, ex:
+            self.log.error('cycle for repository %s raised an exception: %s' %(repository.repositoryname, ex))
+            repository._cycledone()
+            self.schedule(repository)
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread. Overriding this method required to handle Ctrl-C from console.
+        '''
+        self.stopevent.set()
+        self.wakeuppipe.wakeup()
+        self.log.debug('Stopping thread...')
+        threading.Thread.join(self, timeout)
+        self.cyclepool.stop()
@@ -10,6 +10,7 @@ import logging.handlers
 import os
 import pwd
 import re
+import signal
 import subprocess
 import string
 import sys
@@ -18,6 +19,8 @@ import threading
 import traceback
 
 from replicas import ReplicaManager
+from cvmfsreplica.control import ControlServer
+from cvmfsreplica.metrics import Metrics, MetricsServer
 #from pyconfidence import Config
 from cvmfsreplica.pyconfidence import Config
 from cvmfsreplica.cvmfsreplicaex import ServiceConfigurationFailure
@@ -49,6 +52,12 @@ class serviceCLI(object):
 
         self.log.trace('main config file:\n%s' %self.conf)
         self.log.trace('repositories config file:\n%s' %self.repositoriesconf)
+
+        # metrics are always collected, 
+        # but only exposed if an endpoint is configured
+        self.metrics = Metrics()
+        self.metricsserver = None
+        self.controlserver = None
  
         self.replica_manager = ReplicaManager(self)
 
@@ -76,11 +85,29 @@ class serviceCLI(object):
         # 2
         self._readloggingconfig()
         self._readmaxthreadsconfig()
-        repositoriesconffile = self._readrepositoriesconfig()
+        self._readadaptiveconfig()
+        self._readschedulerconfig()
+        self._readschedulerworkersconfig()
+        self._readacceptanceworkersconfig()
+        self._readstartupworkersconfig()
+        self._readhttpconfig()
+        self._readmanifestpollerconfig()
+        self._readfilewatcherconfig()
+        self._readkillgraceperiodconfig()
+        self._readhostlimitsconfig()
+        self._readhistoryconfig()
+        self._readstatejournalconfig()
+        self._readmetricsconfig()
+        self._readcontrolconfig()
+        self._readtracingconfig()
+        self._readcvmfsconfig()
+        self._readfreespaceconfig()
+        self._readnotificationconfig()
+        self.repositoriesconffile = self._readrepositoriesconfig()
 
         # 3
         self.repositoriesconf = Config()
-        self.repositoriesconf.readfp(open(repositoriesconffile))
+        self.repositoriesconf.readfp(open(self.repositoriesconffile))
 
 
     def _readloggingconfig(self):
@@ -111,6 +138,350 @@ class serviceCLI(object):
             raise Exception(msg)
 
 
+    def _readadaptiveconfig(self):
+        """
+        get the configuration for the adaptive concurrency mode.
+        In that mode, the number of snapshots running at the same time
+        changes between minimum_concurrent_snapshots 
+        and maximum_concurrent_snapshots 
+        """
+        try:
+            self.adaptiveconcurrency = self.conf.getboolean("REPLICA", "adaptive_concurrency")
+        except:
+            # DEFAULT value
+            self.adaptiveconcurrency = False
+        try:
+            self.minthreads = self.conf.getint("REPLICA", "minimum_concurrent_snapshots")
+        except:
+            # DEFAULT value
+            self.minthreads = 1
+        if self.minthreads > self.maxthreads:
+            msg = "minimum_concurrent_snapshots is larger than maximum_concurrent_snapshots. Aborting"
+            raise Exception(msg)
+
+        # optional parameters, passed as they are to AdaptiveConcurrency()
+        self.adaptiveparameters = {}
+        for option, parameter, conv in [('adaptive_period', 'period', int),
+                                        ('adaptive_max_iowait', 'max_iowait', float),
+                                        ('adaptive_max_load', 'max_load', float),
+                                        ('adaptive_decrease_factor', 'decrease_factor', float)]:
+            if self.conf.has_option("REPLICA", option):
+                self.adaptiveparameters[parameter] = conv(self.conf.get("REPLICA", option))
+
+
+    def _readschedulerconfig(self):
+        """
+        get the scheduler mode:
+            -- "threads": one thread per repository
+            -- "loop": one single thread for all repositories
+        """
+        try:
+            self.scheduler = self.conf.get("REPLICA", "scheduler")
+        except:
+            # DEFAULT value
+            self.scheduler = "threads"
+        if self.scheduler not in ['threads', 'loop']:
+            msg = "configuration variable 'scheduler' has a wrong value %s. Aborting" %self.scheduler
+            raise Exception(msg)
+
+
+    def _readschedulerworkersconfig(self):
+        """
+        get the number of threads to run the cycles
+        of the repositories, in "loop" mode
+        """
+        try:
+            self.schedulerworkers = self.conf.getint("REPLICA", "scheduler_workers")
+        except:
+            # DEFAULT value
+            self.schedulerworkers = 10
+
+
+    def _readacceptanceworkersconfig(self):
+        """
+        get the number of threads, 
+        shared by all repositories,
+        to run the acceptance plugins
+        """
+        try:
+            self.acceptanceworkers = self.conf.getint("REPLICA", "acceptance_workers")
+        except:
+            # DEFAULT value
+            self.acceptanceworkers = 10
+
+
+    def _readstartupworkersconfig(self):
+        """
+        get the number of threads to create 
+        the repositories when the service starts
+        """
+        try:
+            self.startupworkers = self.conf.getint("REPLICA", "startup_workers")
+        except:
+            # DEFAULT value
+            self.startupworkers = 16
+
+
+    def _readhttpconfig(self):
+        """
+        get the timeouts, in seconds, for the HTTP requests
+        to the Stratum-0 servers
+        """
+        try:
+            self.httpconnecttimeout = self.conf.getint("REPLICA", "http_connect_timeout")
+        except:
+            # DEFAULT value
+            self.httpconnecttimeout = 10
+        try:
+            self.httpreadtimeout = self.conf.getint("REPLICA", "http_read_timeout")
+        except:
+            # DEFAULT value
+            self.httpreadtimeout = 30
+
+
+    def _readmanifestpollerconfig(self):
+        """
+        get the interval, in seconds, between sweeps 
+        to read the .cvmfspublished files of all repositories,
+        and for how long the results are valid.
+        The poller is not used if no interval is set.
+        """
+        try:
+            self.manifestpollinterval = self.conf.getint("REPLICA", "manifest_poll_interval")
+        except:
+            # DEFAULT value
+            self.manifestpollinterval = 0
+        try:
+            self.manifestcachettl = self.conf.getint("REPLICA", "manifest_cache_ttl")
+        except:
+            # DEFAULT value
+            self.manifestcachettl = 2 * self.manifestpollinterval
+
+
+    def _readfilewatcherconfig(self):
+        """
+        get how the local files of the repositories are watched:
+        with inotify, unless filewatcher = stat,
+        and how often, in seconds, the files not watched by inotify
+        are checked for snapshots done outside the service
+        """
+        try:
+            self.filewatcherinotify = self.conf.get("REPLICA", "filewatcher") != 'stat'
+        except:
+            # DEFAULT value
+            self.filewatcherinotify = True
+        try:
+            self.filewatcherpollinterval = self.conf.getint("REPLICA", "filewatcher_poll_interval")
+        except:
+            # DEFAULT value
+            self.filewatcherpollinterval = 60
+
+
+    def _readkillgraceperiodconfig(self):
+        """
+        get the number of seconds between SIGTERM and SIGKILL
+        when a snapshot times out
+        """
+        try:
+            self.killgraceperiod = self.conf.getint("REPLICA", "kill_grace_period")
+        except:
+            # DEFAULT value
+            self.killgraceperiod = 30
+
+
+    def _readhostlimitsconfig(self):
+        """
+        get the limits for the snapshots of repositories
+        from the same Stratum-0 host:
+            -- host_maximum_concurrent_snapshots
+            -- host_snapshot_rate, in snapshots started per minute
+            -- host_snapshot_burst, snapshots that can start at once
+        They can be changed for a given host with 
+            host.<hostname>.maximum_concurrent_snapshots
+            host.<hostname>.snapshot_rate
+            host.<hostname>.snapshot_burst
+        No limits are used if none is specified.
+        """
+        def read(option, conv, default):
+            if self.conf.has_option("REPLICA", option):
+                return conv(self.conf.get("REPLICA", option))
+            return default
+
+        def limits(prefix, default):
+            maxconcurrent = read(prefix + 'maximum_concurrent_snapshots', int, default[0])
+            rate = read(prefix + 'snapshot_rate', float, None)
+            if rate is None:
+                rate = default[1]
+            else:
+                rate = rate / 60
+            burst = read(prefix + 'snapshot_burst', int, default[2])
+            return (maxconcurrent, rate, burst)
+
+        default = limits('host_', (None, None, 1))
+        overrides = {}
+        for option in self.conf.options("REPLICA"):
+            if option.startswith('host.'):
+                host = option[5:].rsplit('.', 1)[0]
+                if host not in overrides:
+                    overrides[host] = limits('host.%s.' %host, default)
+
+        self.hostlimitsparameters = {}
+        if default != (None, None, 1) or overrides:
+            self.hostlimitsparameters = {'maxconcurrent': default[0],
+                                         'rate': default[1],
+                                         'burst': default[2],
+                                         'overrides': overrides}
+
+
+    def _readhistoryconfig(self):
+        """
+        get the database file to record every snapshot attempt.
+        Attempts are not recorded if it is not defined.
+        """
+        try:
+            self.historydb = self.conf.get("REPLICA", "historydb")
+            if self.historydb.startswith('file:'):
+                self.historydb = self.historydb[7:]
+        except:
+            # DEFAULT value
+            self.historydb = None
+
+
+    def _readstatejournalconfig(self):
+        """
+        get the file to keep the scheduler state of the repositories
+        between restarts, and the window, in seconds, 
+        to start the repositories overdue after a restart
+        """
+        try:
+            self.statejournal = self.conf.get("REPLICA", "statejournal")
+            if self.statejournal.startswith('file:'):
+                self.statejournal = self.statejournal[7:]
+        except:
+            # DEFAULT value
+            self.statejournal = None
+        try:
+            self.coldstartwindow = self.conf.getint("REPLICA", "cold_start_window")
+        except:
+            # DEFAULT value
+            self.coldstartwindow = 60
+
+
+    def _readmetricsconfig(self):
+        """
+        get the endpoint to expose the metrics, in Prometheus text format.
+        It can be either http://<host>:<port> or unix://<path>
+        Metrics are not exposed if it is not defined.
+        """
+        try:
+            self.metricsaddress = self.conf.get("REPLICA", "metrics")
+        except:
+            # DEFAULT value
+            self.metricsaddress = None
+
+
+    def _readcontrolconfig(self):
+        """
+        get the endpoint of the control channel, 
+        to ask for a snapshot now, and the priority of those requests.
+        It can be either http://<host>:<port> or unix://<path>
+        There is no control channel if it is not defined.
+        """
+        try:
+            self.controladdress = self.conf.get("REPLICA", "control")
+        except:
+            # DEFAULT value
+            self.controladdress = None
+        try:
+            self.controlpriority = self.conf.getint("REPLICA", "control_priority")
+        except:
+            # DEFAULT value
+            self.controlpriority = 1000
+
+
+    def _readtracingconfig(self):
+        """
+        get the file to write the timeline of every snapshot request,
+        as one JSON document per line, 
+        and when that file is rotated.
+        Timelines are not written if it is not defined.
+        """
+        try:
+            self.tracefile = self.conf.get("REPLICA", "tracefile")
+            if self.tracefile.startswith('file:'):
+                self.tracefile = self.tracefile[7:]
+        except:
+            # DEFAULT value
+            self.tracefile = None
+        try:
+            self.tracefilemaxbytes = self.conf.getint("REPLICA", "tracefile_max_bytes")
+        except:
+            # DEFAULT value
+            self.tracefilemaxbytes = 10485760
+        try:
+            self.tracefilebackups = self.conf.getint("REPLICA", "tracefile_backups")
+        except:
+            # DEFAULT value
+            self.tracefilebackups = 5
+
+
+    def _readcvmfsconfig(self):
+        """
+        get the directory with the CVMFS configuration of the repositories,
+        and the command to run the snapshots.
+        Changing them is mostly useful for testing.
+        """
+        try:
+            self.cvmfsrepositoriesdir = self.conf.get("REPLICA", "cvmfs_repositories_dir")
+        except:
+            # DEFAULT value
+            self.cvmfsrepositoriesdir = "/etc/cvmfs/repositories.d"
+        try:
+            self.cvmfsserver = self.conf.get("REPLICA", "cvmfs_server")
+        except:
+            # DEFAULT value
+            self.cvmfsserver = "cvmfs_server"
+
+
+    def _readfreespaceconfig(self):
+        """
+        get for how long, in seconds, the free disk space 
+        of a filesystem is reused by all repositories in it
+        before reading it again
+        """
+        try:
+            self.freespacettl = self.conf.getint("REPLICA", "freespace_cache_ttl")
+        except:
+            # DEFAULT value
+            self.freespacettl = 10
+
+
+    def _readnotificationconfig(self):
+        """
+        get how the emails from the report plugins are sent:
+            -- notification_window: seconds to collect messages 
+               for the same recipients into one single email
+            -- notification_rate: maximum emails per minute
+            -- notification_burst: emails that can be sent at once
+        No rate limit if notification_rate is not specified.
+        """
+        try:
+            self.notificationwindow = self.conf.getint("REPLICA", "notification_window")
+        except:
+            # DEFAULT value
+            self.notificationwindow = 60
+        try:
+            self.notificationrate = self.conf.getfloat("REPLICA", "notification_rate")
+        except:
+            # DEFAULT value
+            self.notificationrate = None
+        try:
+            self.notificationburst = self.conf.getint("REPLICA", "notification_burst")
+        except:
+            # DEFAULT value
+            self.notificationburst = 1
+
+
     def _readrepositoriesconfig(self):
         """
         get the  configuration file for repositories
@@ -183,6 +554,14 @@ class serviceCLI(object):
     #      RUN THE SERVICE 
     # =========================================================================
 
+    def _sighup(self, signum, frame):
+        """
+        SIGHUP asks to reload the repositories configuration file.
+        The reload itself is done by the main loop of ReplicaManager
+        """
+        self.log.info('Caught SIGHUP - reloading repositories configuration')
+        self.replica_manager.reloadrequested = True
+
     def run(self):
         """
         runs the actual service by calling the method start()
@@ -193,12 +572,25 @@ class serviceCLI(object):
         """
 
         try:
+            if self.metricsaddress:
+                self.log.info('Starting MetricsServer object...')
+                self.metricsserver = MetricsServer(self.metrics, self.metricsaddress)
+                self.metricsserver.start()
+            if self.controladdress:
+                self.log.info('Starting ControlServer object...')
+                self.controlserver = ControlServer(self.replica_manager, self.controladdress)
+                self.controlserver.start()
+            signal.signal(signal.SIGHUP, self._sighup)
             self.log.info('Starting ReplicaManager object main process...')
             self.replica_manager.run()
 
         except KeyboardInterrupt:
             self.log.info('Caught keyboard interrupt - exitting')
+            if self.controlserver:
+                self.controlserver.join()
             self.replica_manager.shutdown()
+            if self.metricsserver:
+                self.metricsserver.join()
             sys.exit(0)
         except ImportError, errorMsg:
             self.log.critical('Failed to import necessary python module: %s' % errorMsg)
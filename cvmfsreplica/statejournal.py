@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+module with the persistent state of the scheduler,
+so it survives a restart of the service
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+# =============================================================================
+#       CLASS STATE JOURNAL
+# =============================================================================
+
+class StateJournal(object):
+    """
+    class to keep, in a small file, the scheduler state of every repository:
+
+        -- last_attempt: end of the last cycle, in seconds since EPOCH,
+           whatever its result, including rejections by the acceptance plugins
+        -- last_success: end of the last successful snapshot
+        -- failures: number of consecutive failed snapshots
+        -- next_due: when the next cycle should start
+
+    Each change is appended to the file, as one line of JSON,
+    and fsync'ed before record() returns.
+    When the file has too many lines, it is compacted:
+    the last state of each repository is written into a new file,
+    which then replaces the old one.
+    """
+
+    def __init__(self, path, compactlines=1000):
+        """
+        path is the journal file.
+        compactlines is the minimum number of lines
+        before the file is compacted
+        """
+        self.log = logging.getLogger('cvmfsreplica.statejournal')
+        self.path = path
+        self.compactlines = compactlines
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # repository name -> state dictionary
+        self.states = self._read()
+        self.lines = len(self.states)
+        self._compact()
+
+
+    def _read(self):
+        '''
+        reads the journal file, if any.
+        A line partially written when the service died is ignored.
+        '''
+        states = {}
+        if not os.path.exists(self.path):
+            return states
+        for line in open(self.path):
+            try:
+                entry = json.loads(line)
+                states[entry.pop('repository')] = entry
+            except Exception:
+                self.log.warning('ignoring wrong line in journal %s: %r' %(self.path, line))
+        return states
+
+
+    def get(self, repositoryname):
+        '''
+        returns a dictionary with the last state recorded
+        for a repository, or None
+        '''
+        self.lock.acquire()
+        try:
+            state = self.states.get(repositoryname)
+            if state is not None:
+                state = dict(state)
+            return state
+        finally:
+            self.lock.release()
+
+
+    def record(self, repositoryname, state):
+        '''
+        records the new state of a repository.
+        state is a dictionary
+        '''
+        entry = dict(state)
+        entry['repository'] = repositoryname
+        self.lock.acquire()
+        try:
+            self.states[repositoryname] = dict(state)
+            f = open(self.path, 'a')
+            try:
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            self.lines += 1
+            if self.lines > max(self.compactlines, 2 * len(self.states)):
+                self._compact()
+        finally:
+            self.lock.release()
+
+
+    def _compact(self):
+        '''
+        rewrites the file with only the last state of each repository.
+        The new file is fsync'ed and renamed over the old one,
+        so a crash leaves either of them complete.
+        '''
+        tmp = '%s.tmp' %self.path
+        f = open(tmp, 'w')
+        try:
+            for name in sorted(self.states.keys()):
+                entry = dict(self.states[name])
+                entry['repository'] = name
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+        dirfd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+        self.lines = len(self.states)
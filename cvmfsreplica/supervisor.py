@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+module with the supervisor of all the commands
+run by the service, like cvmfs_server snapshot
+"""
+
+import collections
+import errno
+import logging
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import threading
+import time
+
+from cvmfsreplica.utils import WakeupPipe
+
+
+# lines are split at \n, \r\n, and also \r, used by progress bars
+LINEBREAK = re.compile('\r\n|\r|\n')
+# longer lines are cut, so the memory used is bounded
+# even for output with no line breaks
+MAXLINE = 65536
+
+
+# =============================================================================
+#       CLASS SUPERVISED PROCESS
+# =============================================================================
+
+class SupervisedProcess(object):
+    """
+    class to represent one command run by the ProcessSupervisor.
+
+    Once the command is done, these attributes are set:
+        -- rc: the return code,
+           negative if the process was killed by a signal
+        -- reason: why the command finished
+            "exit":    the command exited by itself, with code rc
+            "signal":  the command was killed by signal self.signal
+            "timeout": the command was killed because it took too long
+        -- out, err: the output of the command,
+           only the last maxlines lines if maxlines was specified.
+           Lines longer than MAXLINE are cut into several
+    """
+
+    def __init__(self, cmd, timeout=None, sink=None, maxlines=None, shell=False):
+        """
+        cmd is the command to run, as a list of arguments or a string.
+        timeout is the maximum number of seconds the command can run.
+        sink(line), if provided, is called for each line of output.
+        maxlines is the number of lines of output kept in memory.
+        shell is True if cmd must be run by the shell.
+        """
+        self.cmd = cmd
+        self.timeout = timeout
+        self.sink = sink
+        self.maxlines = maxlines
+        self.shell = shell
+
+        self.process = None
+        self.pid = None
+        self.starttime = None
+        self.deadline = None
+        self.killtime = None # when SIGKILL will be sent, after SIGTERM
+
+        self.rc = None
+        self.reason = None
+        self.signal = None
+        self.timedout = False
+        self.out = None
+        self.err = None
+        self.doneevent = threading.Event()
+
+
+    def start(self):
+        '''
+        starts the command in its own process group,
+        so it can be killed together with all its children
+        '''
+        args = self.cmd
+        if not self.shell and isinstance(args, basestring):
+            args = shlex.split(args)
+        self.process = subprocess.Popen(args,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        shell=self.shell,
+                                        close_fds=True,
+                                        preexec_fn=os.setsid
+                                       )
+        self.pid = self.process.pid
+        self.starttime = time.time()
+        if self.timeout is not None:
+            self.deadline = self.starttime + self.timeout
+
+        self.stdout = self.process.stdout.fileno()
+        self.stderr = self.process.stderr.fileno()
+        self.opened = [self.stdout, self.stderr]
+        self.lines = {self.stdout: collections.deque(maxlen=self.maxlines),
+                      self.stderr: collections.deque(maxlen=self.maxlines)}
+        self.partial = {self.stdout: '', self.stderr: ''}
+
+
+    def done(self):
+        return self.doneevent.isSet()
+
+
+    def wait(self):
+        '''
+        blocks until the command is done,
+        and returns the return code
+        '''
+        self.doneevent.wait()
+        return self.rc
+
+
+    def _read(self, fd):
+        data = os.read(fd, 4096)
+        if not data:
+            self.opened.remove(fd)
+            if self.partial[fd]:
+                self._newline(fd, self.partial[fd].rstrip('\r'))
+            return
+        text = self.partial[fd] + data
+        # a \r at the end may be the first half of \r\n
+        hold = ''
+        if text.endswith('\r'):
+            text, hold = text[:-1], '\r'
+        chunks = LINEBREAK.split(text)
+        partial = chunks.pop()
+        for line in chunks:
+            self._newline(fd, line)
+        while len(partial) >= MAXLINE:
+            self._newline(fd, partial[:MAXLINE])
+            partial = partial[MAXLINE:]
+        self.partial[fd] = partial + hold
+
+
+    def _newline(self, fd, line):
+        self.lines[fd].append(line)
+        if self.sink:
+            self.sink(line)
+
+
+    def _killgroup(self, sig):
+        try:
+            os.killpg(self.pid, sig)
+        except OSError, ex:
+            if ex.errno != errno.ESRCH:
+                raise
+
+
+    def _finish(self):
+        self.process.stdout.close()
+        self.process.stderr.close()
+        self.out = '\n'.join(self.lines[self.stdout])
+        self.err = '\n'.join(self.lines[self.stderr])
+        self.rc = self.process.returncode
+        if self.timedout:
+            self.reason = 'timeout'
+        elif self.rc < 0:
+            self.reason = 'signal'
+        else:
+            self.reason = 'exit'
+        if self.rc < 0:
+            self.signal = -self.rc
+        self.doneevent.set()
+
+
+# =============================================================================
+#       CLASS PROCESS SUPERVISOR
+# =============================================================================
+
+class ProcessSupervisor(threading.Thread):
+    """
+    class to run commands and supervise all of them
+    from one single select( ) loop, with no other threads.
+
+    Commands that take longer than their timeout
+    receive SIGTERM, for the whole process group.
+    If they are still alive after a grace period,
+    they receive SIGKILL.
+
+    The loop can run in its own thread, with start( ),
+    or in the calling thread, with loop( ).
+    """
+
+    # while the pipes of a process are closed,
+    # but it has not exited yet,
+    # it is checked with this period, in seconds
+    POLL = 0.5
+
+    def __init__(self, grace=30):
+        """
+        grace is the number of seconds between SIGTERM and SIGKILL
+        """
+
+        threading.Thread.__init__(self) # init the thread
+        self.log = logging.getLogger('cvmfsreplica.processsupervisor')
+        self.stopevent = threading.Event()
+        self.wakeuppipe = WakeupPipe()
+
+        self.grace = grace
+        self.processes = []
+        self.lock = threading.Lock()
+
+
+    def submit(self, cmd, timeout=None, sink=None, maxlines=None, shell=False):
+        '''
+        starts a new command.
+        Returns the SupervisedProcess( ) object,
+        that can be waited for.
+        '''
+        sp = SupervisedProcess(cmd, timeout, sink, maxlines, shell)
+        sp.start()
+        self.log.debug('started command "%s" with pid %s' %(cmd, sp.pid))
+        self.lock.acquire()
+        try:
+            self.processes.append(sp)
+        finally:
+            self.lock.release()
+        self.wakeuppipe.wakeup()
+        return sp
+
+
+    def terminate(self, sp):
+        '''
+        sends SIGTERM to a command, and SIGKILL
+        after the grace period if it is still alive
+        '''
+        if sp.killtime is None and not sp.done():
+            self.log.info('sending SIGTERM to process group %s' %sp.pid)
+            sp._killgroup(signal.SIGTERM)
+            sp.killtime = time.time() + self.grace
+            self.wakeuppipe.wakeup()
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+        self.log.debug('starting ProcessSupervisor thread main loop...')
+        self.loop(self.stopevent.isSet)
+
+
+    def loop(self, until):
+        '''
+        supervises the commands until until() returns True
+        '''
+        while not until():
+            self.lock.acquire()
+            try:
+                processes = list(self.processes)
+            finally:
+                self.lock.release()
+
+            now = time.time()
+            fds = {}
+            wakeup = None
+            for sp in processes:
+                for fd in sp.opened:
+                    fds[fd] = sp
+                when = self._nextcheck(sp)
+                if when is not None and (wakeup is None or when < wakeup):
+                    wakeup = when
+
+            timeout = None
+            if wakeup is not None:
+                timeout = max(wakeup - now, 0)
+            rlist = fds.keys() + [self.wakeuppipe.fileno()]
+            try:
+                ready = select.select(rlist, [], [], timeout)[0]
+            except select.error, ex:
+                if ex[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in ready:
+                if fd == self.wakeuppipe.fileno():
+                    self.wakeuppipe.clear()
+                else:
+                    fds[fd]._read(fd)
+
+            for sp in processes:
+                self._check(sp)
+
+
+    def _nextcheck(self, sp):
+        '''
+        returns the next time something has to be checked
+        for a process, or None if there is nothing to check
+        '''
+        if not sp.opened:
+            return time.time() + self.POLL
+        if sp.killtime is not None:
+            return sp.killtime
+        return sp.deadline
+
+
+    def _check(self, sp):
+        '''
+        handles timeouts, and collects processes that are done
+        '''
+        now = time.time()
+        if sp.killtime is None:
+            if sp.deadline is not None and now >= sp.deadline:
+                self.log.warning('command "%s" with pid %s timed out after %s seconds' %(sp.cmd, sp.pid, sp.timeout))
+                sp.timedout = True
+                self.terminate(sp)
+        elif now >= sp.killtime:
+            self.log.warning('sending SIGKILL to process group %s' %sp.pid)
+            sp._killgroup(signal.SIGKILL)
+            # no more than one SIGKILL every grace period
+            sp.killtime = now + self.grace
+
+        if not sp.opened and sp.process.poll() is not None:
+            self.lock.acquire()
+            try:
+                self.processes.remove(sp)
+            finally:
+                self.lock.release()
+            sp._finish()
+            self.log.debug('command "%s" with pid %s finished, reason=%s, rc=%s' %(sp.cmd, sp.pid, sp.reason, sp.rc))
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread. Overriding this method required to handle Ctrl-C from console.
+        '''
+        self.stopevent.set()
+        self.wakeuppipe.wakeup()
+        self.log.debug('Stopping thread...')
+        threading.Thread.join(self, timeout)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+fake cvmfs_server command for the benchmark suite.
+
+    fakecvmfsserver.py --root <dir> [--duration <seconds>]
+                       [--distribution constant|uniform|exponential]
+                       [--failure-rate <fraction>] snapshot <repositoryname>
+
+It takes a random time, following the distribution with the given mean,
+and then either fails, with the given probability, or copies
+the .cvmfspublished file from the fake Stratum-0 into the local storage
+and updates the .cvmfs_last_snapshot file, like a real snapshot would.
+"""
+
+import getopt
+import os
+import random
+import shutil
+import sys
+import time
+
+
+def duration(mean, distribution):
+    if distribution == 'constant':
+        return mean
+    if distribution == 'uniform':
+        return random.uniform(0, 2 * mean)
+    if distribution == 'exponential':
+        if mean <= 0:
+            return 0
+        return random.expovariate(1.0 / mean)
+    raise ValueError('unknown distribution %s' %distribution)
+
+
+def snapshot(root, repositoryname):
+    storage = os.path.join(root, 'srv', repositoryname)
+    source = os.path.join(root, 'stratum0', repositoryname, '.cvmfspublished')
+    shutil.copyfile(source, os.path.join(storage, '.cvmfspublished.tmp'))
+    os.rename(os.path.join(storage, '.cvmfspublished.tmp'),
+              os.path.join(storage, '.cvmfspublished'))
+    f = open(os.path.join(storage, '.cvmfs_last_snapshot'), 'w')
+    try:
+        f.write(time.strftime('%a %b %d %H:%M:%S UTC %Y\n', time.gmtime()))
+    finally:
+        f.close()
+
+
+def main(argv):
+    root = None
+    mean = 1.0
+    distribution = 'exponential'
+    failurerate = 0.0
+
+    opts, args = getopt.getopt(argv, '', ['root=', 'duration=', 'distribution=', 'failure-rate='])
+    for o, a in opts:
+        if o == '--root':
+            root = a
+        elif o == '--duration':
+            mean = float(a)
+        elif o == '--distribution':
+            distribution = a
+        elif o == '--failure-rate':
+            failurerate = float(a)
+    if root is None or len(args) != 2 or args[0] != 'snapshot':
+        sys.stderr.write('usage: fakecvmfsserver.py --root <dir> [options] snapshot <repositoryname>\n')
+        return 2
+
+    repositoryname = args[1]
+    print('Initial snapshot of %s' %repositoryname)
+    sys.stdout.flush()
+    time.sleep(duration(mean, distribution))
+    if random.random() < failurerate:
+        sys.stderr.write('Failed to replicate %s\n' %repositoryname)
+        return 1
+    snapshot(root, repositoryname)
+    print('Snapshot of %s done' %repositoryname)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+
+"""
+benchmark of a ReplicaManager with a fleet of synthetic repositories.
+
+    python -m cvmfsreplica.test.benchmark.fleet [options]
+
+        --repositories <n>      number of repositories (default 100)
+        --scheduler <mode>      threads or loop (default threads)
+        --interval <seconds>    interval of each repository (default 60)
+        --agents <n>            maximum_concurrent_snapshots (default 10)
+        --idle <seconds>        length of the idle phase (default 60)
+        --duration <seconds>    length of the load phase (default 120)
+        --publish-rate <n>      new revisions published per second,
+                                in the whole fleet, during the load phase (default 1)
+        --snapshot-duration <seconds>  mean duration of the snapshots (default 1)
+        --distribution <name>   constant, uniform or exponential (default exponential)
+        --failure-rate <f>      fraction of snapshots that fail (default 0)
+        --root <dir>            directory for all files (default, a temporary one)
+        --output <file>         also write the results, as JSON, into this file
+
+Everything runs in this process, with the real service code,
+except the snapshots, run by a fake cvmfs_server command,
+and the Stratum-0, replaced by a local HTTP server.
+
+There are two phases:
+
+    -- idle: nothing is published, so every cycle of every repository
+       stops at the acceptance plugins.
+       It measures the cost of just watching the repositories:
+       CPU per idle repository, threads, and memory.
+
+    -- load: new revisions are published, at random,
+       and the repositories replicate them.
+       It measures dispatch latency (from enqueued to dequeued),
+       end-to-end latency (from created to noticed), and throughput.
+"""
+
+import getopt
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from cvmfsreplica.history import percentile
+from cvmfsreplica.service import serviceCLI
+from cvmfsreplica.test.benchmark import fakecvmfsserver
+from cvmfsreplica.test.benchmark.stratum0 import FakeStratum0
+
+
+class Options(object):
+    """
+    input options of serviceCLI
+    """
+    def __init__(self, conffile):
+        self.conffile = conffile
+
+
+def procstatus():
+    '''
+    returns the resident memory, in kB,
+    and the number of threads, of this process
+    '''
+    rss = threads = None
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            rss = int(line.split()[1])
+        elif line.startswith('Threads:'):
+            threads = int(line.split()[1])
+    return rss, threads
+
+
+def cputime():
+    '''
+    returns the CPU time, user + system, of this process,
+    not including the snapshot commands
+    '''
+    t = os.times()
+    return t[0] + t[1]
+
+
+# =============================================================================
+#       CLASS FLEET
+# =============================================================================
+
+class Fleet(object):
+    """
+    class to create the files for a fleet of synthetic repositories,
+    run a ReplicaManager on them, and measure it.
+    """
+
+    def __init__(self, root, nrepositories=100, scheduler='threads', interval=60, agents=10,
+                 snapshotduration=1.0, distribution='exponential', failurerate=0.0):
+        self.root = root
+        self.nrepositories = nrepositories
+        self.scheduler = scheduler
+        self.interval = interval
+        self.agents = agents
+        self.snapshotduration = snapshotduration
+        self.distribution = distribution
+        self.failurerate = failurerate
+        self.names = ['repo%05d.benchmark.org' %i for i in range(nrepositories)]
+        self.stratum0 = FakeStratum0(root)
+        self.results = {}
+
+
+    # -------------------------------------------------------------------------
+    #   files
+    # -------------------------------------------------------------------------
+
+    def create(self):
+        '''
+        creates all files:
+            -- CVMFS configuration of each repository
+            -- local storage, with the same revision as the Stratum-0,
+               and a last snapshot at a random time in the last interval
+            -- configuration files of the service
+        '''
+        now = time.time()
+        for name in self.names:
+            storage = os.path.join(self.root, 'srv', name)
+            os.makedirs(os.path.join(storage, 'data', 'txn'))
+            self.stratum0.publish(name)
+            fakecvmfsserver.snapshot(self.root, name)
+            last = now - random.uniform(0, self.interval)
+            f = open(os.path.join(storage, '.cvmfs_last_snapshot'), 'w')
+            f.write(time.strftime('%a %b %d %H:%M:%S UTC %Y\n', time.gmtime(last)))
+            f.close()
+
+            confdir = os.path.join(self.root, 'repositories.d', name)
+            os.makedirs(confdir)
+            f = open(os.path.join(confdir, 'server.conf'), 'w')
+            f.write('CVMFS_REPOSITORY_NAME=%s\n' %name)
+            f.write('CVMFS_STRATUM0=%s\n' %self.stratum0.url(name))
+            f.write('CVMFS_UPSTREAM_STORAGE=local,%s/data/txn,%s\n' %(storage, storage))
+            f.close()
+
+        etc = os.path.join(self.root, 'etc')
+        os.makedirs(etc)
+        f = open(os.path.join(etc, 'repositories.conf'), 'w')
+        f.write('[DEFAULT]\n')
+        f.write('enabled = True\n')
+        f.write('interval = %s\n' %self.interval)
+        f.write('ntrials = 1\n')
+        f.write('acceptanceplugins = Updatedserver\n')
+        f.write('reportplugins = None\n')
+        f.write('postplugins = None\n')
+        for name in self.names:
+            f.write('\n[%s]\nrepositoryname = %s\n' %(name, name))
+        f.close()
+
+        cvmfsserver = '%s %s --root %s --duration %s --distribution %s --failure-rate %s' \
+                      %(sys.executable, fakecvmfsserver.__file__.replace('.pyc', '.py'),
+                        self.root, self.snapshotduration, self.distribution, self.failurerate)
+        self.conffile = os.path.join(etc, 'cvmfsreplica.conf')
+        f = open(self.conffile, 'w')
+        f.write('[REPLICA]\n')
+        f.write('repositoriesconf = file://%s/repositories.conf\n' %etc)
+        f.write('log = file://%s/cvmfsreplica.log\n' %self.root)
+        f.write('loglevel = WARNING\n')
+        f.write('maximum_concurrent_snapshots = %s\n' %self.agents)
+        f.write('scheduler = %s\n' %self.scheduler)
+        f.write('tracefile = file://%s/trace.log\n' %self.root)
+        f.write('tracefile_max_bytes = 0\n')
+        f.write('cvmfs_repositories_dir = %s/repositories.d\n' %self.root)
+        f.write('cvmfs_server = %s\n' %cvmfsserver)
+        f.close()
+
+
+    # -------------------------------------------------------------------------
+    #   run
+    # -------------------------------------------------------------------------
+
+    def run(self, idle=60, duration=120, publishrate=1.0):
+        self.stratum0.start()
+
+        rss0, threads0 = procstatus()
+        before = time.time()
+        self.service = serviceCLI(Options(self.conffile))
+        self.manager = self.service.replica_manager
+        self.results['setup_seconds'] = time.time() - before
+        rss1, threads1 = procstatus()
+        self.results['rss_per_repository_kb'] = float(rss1 - rss0) / self.nrepositories
+
+        self._start()
+
+        # idle phase
+        time.sleep(min(5, idle))
+        cpu = cputime()
+        requests = self.stratum0.server.requests
+        time.sleep(idle)
+        cpu = cputime() - cpu
+        rss, threads = procstatus()
+        self.results['idle_threads'] = threads
+        self.results['idle_rss_kb'] = rss
+        self.results['idle_cpu_seconds_per_hour_per_repository'] = cpu / idle * 3600 / self.nrepositories
+        self.results['idle_http_requests_per_second'] = (self.stratum0.server.requests - requests) / float(idle)
+
+        # load phase
+        before = time.time()
+        published = 0
+        cpu = cputime()
+        while time.time() - before < duration:
+            self.stratum0.publish(random.choice(self.names))
+            published += 1
+            time.sleep(1.0 / publishrate)
+        elapsed = time.time() - before
+        cpu = cputime() - cpu
+        rss, threads = procstatus()
+        attempts = self.service.metrics.counters['cvmfsreplica_snapshot_attempts_total']
+        successes = attempts.get((('result', 'success'),), 0)
+        self.results['load_published'] = published
+        self.results['load_threads'] = threads
+        self.results['load_rss_kb'] = rss
+        self.results['load_cpu_seconds_per_second'] = cpu / elapsed
+        self.results['load_snapshots'] = sum(attempts.values())
+        self.results['load_throughput_per_second'] = successes / elapsed
+
+        self._stop()
+        self._readtraces()
+        self.stratum0.join()
+        return self.results
+
+
+    def _start(self):
+        '''
+        starts the threads of the ReplicaManager.
+        They are all daemon threads, so the benchmark
+        does not wait for Repository threads sleeping until their next cycle.
+        '''
+        manager = self.manager
+        threads = manager.repositories + manager.replicaagents + [manager.supervisor, manager.filewatcher]
+        for thread in [manager.scheduler, manager.manifestpoller, manager.adaptiveconcurrency]:
+            if thread:
+                threads.append(thread)
+        for thread in threads:
+            thread.setDaemon(True)
+        manager._start_threads()
+
+
+    def _stop(self):
+        stopper = threading.Thread(target=self.manager.shutdown)
+        stopper.setDaemon(True)
+        stopper.start()
+        stopper.join(30)
+
+
+    def _readtraces(self):
+        '''
+        dispatch and end-to-end latencies, from the trace file
+        '''
+        dispatch = []
+        endtoend = []
+        for line in open(os.path.join(self.root, 'trace.log')):
+            trace = json.loads(line)
+            if 'queuewait' in trace:
+                dispatch.append(trace['queuewait'])
+            if 'total' in trace:
+                endtoend.append(trace['total'])
+        for name, values in [('dispatch_latency', dispatch), ('end_to_end_latency', endtoend)]:
+            self.results['%s_p50' %name] = percentile(values, 50)
+            self.results['%s_p95' %name] = percentile(values, 95)
+            self.results['%s_max' %name] = percentile(values, 100)
+
+
+# =============================================================================
+
+def main(argv):
+    parameters = {}
+    run = {}
+    root = None
+    output = None
+    opts, args = getopt.getopt(argv, '', ['repositories=', 'scheduler=', 'interval=', 'agents=',
+                                          'idle=', 'duration=', 'publish-rate=',
+                                          'snapshot-duration=', 'distribution=', 'failure-rate=',
+                                          'root=', 'output='])
+    for o, a in opts:
+        if o == '--repositories':
+            parameters['nrepositories'] = int(a)
+        elif o == '--scheduler':
+            parameters['scheduler'] = a
+        elif o == '--interval':
+            parameters['interval'] = int(a)
+        elif o == '--agents':
+            parameters['agents'] = int(a)
+        elif o == '--snapshot-duration':
+            parameters['snapshotduration'] = float(a)
+        elif o == '--distribution':
+            parameters['distribution'] = a
+        elif o == '--failure-rate':
+            parameters['failurerate'] = float(a)
+        elif o == '--idle':
+            run['idle'] = int(a)
+        elif o == '--duration':
+            run['duration'] = int(a)
+        elif o == '--publish-rate':
+            run['publishrate'] = float(a)
+        elif o == '--root':
+            root = a
+        elif o == '--output':
+            output = a
+
+    cleanup = root is None
+    if root is None:
+        root = tempfile.mkdtemp(prefix='cvmfsreplica-benchmark-')
+    try:
+        fleet = Fleet(root, **parameters)
+        fleet.create()
+        results = fleet.run(**run)
+    finally:
+        if cleanup:
+            shutil.rmtree(root, ignore_errors=True)
+
+    results['parameters'] = dict(parameters, **run)
+    for key in sorted(results.keys()):
+        print('%-45s %s' %(key, results[key]))
+    if output:
+        f = open(output, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
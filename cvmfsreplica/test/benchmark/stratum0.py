@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+fake Stratum-0 server for the benchmark suite.
+
+It serves, over HTTP, the .cvmfspublished file of each repository
+from <root>/stratum0/<repositoryname>/.cvmfspublished
+with ETag support, so conditional requests get 304 Not Modified.
+"""
+
+import BaseHTTPServer
+import os
+import SocketServer
+import threading
+import time
+
+
+def manifest(repositoryname, revision):
+    '''
+    returns the content of a .cvmfspublished file
+    '''
+    return 'C0123456789abcdef\nB1234\nRd41d8cd98f00b204e9800998ecf8427e\nD900\nS%s\nN%s\nT%s\n--\n0123456789abcdef\n' \
+           %(revision, repositoryname, int(time.time()))
+
+
+class ManifestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests += 1
+        parts = self.path.strip('/').split('/')
+        revision = None
+        if len(parts) == 2 and parts[1] == '.cvmfspublished':
+            revision = self.server.revisions.get(parts[0])
+        if revision is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"%s"' %revision
+        if self.headers.getheader('If-None-Match') == etag:
+            self.server.notmodified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = open(self.server.path(parts[0])).read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ManifestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeStratum0(threading.Thread):
+    """
+    class to run the fake Stratum-0 server,
+    and to publish new revisions of its repositories.
+    """
+
+    def __init__(self, root, host='127.0.0.1', port=0):
+        """
+        root is the directory of the benchmark
+        port 0 means any free port
+        """
+        threading.Thread.__init__(self) # init the thread
+        self.setDaemon(True)
+        self.root = root
+        self.server = ManifestServer((host, port), ManifestHandler)
+        self.server.revisions = {}
+        self.server.requests = 0
+        self.server.notmodified = 0
+        self.server.path = self.path
+        self.lock = threading.Lock()
+
+
+    def url(self, repositoryname):
+        host, port = self.server.server_address
+        return 'http://%s:%s/%s' %(host, port, repositoryname)
+
+
+    def path(self, repositoryname):
+        return os.path.join(self.root, 'stratum0', repositoryname, '.cvmfspublished')
+
+
+    def publish(self, repositoryname):
+        '''
+        publishes a new revision of the repository.
+        Returns the new revision number.
+        '''
+        self.lock.acquire()
+        try:
+            revision = self.server.revisions.get(repositoryname, 0) + 1
+            path = self.path(repositoryname)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # written aside and renamed, so readers never see a partial file
+            f = open(path + '.tmp', 'w')
+            try:
+                f.write(manifest(repositoryname, revision))
+            finally:
+                f.close()
+            os.rename(path + '.tmp', path)
+            self.server.revisions[repositoryname] = revision
+            return revision
+        finally:
+            self.lock.release()
+
+
+    def run(self):
+        '''
+        Method called by thread.start()
+        Main functional loop.
+        '''
+        self.server.serve_forever()
+
+
+    def join(self, timeout=None):
+        '''
+        Stop the thread.
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+        threading.Thread.join(self, timeout)
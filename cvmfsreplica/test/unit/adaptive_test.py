@@ -0,0 +1,35 @@
+#/usr/bin/python
+
+import unittest
+
+
+from cvmfsreplica.adaptive import AdaptiveConcurrency
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    def setUp(self):
+        self.adaptive = AdaptiveConcurrency(None, 1, 8, max_iowait=0.3, max_load=1.0)
+        self.adaptive.limit = 4
+
+    def test_increase_when_saturated(self):
+        self.assertEqual(self.adaptive._decide(0.1, 0.5, 10, 10, True), 5)
+    def test_keep_when_not_saturated(self):
+        self.assertEqual(self.adaptive._decide(0.1, 0.5, 10, 10, False), 4)
+    def test_decrease_on_iowait(self):
+        self.assertEqual(self.adaptive._decide(0.5, 0.5, 10, 10, True), 2)
+    def test_decrease_on_load(self):
+        self.assertEqual(self.adaptive._decide(0.1, 2.0, 10, 10, True), 2)
+    def test_decrease_when_increase_did_not_help(self):
+        self.adaptive.increased = True
+        self.assertEqual(self.adaptive._decide(0.1, 0.5, 8, 10, True), 2)
+    def test_bounds(self):
+        self.adaptive.limit = 8
+        self.assertEqual(self.adaptive._decide(0.1, 0.5, 10, 10, True), 8)
+        self.adaptive.limit = 1
+        self.assertEqual(self.adaptive._decide(0.5, 0.5, 10, 10, True), 1)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from cvmfsreplica.httpclient import HTTPClient
+from cvmfsreplica.test.benchmark import fakecvmfsserver
+from cvmfsreplica.test.benchmark.stratum0 import FakeStratum0
+from cvmfsreplica.utils import date2seconds, get_revision
+
+
+class TestFakes(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.stratum0 = FakeStratum0(self.root)
+        self.stratum0.start()
+        os.makedirs(os.path.join(self.root, 'srv', 'foo'))
+
+    def tearDown(self):
+        self.stratum0.join()
+        shutil.rmtree(self.root)
+
+    def test_stratum0(self):
+        client = HTTPClient()
+        try:
+            url = '%s/.cvmfspublished' %self.stratum0.url('foo')
+            self.stratum0.publish('foo')
+            self.assertEqual(client.getrevision(url), 1)
+            self.assertEqual(client.getrevision(url), 1)
+            self.assertEqual(self.stratum0.server.notmodified, 1)
+            self.stratum0.publish('foo')
+            self.assertEqual(client.getrevision(url), 2)
+        finally:
+            client.close()
+
+    def test_snapshot(self):
+        self.stratum0.publish('foo')
+        self.stratum0.publish('foo')
+        argv = ['--root', self.root, '--duration', '0', 'snapshot', 'foo']
+        self.assertEqual(fakecvmfsserver.main(argv), 0)
+        storage = os.path.join(self.root, 'srv', 'foo')
+        self.assertEqual(get_revision(open(os.path.join(storage, '.cvmfspublished'))), 2)
+        date2seconds(open(os.path.join(storage, '.cvmfs_last_snapshot')).read().strip())
+
+    def test_failure(self):
+        self.stratum0.publish('foo')
+        argv = ['--root', self.root, '--duration', '0', '--failure-rate', '1', 'snapshot', 'foo']
+        self.assertEqual(fakecvmfsserver.main(argv), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'srv', 'foo', '.cvmfspublished')))
+
+
+if __name__ == '__main__':
+    unittest.main()
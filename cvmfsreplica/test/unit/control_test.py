@@ -0,0 +1,93 @@
+#/usr/bin/python
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+from cvmfsreplica.control import ControlClient, ControlServer
+from cvmfsreplica.service import serviceCLI
+from cvmfsreplica.test.benchmark.fleet import Fleet, Options
+from cvmfsreplica.utils import get_revision
+
+# the TRACE level is normally added by serviceCLI
+logging.Logger.trace = lambda self, msg, *args, **kwargs: self.log(5, msg, *args, **kwargs)
+
+
+class TestControl(unittest.TestCase):
+
+    scheduler = 'threads'
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fleet = Fleet(self.root, nrepositories=2, scheduler=self.scheduler, 
+                           interval=3600, agents=2, snapshotduration=0)
+        self.fleet.create()
+        self.fleet.stratum0.start()
+        self.fleet.service = serviceCLI(Options(self.fleet.conffile))
+        self.fleet.manager = self.fleet.service.replica_manager
+        self.fleet._start()
+        address = 'unix://%s/control.sock' %self.root
+        self.server = ControlServer(self.fleet.manager, address)
+        self.server.start()
+        self.client = ControlClient(address)
+
+    def tearDown(self):
+        self.server.join()
+        # Repository threads are daemons, sleeping for the whole interval,
+        # so they are not waited for
+        for repository in self.fleet.manager.repositories:
+            repository.stopevent.set()
+        self.fleet.manager.repositories = []
+        self.fleet._stop()
+        self.fleet.stratum0.join()
+        shutil.rmtree(self.root)
+
+    def _localrevision(self, name):
+        path = os.path.join(self.root, 'srv', name, '.cvmfspublished')
+        return get_revision(open(path))
+
+    def test_replicate(self):
+        name = self.fleet.names[0]
+        self.fleet.stratum0.publish(name)
+        before = time.time()
+        status, content = self.client.replicate(name)
+        self.assertEqual(status, 202)
+        self.assertEqual(content, {'repository': name, 'state': 'scheduled'})
+        while self._localrevision(name) != 2 and time.time() - before < 10:
+            time.sleep(0.05)
+        self.assertEqual(self._localrevision(name), 2)
+        # the other one is not touched
+        self.assertEqual(self._localrevision(self.fleet.names[1]), 1)
+
+    def test_unknown_repository(self):
+        status, content = self.client.replicate('foo.example.org')
+        self.assertEqual(status, 404)
+
+    def test_queue(self):
+        status, content = self.client.queue()
+        self.assertEqual(status, 200)
+        self.assertEqual(content, [])
+
+    def test_priority(self):
+        status, content = self.client.priority(self.fleet.names[0], 'high')
+        self.assertEqual(status, 400)
+        # nothing pending
+        status, content = self.client.priority(self.fleet.names[0], 100)
+        self.assertEqual(status, 404)
+
+    def test_cancel(self):
+        status, content = self.client.cancel(self.fleet.names[0])
+        self.assertEqual(status, 404)
+
+
+class TestControlLoop(TestControl):
+
+    scheduler = 'loop'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#/usr/bin/python
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+from cvmfsreplica.filewatcher import FileWatcher, readrevision, readtimestamp
+
+# the TRACE level is normally added by serviceCLI
+logging.Logger.trace = lambda self, msg, *args, **kwargs: self.log(5, msg, *args, **kwargs)
+
+
+class TestFileWatcher(unittest.TestCase):
+
+    useinotify = True
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, '.cvmfspublished')
+        self.watcher = FileWatcher(pollinterval=0.1, useinotify=self.useinotify)
+        if self.useinotify and self.watcher.inotify is None:
+            self.skipTest('inotify not available')
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.join()
+        shutil.rmtree(self.root)
+
+    def _publish(self, revision, rename=False):
+        tmp = self.path
+        if rename:
+            tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        f.write('C0123\nS%s\n--\n' %revision)
+        f.close()
+        if rename:
+            os.rename(tmp, self.path)
+
+    def _wait(self, condition):
+        before = time.time()
+        while not condition() and time.time() - before < 2:
+            time.sleep(0.01)
+        return condition()
+
+    def test_read_once(self):
+        self._publish(1)
+        for i in range(10):
+            self.assertEqual(self.watcher.get(self.path, readrevision), 1)
+        self.assertEqual(self.watcher.nreads, 1)
+
+    def test_change(self):
+        self._publish(1)
+        self.assertEqual(self.watcher.get(self.path, readrevision), 1)
+        self._publish(22)
+        self.assertTrue(self._wait(lambda: self.watcher.get(self.path) == 22))
+        self._publish(333, rename=True)
+        self.assertTrue(self._wait(lambda: self.watcher.get(self.path) == 333))
+
+    def test_missing(self):
+        self.assertRaises(IOError, self.watcher.get, self.path, readrevision)
+        self._publish(1)
+        self.assertTrue(self._wait(lambda: self.watcher.get(self.path) == 1))
+
+    def test_callback(self):
+        path = os.path.join(self.root, '.cvmfs_last_snapshot')
+        values = []
+        self.watcher.watch(path, readtimestamp, values.append)
+        self.watcher.wakeuppipe.wakeup()
+        f = open(path, 'w')
+        f.write('Fri Apr 15 15:32:19 UTC 2016\n')
+        f.close()
+        self.assertTrue(self._wait(lambda: values == [1460734339]))
+
+    def test_unwatch(self):
+        path = os.path.join(self.root, '.cvmfs_last_snapshot')
+        values = []
+        self.watcher.watch(path, readtimestamp, values.append)
+        self.watcher.unwatch(path, values.append)
+        self.assertFalse(path in self.watcher.entries)
+        f = open(path, 'w')
+        f.write('Fri Apr 15 15:32:19 UTC 2016\n')
+        f.close()
+        self.watcher.wakeuppipe.wakeup()
+        time.sleep(0.2)
+        self.assertEqual(values, [])
+
+
+class TestFileWatcherStat(TestFileWatcher):
+
+    useinotify = False
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+from cvmfsreplica.freespace import FreeSpaceCache
+
+
+class TestFreeSpaceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(10):
+            path = os.path.join(self.dir, 'repo%s' %i)
+            os.mkdir(path)
+            self.paths.append(path)
+        self.cache = FreeSpaceCache(ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_shared_by_filesystem(self):
+        for path in self.paths:
+            self.assertTrue(self.cache.free(path) > 0)
+        self.assertEqual(self.cache.nstatvfs, 1)
+
+    def test_ttl(self):
+        cache = FreeSpaceCache(ttl=0.1)
+        cache.free(self.dir)
+        time.sleep(0.2)
+        cache.free(self.dir)
+        self.assertEqual(cache.nstatvfs, 2)
+
+    def test_claim_and_release(self):
+        free = self.cache.free(self.dir)
+        nbytes = free / 2 + 1
+        self.assertTrue(self.cache.claim(self.paths[0], nbytes, 'repo0')[0])
+        # what is reserved for repo0 is not free for repo1
+        ok, available = self.cache.claim(self.paths[1], nbytes, 'repo1')
+        self.assertFalse(ok)
+        self.assertEqual(available, free - nbytes)
+        self.cache.release('repo0', written=False)
+        self.assertEqual(self.cache.nstatvfs, 1)
+        self.assertTrue(self.cache.claim(self.paths[1], nbytes, 'repo1')[0])
+        # after a snapshot, the filesystem is read again
+        self.cache.release('repo1')
+        self.cache.free(self.dir)
+        self.assertEqual(self.cache.nstatvfs, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#/usr/bin/python
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+
+from cvmfsreplica.history import percentile, SnapshotHistory
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), None)
+    def test_percentiles(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+
+
+class TestSnapshotHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = SnapshotHistory(':memory:')
+        self.history.record('foo', 1000, 10, 1, 1, False)
+        self.history.record('foo', 1100, 20, 2, 0, False)
+        self.history.record('foo', 2000, 30, 1, -15, True)
+        self.history.record('bar', 1000, 5, 1, 0, False)
+
+    def tearDown(self):
+        self.history.close()
+
+    def test_attempts(self):
+        self.assertEqual(len(self.history.attempts(repository='foo')), 3)
+        self.assertEqual(len(self.history.attempts(since=1050, until=2000)), 1)
+
+    def test_stats(self):
+        stats = self.history.stats(0, 3600)
+        self.assertEqual(stats['foo']['attempts'], 3)
+        self.assertEqual(stats['foo']['failures'], 2)
+        self.assertEqual(stats['foo']['timeouts'], 1)
+        self.assertEqual(stats['foo']['p50'], 20)
+        self.assertEqual(stats['foo']['throughput'], 1)
+        self.assertEqual(stats['bar']['failurerate'], 0)
+
+    def test_stats_repository(self):
+        stats = self.history.stats(repository='foo')
+        self.assertEqual(stats.keys(), ['foo'])
+        self.assertEqual(stats['foo']['p95'], 30)
+
+
+class TestReadOnlySnapshotHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'history.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_missing(self):
+        self.assertRaises(IOError, SnapshotHistory, self.path, readonly=True)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_query_only(self):
+        history = SnapshotHistory(self.path)
+        history.record('foo', 1000, 10, 1, 0, False)
+        history.close()
+        history = SnapshotHistory(self.path, readonly=True)
+        self.assertEqual(history.stats(0, 3600)['foo']['attempts'], 1)
+        self.assertRaises(sqlite3.Error, history.record, 'foo', 1100, 10, 1, 0, False)
+        history.close()
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#/usr/bin/python
+
+import unittest
+
+
+from cvmfsreplica.hostlimits import HostLimits, TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(1, 2)
+        now = bucket.last
+        bucket.take(now)
+        bucket.take(now)
+        self.assertFalse(bucket.available(now))
+        self.assertEqual(bucket.wait(now), 1)
+        self.assertTrue(bucket.available(now + 1))
+
+
+class TestHostLimits(unittest.TestCase):
+
+    def test_no_limits(self):
+        limits = HostLimits()
+        limits.start('foo', 0)
+        self.assertEqual(limits.wait('foo', 0), 0)
+
+    def test_maxconcurrent(self):
+        limits = HostLimits(maxconcurrent=1)
+        limits.start('foo', 0)
+        self.assertEqual(limits.wait('foo', 0), None)
+        self.assertEqual(limits.wait('bar', 0), 0)
+        limits.finish('foo')
+        self.assertEqual(limits.wait('foo', 0), 0)
+
+    def test_override(self):
+        limits = HostLimits(maxconcurrent=1, overrides={'foo': (2, None, 1)})
+        limits.start('foo', 0)
+        self.assertEqual(limits.wait('foo', 0), 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#/usr/bin/python
+
+import BaseHTTPServer
+import threading
+import unittest
+
+
+from cvmfsreplica.cvmfsreplicaex import HTTPRequestFailure
+from cvmfsreplica.httpclient import HTTPClient
+
+
+MANIFEST = 'C0123\nB1234\nS42\nT1460734339\n--\n0123456789abcdef\n'
+
+
+class ManifestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    serves .cvmfspublished files, with ETag support
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        if self.path != '/cvmfs/foo/.cvmfspublished':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"%s"' %hash(self.server.manifest)
+        if self.headers.getheader('If-None-Match') == etag:
+            self.server.notmodified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.server.manifest)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(self.server.manifest)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHTTPClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ManifestHandler)
+        self.server.manifest = MANIFEST
+        self.server.connections = 0
+        self.server.notmodified = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s/cvmfs/foo/.cvmfspublished' %self.server.server_port
+        self.client = HTTPClient(1, 1)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def test_revision(self):
+        self.assertEqual(self.client.getrevision(self.url), 42)
+
+    def test_not_modified(self):
+        self.client.getrevision(self.url)
+        self.assertEqual(self.client.getrevision(self.url), 42)
+        self.assertEqual(self.server.notmodified, 1)
+
+    def test_modified(self):
+        self.client.getrevision(self.url)
+        self.server.manifest = MANIFEST.replace('S42', 'S43')
+        self.assertEqual(self.client.getrevision(self.url), 43)
+        self.assertEqual(self.server.notmodified, 0)
+
+    def test_keepalive(self):
+        for i in range(3):
+            self.client.getrevision(self.url)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_not_found(self):
+        self.assertRaises(HTTPRequestFailure, self.client.getrevision, self.url + 'x')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
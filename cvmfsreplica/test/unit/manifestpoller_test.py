@@ -0,0 +1,64 @@
+#/usr/bin/python
+
+import logging
+import time
+import unittest
+
+
+from cvmfsreplica.manifestpoller import ManifestPoller
+
+# the TRACE level is normally added by serviceCLI
+logging.Logger.trace = lambda self, msg, *args, **kwargs: self.log(5, msg, *args, **kwargs)
+
+
+class FakeHTTPClient(object):
+
+    def __init__(self):
+        self.requests = []
+
+    def getrevision(self, url):
+        self.requests.append(url)
+        return 42
+
+
+class TestManifestPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.httpclient = FakeHTTPClient()
+
+    def test_cached(self):
+        poller = ManifestPoller(self.httpclient, 60, 120)
+        self.assertEqual(poller.getrevision('http://foo/cvmfs/a/.cvmfspublished'), 42)
+        self.assertEqual(poller.getrevision('http://foo/cvmfs/a/.cvmfspublished'), 42)
+        self.assertEqual(len(self.httpclient.requests), 1)
+
+    def test_expired(self):
+        poller = ManifestPoller(self.httpclient, 60, 0)
+        poller.getrevision('http://foo/cvmfs/a/.cvmfspublished')
+        poller.getrevision('http://foo/cvmfs/a/.cvmfspublished')
+        self.assertEqual(len(self.httpclient.requests), 2)
+
+    def test_sweep(self):
+        poller = ManifestPoller(self.httpclient, 60, 120)
+        poller.register('http://foo/cvmfs/a/.cvmfspublished')
+        poller.register('http://foo/cvmfs/b/.cvmfspublished')
+        poller.register('http://bar/cvmfs/c/.cvmfspublished')
+        poller.start()
+        time.sleep(0.2)
+        poller.join()
+        self.assertEqual(len(self.httpclient.requests), 3)
+        poller.getrevision('http://bar/cvmfs/c/.cvmfspublished')
+        self.assertEqual(len(self.httpclient.requests), 3)
+
+    def test_unregister(self):
+        poller = ManifestPoller(self.httpclient, 60, 120)
+        poller.register('http://foo/cvmfs/a/.cvmfspublished')
+        poller.getrevision('http://foo/cvmfs/a/.cvmfspublished')
+        poller.unregister('http://foo/cvmfs/a/.cvmfspublished')
+        self.assertEqual(poller.urls, [])
+        self.assertEqual(poller.cache, {})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#/usr/bin/python
+
+import unittest
+import urllib2
+
+
+from cvmfsreplica.metrics import Metrics, MetricsServer
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_counter(self):
+        self.metrics.describe('requests_total', 'counter', 'Requests')
+        self.metrics.inc('requests_total', {'result': 'success'})
+        self.metrics.inc('requests_total', {'result': 'success'})
+        self.metrics.inc('requests_total', {'result': 'failure'})
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines[0], '# HELP requests_total Requests')
+        self.assertEqual(lines[1], '# TYPE requests_total counter')
+        self.assertTrue('requests_total{result="success"} 2.0' in lines)
+        self.assertTrue('requests_total{result="failure"} 1.0' in lines)
+
+    def test_histogram(self):
+        self.metrics.describe('duration_seconds', 'histogram', 'Duration', buckets=[1, 10])
+        self.metrics.observe('duration_seconds', 0.5)
+        self.metrics.observe('duration_seconds', 5)
+        self.metrics.observe('duration_seconds', 50)
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines[2:], ['duration_seconds_bucket{le="1.0"} 1',
+                                     'duration_seconds_bucket{le="10.0"} 2',
+                                     'duration_seconds_bucket{le="+Inf"} 3',
+                                     'duration_seconds_sum 55.5',
+                                     'duration_seconds_count 3'])
+
+    def test_gauge(self):
+        self.metrics.describe('age_seconds', 'gauge', 'Age')
+        self.metrics.addcollector(lambda: [('age_seconds', {'repository': 'a"b'}, 3)])
+        lines = self.metrics.render().splitlines()
+        self.assertEqual(lines[2], 'age_seconds{repository="a\\"b"} 3.0')
+
+    def test_broken_collector(self):
+        self.metrics.describe('age_seconds', 'gauge', 'Age')
+        self.metrics.addcollector(lambda: 1 / 0)
+        self.assertEqual(len(self.metrics.render().splitlines()), 2)
+
+
+class TestMetricsServer(unittest.TestCase):
+
+    def test_http(self):
+        metrics = Metrics()
+        metrics.describe('requests_total', 'counter', 'Requests')
+        metrics.inc('requests_total')
+        server = MetricsServer(metrics, 'http://127.0.0.1:0')
+        server.start()
+        try:
+            port = server.server.server_address[1]
+            body = urllib2.urlopen('http://127.0.0.1:%s/metrics' %port).read()
+            self.assertTrue('requests_total 1.0\n' in body)
+        finally:
+            server.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#/usr/bin/python
+
+import asyncore
+import email
+import smtpd
+import threading
+import time
+import unittest
+
+
+from cvmfsreplica.notifier import EmailDispatcher
+
+
+class FakeSMTPServer(smtpd.SMTPServer):
+    '''
+    records the messages received, 
+    and how many connections were opened
+    '''
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.messages = []
+        self.connections = 0
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, email.message_from_string(data)))
+
+
+class TestEmailDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.smtp = FakeSMTPServer()
+        self.address = '127.0.0.1:%s' %self.smtp.getsockname()[1]
+        self.loop = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05})
+        self.loop.setDaemon(True)
+        self.loop.start()
+        self.dispatcher = None
+
+    def tearDown(self):
+        if self.dispatcher:
+            self.dispatcher.join()
+        self.smtp.close()
+        asyncore.close_all()
+
+    def _dispatcher(self, **kwargs):
+        self.dispatcher = EmailDispatcher(**kwargs)
+        self.dispatcher.start()
+        return self.dispatcher
+
+    def _wait(self, n, timeout=2):
+        before = time.time()
+        while len(self.smtp.messages) < n and time.time() - before < timeout:
+            time.sleep(0.01)
+
+    def test_submit_does_not_block(self):
+        dispatcher = self._dispatcher(window=0.2)
+        before = time.time()
+        dispatcher.submit('127.0.0.1:1', 'admin@example.org', 'foo', 'failed')
+        self.assertTrue(time.time() - before < 0.1)
+
+    def test_single(self):
+        dispatcher = self._dispatcher(window=0)
+        dispatcher.submit(self.address, 'admin@example.org', 'foo', 'foo failed')
+        self._wait(1)
+        rcpttos, msg = self.smtp.messages[0]
+        self.assertEqual(rcpttos, ['admin@example.org'])
+        self.assertEqual(msg['Subject'], 'ALERT: CVMFS replica failed')
+        self.assertEqual(msg.get_payload(), 'foo failed')
+
+    def test_digest(self):
+        dispatcher = self._dispatcher(window=0.3)
+        for i in range(200):
+            dispatcher.submit(self.address, 'admin@example.org', 'repo%s' %i, 'repo%s failed' %i)
+        dispatcher.submit(self.address, 'other@example.org', 'foo', 'foo failed')
+        self._wait(2)
+        time.sleep(0.2)
+        self.assertEqual(len(self.smtp.messages), 2)
+        subjects = sorted([msg['Subject'] for rcpttos, msg in self.smtp.messages])
+        self.assertEqual(subjects, ['ALERT: CVMFS replica failed',
+                                    'ALERT: CVMFS replica failed for 200 repositories'])
+        # one single connection
+        self.assertEqual(self.smtp.connections, 1)
+
+    def test_rate_limit(self):
+        # one email per second
+        dispatcher = self._dispatcher(window=0, rate=60, burst=1)
+        dispatcher.submit(self.address, 'admin@example.org', 'foo', 'foo failed')
+        self._wait(1)
+        dispatcher.submit(self.address, 'admin@example.org', 'bar', 'bar failed')
+        dispatcher.submit(self.address, 'admin@example.org', 'baz', 'baz failed')
+        time.sleep(0.3)
+        self.assertEqual(len(self.smtp.messages), 1)
+        self._wait(2)
+        self.assertEqual(len(self.smtp.messages), 2)
+        self.assertEqual(self.smtp.messages[1][1]['Subject'],
+                         'ALERT: CVMFS replica failed for 2 repositories')
+
+    def test_pending_sent_on_stop(self):
+        dispatcher = self._dispatcher(window=60)
+        dispatcher.submit(self.address, 'admin@example.org', 'foo', 'foo failed')
+        dispatcher.join()
+        self.dispatcher = None
+        self._wait(1)
+        self.assertEqual(len(self.smtp.messages), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
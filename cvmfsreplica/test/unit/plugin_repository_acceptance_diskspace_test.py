@@ -0,0 +1,71 @@
+#/usr/bin/python
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from cvmfsreplica.cvmfsreplicaex import AcceptancePluginFailed
+from cvmfsreplica.freespace import FreeSpaceCache
+from cvmfsreplica.plugins.repository.acceptance.Diskspace import Diskspace
+from cvmfsreplica.pyconfidence import SingleSectionConfig
+
+logging.Logger.trace = lambda self, msg, *args, **kwargs: self.log(5, msg, *args, **kwargs)
+
+
+class FakeManager(object):
+
+    def __init__(self):
+        self.freespace = FreeSpaceCache()
+
+
+class FakeRepository(object):
+
+    def __init__(self, name, dir, manager):
+        self.repositoryname = name
+        self.manager = manager
+        self.cvmfsconf = SingleSectionConfig()
+        self.cvmfsconf.set('CVMFS_SPOOL_DIR', dir)
+        self.cvmfsconf.set('CVMFS_UPSTREAM_STORAGE', 'local,%s,%s' %(dir, dir))
+
+
+class TestDiskspace(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.manager = FakeManager()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _diskspace(self, name, spool_size, storage_size, should_abort=False):
+        conf = SingleSectionConfig()
+        conf.set('diskspace.spool_size', str(spool_size))
+        conf.set('diskspace.storage_size', str(storage_size))
+        conf.set('diskspace.should_abort', str(should_abort))
+        return Diskspace(FakeRepository(name, self.dir, self.manager), conf)
+
+    def test_enough_space(self):
+        self.assertTrue(self._diskspace('foo', 0, 0).verify())
+
+    def test_spool_is_checked(self):
+        self.assertFalse(self._diskspace('foo', 10**18, 0).verify())
+        # nothing stays reserved after a failure
+        self.assertEqual(self.manager.freespace.reservations, {})
+
+    def test_abort(self):
+        diskspace = self._diskspace('foo', 0, 10**18, should_abort=True)
+        self.assertRaises(AcceptancePluginFailed, diskspace.verify)
+
+    def test_reserved_space_is_not_free(self):
+        third = self.manager.freespace.free(self.dir) / 3 + 1
+        self.assertTrue(self._diskspace('foo', third, third).verify())
+        self.assertFalse(self._diskspace('bar', third, third).verify())
+        self.manager.freespace.release('foo')
+        self.assertTrue(self._diskspace('bar', third, third).verify())
+
+
+if __name__ == '__main__':
+    unittest.main()
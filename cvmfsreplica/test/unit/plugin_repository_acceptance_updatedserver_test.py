@@ -0,0 +1,74 @@
+#/usr/bin/python
+
+import logging
+import unittest
+
+
+from cvmfsreplica.plugins.repository.acceptance.Updatedserver import Updatedserver
+from cvmfsreplica.pyconfidence import SingleSectionConfig
+
+logging.Logger.trace = lambda self, msg, *args, **kwargs: self.log(5, msg, *args, **kwargs)
+
+
+class FakeManifestPoller(object):
+
+    def __init__(self, revision):
+        self.revision = revision
+
+    def register(self, url):
+        pass
+
+    def getrevision(self, url):
+        return self.revision
+
+
+class FakeFileWatcher(object):
+
+    def __init__(self, revision):
+        self.revision = revision
+
+    def watch(self, path, reader):
+        pass
+
+    def get(self, path, parser=None):
+        return self.revision
+
+
+class FakeManager(object):
+
+    def __init__(self, serverrevision, localrevision):
+        self.manifestpoller = FakeManifestPoller(serverrevision)
+        self.filewatcher = FakeFileWatcher(localrevision)
+
+
+class FakeRepository(object):
+
+    def __init__(self, manager):
+        self.repositoryname = 'foo'
+        self.manager = manager
+        self.cvmfsconf = SingleSectionConfig()
+        self.cvmfsconf.set('CVMFS_STRATUM0', 'http://stratum0/cvmfs/foo')
+
+    def _get_cvmfs_upstream_storage(self):
+        return '/srv/cvmfs/foo'
+
+
+class TestUpdatedserver(unittest.TestCase):
+
+    def _updatedserver(self, serverrevision, localrevision):
+        manager = FakeManager(serverrevision, localrevision)
+        return Updatedserver(FakeRepository(manager), SingleSectionConfig())
+
+    def test_new_revision(self):
+        self.assertTrue(self._updatedserver(11, 10).verify())
+
+    def test_same_revision(self):
+        self.assertFalse(self._updatedserver(10, 10).verify())
+
+    def test_cached_revision_older_than_snapshot(self):
+        # the poller has not seen yet the revision just replicated
+        self.assertFalse(self._updatedserver(10, 11).verify())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+from cvmfsreplica.metrics import Metrics
+from cvmfsreplica.plugins.repository.post.Cleanup import Cleanup
+from cvmfsreplica.pyconfidence import SingleSectionConfig
+
+
+class FakeManager(object):
+
+    def __init__(self):
+        self.metrics = Metrics()
+        self.metrics.describe('cvmfsreplica_cleanup_files_removed_total', 'counter', '')
+        self.metrics.describe('cvmfsreplica_cleanup_bytes_freed_total', 'counter', '')
+
+
+class FakeRepository(object):
+
+    def __init__(self, srvdir):
+        self.repositoryname = 'foo'
+        self.manager = FakeManager()
+        self.cvmfsconf = SingleSectionConfig()
+        self.cvmfsconf.set('CVMFS_UPSTREAM_STORAGE', 'local,%s,/srv/cvmfs/foo' %srvdir)
+
+
+class TestCleanup(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.srvdir = os.path.join(self.dir, 'txn')
+        os.mkdir(self.srvdir)
+        for i in range(25):
+            f = open(os.path.join(self.srvdir, 'file%s' %i), 'w')
+            f.write('x' * 10)
+            f.close()
+        os.mkdir(os.path.join(self.srvdir, 'subdir'))
+        self.repository = FakeRepository(self.srvdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _cleanup(self, **options):
+        conf = SingleSectionConfig()
+        for option, value in options.items():
+            conf.set('post.cleanup.%s' %option, str(value))
+        return Cleanup(self.repository, conf)
+
+    def test_serial(self):
+        cleanup = self._cleanup()
+        cleanup.run()
+        self.assertEqual(os.listdir(self.srvdir), ['subdir'])
+        self.assertEqual(cleanup.filesremoved, 25)
+        self.assertEqual(cleanup.bytesfreed, 250)
+        counters = self.repository.manager.metrics.counters
+        self.assertEqual(counters['cvmfsreplica_cleanup_files_removed_total'][()], 25)
+
+    def test_parallel_batches(self):
+        cleanup = self._cleanup(workers=3, batch_size=4)
+        cleanup.run()
+        self.assertEqual(os.listdir(self.srvdir), ['subdir'])
+        self.assertEqual(cleanup.filesremoved, 25)
+
+    def test_throttle(self):
+        cleanup = self._cleanup(batch_size=5, max_files_per_second=100)
+        before = time.time()
+        cleanup.run()
+        self.assertTrue(time.time() - before >= 0.2)
+        self.assertEqual(cleanup.filesremoved, 25)
+
+    def test_background(self):
+        cleanup = self._cleanup(background=True, batch_size=5, max_files_per_second=50)
+        before = time.time()
+        cleanup.run()
+        self.assertTrue(time.time() - before < 0.2)
+        cleanup.wait()
+        self.assertTrue(time.time() - before >= 0.4)
+        self.assertEqual(cleanup.filesremoved, 25)
+
+    def test_missing_directory(self):
+        shutil.rmtree(self.srvdir)
+        cleanup = self._cleanup()
+        cleanup.run()
+        self.assertEqual(cleanup.filesremoved, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#/usr/bin/python
+
+import ConfigParser
+import StringIO
+import unittest
+
+
+from cvmfsreplica.pyconfidence import Config, SingleSectionConfig
+
+
+CONF = '''
+[DEFAULT]
+enabled = True
+ntrials = 3
+acceptanceplugins = Updatedserver
+acceptance.updatedserver.reportplugins = Email
+acceptance.updatedserver.report.email.admin_email = neo@matrix.net
+snapshotlog = /var/log/%(repositoryname)s.log
+
+[REPO1]
+repositoryname = foo
+interval = 600
+
+[REPO2]
+repositoryname = bar
+interval = 300
+ntrials = 1
+'''
+
+
+class TestSectionView(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = Config()
+        self.conf.readfp(StringIO.StringIO(CONF))
+        self.repo1 = self.conf.getSection('REPO1')
+        self.repo2 = self.conf.getSection('REPO2')
+
+    def test_values(self):
+        self.assertEqual(self.repo1.get('repositoryname'), 'foo')
+        self.assertEqual(self.repo1.getint('interval'), 600)
+        self.assertEqual(self.repo1.getint('ntrials'), 3)
+        self.assertEqual(self.repo2.getint('ntrials'), 1)
+        self.assertEqual(self.repo1.getboolean('enabled'), True)
+        self.assertEqual(self.repo1.getlist('acceptanceplugins'), ['Updatedserver'])
+        self.assertTrue(self.repo1.has_option('interval'))
+        self.assertFalse(self.repo1.has_option('timeout'))
+        self.assertRaises(ConfigParser.NoOptionError, self.repo1.get, 'timeout')
+
+    def test_interpolation(self):
+        self.assertEqual(self.repo1.get('snapshotlog'), '/var/log/foo.log')
+        self.assertEqual(self.repo2.get('snapshotlog'), '/var/log/bar.log')
+
+    def test_shared_defaults(self):
+        self.assertTrue(self.repo1.defaults is self.repo2.defaults)
+        self.assertFalse('ntrials' in self.repo1.values)
+        self.assertFalse('snapshotlog' in self.repo1.defaults)
+
+    def test_defaults_follow_changes(self):
+        self.conf.set('DEFAULT', 'ntrials', '5')
+        self.assertEqual(self.conf.getSection('REPO1').getint('ntrials'), 5)
+
+    def test_converted_per_config(self):
+        self.repo1.getint('interval')
+        self.assertTrue(self.repo1.converted is self.repo2.converted)
+        self.assertTrue(self.repo1.namespace('foo.').converted is self.repo1.converted)
+        self.assertEqual(self.repo1.converted, {(int, '600'): 600})
+        other = Config()
+        other.readfp(StringIO.StringIO(CONF))
+        self.assertEqual(other.getSection('REPO1').converted, {})
+
+    def test_immutable(self):
+        self.assertRaises(AttributeError, setattr, self.repo1, 'foo', 1)
+        self.assertFalse(hasattr(self.repo1, 'set'))
+
+    def test_namespace(self):
+        ns = self.repo1.namespace('acceptance.updatedserver.', exclude=True)
+        self.assertEqual(ns.get('reportplugins'), 'Email')
+        self.assertEqual(ns.get('report.email.admin_email'), 'neo@matrix.net')
+        self.assertFalse(ns.has_option('interval'))
+        self.assertEqual(sorted(ns.options()), ['report.email.admin_email', 'reportplugins'])
+        # options of the parent are also visible
+        ns = self.repo1.namespace('acceptance.updatedserver.')
+        self.assertEqual(ns.getint('interval'), 600)
+        self.assertEqual(ns.get('reportplugins'), 'Email')
+        self.assertFalse(ns.has_option('acceptance.updatedserver.reportplugins'))
+
+    def test_namespace_replace(self):
+        ns = self.repo1.namespace('acceptance.updatedserver.', replace='x.', exclude=True)
+        self.assertEqual(ns.get('x.reportplugins'), 'Email')
+        self.assertFalse(ns.has_option('reportplugins'))
+
+    def test_bad_value(self):
+        self.assertRaises(ValueError, self.repo1.getint, 'repositoryname')
+        self.assertRaises(ValueError, self.repo1.getboolean, 'repositoryname')
+
+
+class TestSingleSectionConfig(unittest.TestCase):
+
+    def test_getboolean(self):
+        conf = SingleSectionConfig()
+        conf.set('a', 'yes')
+        conf.set('b', 'off')
+        self.assertEqual(conf.getboolean('a'), True)
+        self.assertEqual(conf.getboolean('b'), False)
+
+    def test_namespace(self):
+        conf = SingleSectionConfig()
+        conf.set('diskspace.spool_size', '10')
+        conf.set('interval', '600')
+        ns = conf.namespace('diskspace.', exclude=True)
+        self.assertEqual(ns.getint('spool_size'), 10)
+        self.assertFalse(ns.has_option('interval'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,702 @@
+#/usr/bin/python
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+from cvmfsreplica.cvmfsreplicaex import AcceptancePluginFailed, RepositoriesConfigurationFailure
+from cvmfsreplica.hostlimits import HostLimits
+from cvmfsreplica.pyconfidence import SingleSectionConfig
+from cvmfsreplica.replicas import ReplicaManager, ReplicaRequest, ReplicaRequestQueue, Repository
+from cvmfsreplica.service import serviceCLI
+from cvmfsreplica.statejournal import StateJournal
+from cvmfsreplica.test.benchmark.fleet import Fleet, Options
+
+
+class FakeRepository(object):
+
+    def __init__(self, repositoryname, priority=0, upstreamhost=None):
+        self.repositoryname = repositoryname
+        self.priority = priority
+        self.upstreamhost = upstreamhost
+        self.ntrials = 1
+        self.timeout = None
+
+
+class BareManager(ReplicaManager):
+    '''
+    a ReplicaManager with nothing created
+    '''
+    def __init__(self):
+        pass
+
+
+class Accept(object):
+    def verify(self):
+        return True
+
+class Reject(object):
+    def verify(self):
+        return False
+
+class Hang(object):
+    def verify(self):
+        time.sleep(2)
+        return True
+
+class Slow(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+    def verify(self):
+        time.sleep(self.seconds)
+        return True
+
+class SlowClaim(object):
+    '''
+    reserves space, like Diskspace, after the others have answered
+    '''
+    def __init__(self, freespace, path, repositoryname):
+        self.freespace = freespace
+        self.path = path
+        self.repositoryname = repositoryname
+    def verify(self):
+        time.sleep(0.5)
+        return self.freespace.claim(self.path, 1000, self.repositoryname)[0]
+
+class Abort(object):
+    def verify(self):
+        raise AcceptancePluginFailed('abort')
+
+
+def stop_manager(manager):
+    '''
+    stops the threads a ReplicaManager creates before it runs
+    '''
+    manager.acceptancepool.stop()
+    if manager.scheduler:
+        manager.scheduler.cyclepool.stop()
+    manager.httpclient.close()
+
+
+class RepositoryTestCase(unittest.TestCase):
+    '''
+    tests with one real Repository, and its ReplicaManager,
+    created from a Fleet
+    '''
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        fleet = Fleet(self.root, nrepositories=1, scheduler='loop', interval=3600)
+        fleet.create()
+        self.manager = serviceCLI(Options(fleet.conffile)).replica_manager
+        self.repository = self.manager.repositories[0]
+
+    def tearDown(self):
+        stop_manager(self.manager)
+        shutil.rmtree(self.root)
+
+
+class TestSchedule(RepositoryTestCase):
+
+    def schedule_repository(self, name, interval, schedule='interval', jitter=None):
+        '''
+        a new Repository, like the one of the Fleet,
+        with another name and schedule
+        '''
+        cvmfsrepositoriesdir = self.manager.service.cvmfsrepositoriesdir
+        directory = os.path.join(cvmfsrepositoriesdir, name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            shutil.copy(os.path.join(cvmfsrepositoriesdir, self.repository.repositoryname, 'server.conf'), directory)
+        conf = SingleSectionConfig()
+        for option, value in self.repository.conf.items():
+            conf.set(option, value)
+        conf.set('interval', str(interval))
+        conf.set('schedule', schedule)
+        if jitter is not None:
+            conf.set('schedule_jitter', str(jitter))
+        return Repository(self.manager, name, conf)
+
+    def test_interval(self):
+        repository = self.schedule_repository('foo', 600)
+        self.assertEqual(repository._due(1000), 1600)
+
+    def test_phase(self):
+        repository = self.schedule_repository('foo', 600, 'phase')
+        for last in [0, 1000, 1000 + repository.phase, 123456]:
+            due = repository._due(last)
+            self.assertTrue(last < due <= last + 600)
+            self.assertEqual(due % 600, repository.phase)
+
+    def test_phase_is_stable(self):
+        self.assertEqual(self.schedule_repository('foo', 600, 'phase').phase,
+                         self.schedule_repository('foo', 600, 'phase').phase)
+
+    def test_phase_spread(self):
+        # 600 repositories, all with interval 600, 
+        # in 10 buckets of 60 seconds
+        buckets = [0] * 10
+        for i in range(600):
+            repository = self.schedule_repository('repo%s.example.org' %i, 600, 'phase')
+            buckets[repository._due(0) % 600 / 60] += 1
+        self.assertTrue(min(buckets) > 30)
+
+    def test_jitter(self):
+        repository = self.schedule_repository('foo', 600, 'interval', 30)
+        for i in range(100):
+            self.assertTrue(1600 <= repository._due(1000) <= 1630)
+        self.assertEqual(self.schedule_repository('foo', 20, 'interval', 30).jitter, 20)
+
+    def test_wrong_schedule(self):
+        self.assertRaises(RepositoriesConfigurationFailure, self.schedule_repository, 'foo', 600, 'random')
+
+
+class TestVerifyAcceptance(RepositoryTestCase):
+
+    def acceptance_repository(self, plugins, timeouts=None):
+        '''
+        the Repository, with other acceptance plugins
+        '''
+        self.repository.acceptanceplugins = plugins
+        self.repository.acceptancetimeouts = dict(timeouts or {})
+        return self.repository
+
+    def test_all_accept(self):
+        repository = self.acceptance_repository([Accept(), Accept()])
+        self.assertTrue(repository._verify_acceptance())
+        self.assertTrue('Accept' in repository.acceptancelatency)
+
+    def test_reject_does_not_wait(self):
+        repository = self.acceptance_repository([Hang(), Reject()])
+        before = time.time()
+        self.assertFalse(repository._verify_acceptance())
+        self.assertTrue(time.time() - before < 1)
+
+    def test_deadline(self):
+        repository = self.acceptance_repository([Hang(), Accept()], {'Hang': 0.2})
+        before = time.time()
+        self.assertFalse(repository._verify_acceptance())
+        self.assertTrue(time.time() - before < 1)
+
+    def test_deadline_counts_from_start(self):
+        # the last plugin waits for a free thread in the pool
+        nworkers = self.manager.service.acceptanceworkers
+        plugins = [Slow(0.3) for i in range(nworkers + 1)]
+        repository = self.acceptance_repository(plugins, {'Slow': 0.5})
+        self.assertTrue(repository._verify_acceptance())
+
+    def test_overdue(self):
+        repository = self.acceptance_repository([Slow(0.5)], {'Slow': 0.1})
+        overdue = repository.manager.acceptanceoverdue
+        self.assertFalse(repository._verify_acceptance())
+        self.assertEqual(overdue.value, 1)
+        time.sleep(0.6)
+        self.assertEqual(overdue.value, 0)
+
+    def test_release_after_late_claim(self):
+        repository = self.acceptance_repository([Reject()])
+        freespace = repository.manager.freespace
+        repository.acceptanceplugins.append(SlowClaim(freespace, tempfile.gettempdir(), repository.repositoryname))
+        self.assertFalse(repository._verify_acceptance())
+        time.sleep(1)
+        self.assertEqual(freespace.reservations, {})
+
+    def test_reconfigured_while_running(self):
+        repository = self.acceptance_repository([Hang()], {'Hang': 0.5})
+        # as reconfigure() does, with a new configuration with no plugins
+        def reconfigure():
+            repository.acceptanceplugins = []
+            repository.acceptancetimeouts = {}
+        threading.Timer(0.1, reconfigure).start()
+        self.assertFalse(repository._verify_acceptance())
+
+    def test_abort(self):
+        repository = self.acceptance_repository([Abort()])
+        self.assertRaises(AcceptancePluginFailed, repository._verify_acceptance)
+
+
+class TestReplicaRequest(unittest.TestCase):
+
+    def test_wait_returns_status(self):
+        req = ReplicaRequest(FakeRepository('foo'))
+        t = threading.Timer(0.1, req.setdone, [0])
+        t.start()
+        self.assertEqual(req.wait(), 0)
+        self.assertTrue(req.done)
+
+
+class TestReplicaRequestQueue(unittest.TestCase):
+
+    def test_priority_order(self):
+        queue = ReplicaRequestQueue()
+        queue.put(ReplicaRequest(FakeRepository('low', 0)))
+        queue.put(ReplicaRequest(FakeRepository('high', 10)))
+        self.assertEqual(queue.get().repositoryname, 'high')
+        self.assertEqual(queue.get().repositoryname, 'low')
+
+    def test_get_blocks_until_put(self):
+        queue = ReplicaRequestQueue()
+        t = threading.Timer(0.1, queue.put, [ReplicaRequest(FakeRepository('foo'))])
+        t.start()
+        before = time.time()
+        self.assertEqual(queue.get().repositoryname, 'foo')
+        self.assertTrue(time.time() - before < 1)
+
+    def test_trace(self):
+        queue = ReplicaRequestQueue()
+        queue.put(ReplicaRequest(FakeRepository('foo')))
+        req = queue.get()
+        queue.release(req)
+        req.setdone(0)
+        events = [name for name, t in req.trace.events]
+        self.assertEqual(events, ['created', 'enqueued', 'dequeued', 'done'])
+        self.assertEqual(req.trace.status, 0)
+
+    def test_close_wakes_up_get(self):
+        queue = ReplicaRequestQueue()
+        t = threading.Timer(0.1, queue.close)
+        t.start()
+        self.assertEqual(queue.get(), None)
+
+    def test_limit(self):
+        queue = ReplicaRequestQueue()
+        queue.setlimit(1)
+        queue.put(ReplicaRequest(FakeRepository('foo')))
+        queue.put(ReplicaRequest(FakeRepository('bar')))
+        req = queue.get()
+        t = threading.Timer(0.2, queue.release, [req])
+        t.start()
+        before = time.time()
+        queue.get()
+        self.assertTrue(time.time() - before >= 0.1)
+        self.assertEqual(queue.completed, 1)
+
+    def test_host_skip_ahead(self):
+        queue = ReplicaRequestQueue(HostLimits(maxconcurrent=1))
+        queue.put(ReplicaRequest(FakeRepository('a1', 10, 'a')))
+        queue.put(ReplicaRequest(FakeRepository('a2', 5, 'a')))
+        queue.put(ReplicaRequest(FakeRepository('b1', 0, 'b')))
+        self.assertEqual(queue.get().repositoryname, 'a1')
+        self.assertEqual(queue.get().repositoryname, 'b1')
+
+    def test_host_skip_ahead_equal_requests(self):
+        queue = ReplicaRequestQueue(HostLimits(maxconcurrent=1))
+        queue.put(ReplicaRequest(FakeRepository('busy', 0, 'a')))
+        queue.get()
+        a = ReplicaRequest(FakeRepository('a1', 0, 'a'))
+        b = ReplicaRequest(FakeRepository('b1', 0, 'b'))
+        b.timestamp = a.timestamp
+        queue.put(a)
+        queue.put(b)
+        self.assertTrue(queue.get() is b)
+        self.assertEqual(len(queue.queue), 1)
+        self.assertTrue(queue.queue[0] is a)
+        self.assertTrue(queue.pending['a1'] is a)
+
+    def test_host_rate(self):
+        queue = ReplicaRequestQueue(HostLimits(rate=5))
+        queue.put(ReplicaRequest(FakeRepository('a1', 0, 'a')))
+        queue.put(ReplicaRequest(FakeRepository('a2', 0, 'a')))
+        before = time.time()
+        queue.get()
+        queue.get()
+        self.assertTrue(time.time() - before >= 0.15)
+
+    def test_close_releases_pending(self):
+        queue = ReplicaRequestQueue()
+        req = ReplicaRequest(FakeRepository('foo'))
+        queue.put(req)
+        queue.close()
+        self.assertTrue(req.done)
+        self.assertEqual(req.status, None)
+
+    def test_requests(self):
+        queue = ReplicaRequestQueue()
+        queue.put(ReplicaRequest(FakeRepository('low', 0)))
+        queue.put(ReplicaRequest(FakeRepository('high', 10)))
+        queue.put(ReplicaRequest(FakeRepository('running', 5)))
+        queue.reprioritize('running', 20)
+        queue.get()
+        requests = queue.requests()
+        self.assertEqual([(r['repository'], r['state']) for r in requests],
+                         [('running', 'running'), ('high', 'pending'), ('low', 'pending')])
+        self.assertTrue(requests[0]['running'] >= 0)
+        self.assertEqual(requests[1]['running'], None)
+
+    def test_reprioritize(self):
+        queue = ReplicaRequestQueue()
+        for name, priority in (('a', 10), ('b', 9), ('c', 8), ('d', 7)):
+            queue.put(ReplicaRequest(FakeRepository(name, priority)))
+        self.assertEqual(queue.reprioritize('d', 20), 1)
+        self.assertEqual(queue.reprioritize('a', 0), 1)
+        self.assertEqual(queue.reprioritize('foo', 0), 0)
+        names = [queue.get().repositoryname for i in range(4)]
+        self.assertEqual(names, ['d', 'b', 'c', 'a'])
+
+    def test_cancel(self):
+        queue = ReplicaRequestQueue()
+        req = ReplicaRequest(FakeRepository('foo'))
+        queue.put(req)
+        queue.put(ReplicaRequest(FakeRepository('bar')))
+        self.assertEqual(queue.cancel('foo'), 1)
+        self.assertEqual(queue.cancel('foo'), 0)
+        self.assertTrue(req.done)
+        self.assertTrue(req.cancelled)
+        self.assertEqual(queue.get().repositoryname, 'bar')
+        self.assertEqual(queue.qsize(), 0)
+
+    def test_merge(self):
+        queue = ReplicaRequestQueue()
+        first = ReplicaRequest(FakeRepository('foo', 0))
+        second = ReplicaRequest(FakeRepository('foo', 10))
+        second.timestamp = first.timestamp + 60
+        queue.put(ReplicaRequest(FakeRepository('bar', 5)))
+        queue.put(first)
+        queue.put(second)
+        self.assertEqual(queue.qsize(), 2)
+        req = queue.get()
+        self.assertTrue(req is first)
+        self.assertEqual(req.priority, 10)
+        self.assertEqual(req.timestamp, second.timestamp - 60)
+        req.outputtail = 'output'
+        queue.release(req)
+        req.setdone(1)
+        self.assertTrue(second.done)
+        self.assertEqual(second.status, 1)
+        self.assertEqual(second.outputtail, 'output')
+        self.assertTrue(second.merged)
+        self.assertFalse(first.merged)
+
+    def test_defer_while_running(self):
+        queue = ReplicaRequestQueue()
+        queue.put(ReplicaRequest(FakeRepository('foo')))
+        running = queue.get()
+        deferred = ReplicaRequest(FakeRepository('foo'))
+        queue.put(deferred)
+        queue.put(ReplicaRequest(FakeRepository('foo', 10)))
+        self.assertEqual(queue.qsize(), 0)
+        self.assertEqual([r['state'] for r in queue.requests()], ['running', 'deferred'])
+        self.assertEqual(deferred.priority, 10)
+        queue.release(running)
+        self.assertTrue(queue.get() is deferred)
+
+    def test_release_equal_requests(self):
+        queue = ReplicaRequestQueue()
+        a = ReplicaRequest(FakeRepository('a'))
+        b = ReplicaRequest(FakeRepository('b'))
+        b.timestamp = a.timestamp
+        queue.put(a)
+        queue.put(b)
+        queue.get()
+        queue.get()
+        queue.release(b)
+        self.assertTrue(queue.running[0] is a)
+        # a new request for b is not deferred
+        queue.put(ReplicaRequest(FakeRepository('b')))
+        self.assertEqual(queue.qsize(), 1)
+
+    def test_close_releases_deferred(self):
+        queue = ReplicaRequestQueue()
+        queue.put(ReplicaRequest(FakeRepository('foo')))
+        queue.get()
+        req = ReplicaRequest(FakeRepository('foo'))
+        queue.put(req)
+        queue.close()
+        self.assertTrue(req.done)
+
+    def test_cancel_equal_requests(self):
+        queue = ReplicaRequestQueue()
+        a = ReplicaRequest(FakeRepository('a'))
+        b = ReplicaRequest(FakeRepository('b'))
+        b.timestamp = a.timestamp
+        queue.put(a)
+        queue.put(b)
+        self.assertEqual(queue.cancel('b'), 1)
+        self.assertTrue(b.cancelled)
+        self.assertFalse(a.done)
+        self.assertTrue(queue.get() is a)
+        self.assertEqual(queue.qsize(), 0)
+
+    def test_preempt_lowest(self):
+        queue = ReplicaRequestQueue()
+        for name, priority in (('a', 5), ('b', 0), ('c', 20)):
+            queue.put(ReplicaRequest(FakeRepository(name, priority)))
+            queue.get()
+        req = queue.preempt(10)
+        self.assertEqual(req.repositoryname, 'b')
+        self.assertTrue(req.preempted)
+        self.assertEqual(queue.preempt(10).repositoryname, 'a')
+        # nothing lower than 10 left
+        self.assertEqual(queue.preempt(10), None)
+
+    def test_preempt_only_when_busy(self):
+        manager = BareManager()
+        manager.log = logging.getLogger('test')
+        manager.replicaagents = [None, None]
+        manager.replicarequestqueue = queue = ReplicaRequestQueue()
+        queue.put(ReplicaRequest(FakeRepository('low', 0)))
+        low = queue.get()
+        urgent = ReplicaRequest(FakeRepository('urgent', 1000))
+        # one agent is still idle
+        manager.preempt(urgent)
+        self.assertFalse(low.preempted)
+        queue.setlimit(1)
+        manager.preempt(urgent)
+        self.assertTrue(low.preempted)
+
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fleet = Fleet(self.root, nrepositories=4, scheduler='loop', interval=3600)
+        self.fleet.create()
+        self.names = self.fleet.names
+        self._write(self.names[:3], {})
+        self.service = serviceCLI(Options(self.fleet.conffile))
+        self.manager = self.service.replica_manager
+
+    def tearDown(self):
+        stop_manager(self.manager)
+        shutil.rmtree(self.root)
+
+    def _write(self, names, intervals, acceptance='None', emails=None):
+        '''
+        emails, if given, are the admin_email of the Email report plugin,
+        per repository, and the default one with key None
+        '''
+        f = open(os.path.join(self.root, 'etc', 'repositories.conf'), 'w')
+        f.write('[DEFAULT]\nenabled = True\ninterval = 3600\nntrials = 1\n')
+        f.write('acceptanceplugins = %s\npostplugins = None\n' %acceptance)
+        if emails:
+            f.write('reportplugins = Email\nreport.email.smtp_server = localhost\n')
+            f.write('report.email.admin_email = %s\n' %emails[None])
+        else:
+            f.write('reportplugins = None\n')
+        for name in names:
+            f.write('\n[%s]\nrepositoryname = %s\n' %(name, name))
+            if name in intervals:
+                f.write('interval = %s\n' %intervals[name])
+            if emails and name in emails:
+                f.write('report.email.admin_email = %s\n' %emails[name])
+        f.close()
+
+    def test_reload(self):
+        before = dict([(r.repositoryname, r) for r in self.manager.repositories])
+        self.assertEqual(sorted(before.keys()), self.names[:3])
+
+        # first one changed, second unchanged, third removed, fourth added
+        self._write([self.names[0], self.names[1], self.names[3]], {self.names[0]: 60})
+        self.manager.reload()
+
+        after = dict([(r.repositoryname, r) for r in self.manager.repositories])
+        self.assertEqual(sorted(after.keys()), [self.names[0], self.names[1], self.names[3]])
+        self.assertTrue(after[self.names[0]] is before[self.names[0]])
+        self.assertEqual(after[self.names[0]].interval, 60)
+        self.assertTrue(after[self.names[1]] is before[self.names[1]])
+        self.assertEqual(after[self.names[1]].interval, 3600)
+        self.assertTrue(before[self.names[2]].stopevent.isSet())
+        self.assertEqual(self.manager.retiredrepositories, [before[self.names[2]]])
+        # the new one is given to the scheduler
+        scheduled = [entry[2] for entry in self.manager.scheduler.heap]
+        self.assertEqual(scheduled, [after[self.names[3]]])
+
+    def test_reload_wrong_configuration(self):
+        repository = self.manager.repositories[0]
+        f = open(os.path.join(self.root, 'etc', 'repositories.conf'), 'a')
+        f.write('[%s]\ninterval = notanumber\n' %repository.repositoryname)
+        f.close()
+        self.manager.reload()
+        self.assertEqual(repository.interval, 3600)
+        self.assertEqual(len(self.manager.repositories), 3)
+
+    def test_reload_unexpected_error(self):
+        first, second = self.manager.repositories[:2]
+        def reconfigure(conf):
+            raise ValueError('unexpected')
+        first.reconfigure = reconfigure
+        self._write(self.names[:3], {self.names[0]: 60, self.names[1]: 60})
+        self.manager.reload()
+        self.assertEqual(first.interval, 3600)
+        self.assertEqual(second.interval, 60)
+        self.assertEqual(len(self.manager.repositories), 3)
+
+    def test_reload_evicts_shared_plugins(self):
+        emails = {None: 'neo@matrix.net', self.names[0]: 'trinity@matrix.net'}
+        self._write(self.names[:3], {}, emails=emails)
+        self.manager.reload()
+        self.assertEqual(len(self.manager.sharedplugins), 2)
+        self._write(self.names[1:3], {}, emails=emails)
+        self.manager.reload()
+        self.assertEqual(len(self.manager.sharedplugins), 1)
+        email = self.manager.sharedplugins.values()[0]
+        self.assertTrue(self.manager.repositories[0].reportplugins[0] is email)
+        self._write(self.names[1:3], {})
+        self.manager.reload()
+        self.assertEqual(self.manager.sharedplugins, {})
+
+    def test_reload_releases_removed_repository(self):
+        self._write(self.names[:3], {}, 'Updatedserver')
+        self.manager.reload()
+        removed = self.manager.repositories[2]
+        updatedserver = removed.acceptanceplugins[0]
+        entries = self.manager.filewatcher.entries
+        self.assertTrue(removed.timestampfilename in entries)
+        self.assertTrue(updatedserver.localfile in entries)
+        self._write(self.names[:2], {}, 'Updatedserver')
+        self.manager.reload()
+        self.assertFalse(removed.timestampfilename in entries)
+        self.assertFalse(updatedserver.localfile in entries)
+
+
+
+class TestStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        fleet = Fleet(self.root, nrepositories=20, scheduler='loop', interval=3600)
+        fleet.create()
+        f = open(os.path.join(self.root, 'etc', 'repositories.conf'), 'a')
+        f.write('\n[DEFAULT]\nreportplugins = Email\n')
+        f.write('report.email.admin_email = neo@matrix.net\n')
+        f.write('report.email.smtp_server = localhost\n')
+        f.write('\n[%s]\nreport.email.admin_email = trinity@matrix.net\n' %fleet.names[0])
+        f.close()
+        self.names = fleet.names
+        self.service = serviceCLI(Options(fleet.conffile))
+        self.manager = self.service.replica_manager
+
+    def tearDown(self):
+        stop_manager(self.manager)
+        shutil.rmtree(self.root)
+
+    def test_all_created(self):
+        names = [repository.repositoryname for repository in self.manager.repositories]
+        self.assertEqual(names, self.names)
+
+    def test_shared_plugins(self):
+        emails = [repository.reportplugins[0] for repository in self.manager.repositories]
+        self.assertEqual(emails[0].adminemail, 'trinity@matrix.net')
+        self.assertTrue(emails[1] is not emails[0])
+        for email in emails[2:]:
+            self.assertTrue(email is emails[1])
+        self.assertEqual(len(self.manager.sharedplugins), 2)
+
+
+
+class TestColdStart(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fleet = Fleet(self.root, nrepositories=10, scheduler='loop', interval=3600)
+        self.fleet.create()
+        f = open(self.fleet.conffile, 'a')
+        f.write('statejournal = file://%s/state.journal\n' %self.root)
+        f.write('cold_start_window = 100\n')
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_overdue_spread_by_staleness(self):
+        now = int(time.time())
+        journal = StateJournal(os.path.join(self.root, 'state.journal'))
+        names = self.fleet.names
+        # timestamp files older than the journal
+        for name in names:
+            f = open(os.path.join(self.root, 'srv', name, '.cvmfs_last_snapshot'), 'w')
+            f.write(time.strftime('%a %b %d %H:%M:%S UTC %Y\n', time.gmtime(now - 7200)))
+            f.close()
+        # the first 5 ones are overdue, the most outdated is the last one
+        for i, name in enumerate(names[:5]):
+            journal.record(name, {'last_attempt': now - 10, 'last_success': now - 1000 * (i + 1),
+                                  'failures': i, 'next_due': now - 5})
+        for name in names[5:]:
+            journal.record(name, {'last_attempt': now - 10, 'last_success': now - 10,
+                                  'failures': 0, 'next_due': now + 1000})
+
+        manager = serviceCLI(Options(self.fleet.conffile)).replica_manager
+        repositories = dict([(r.repositoryname, r) for r in manager.repositories])
+        overdue = [repositories[name] for name in names[:5]]
+        for repository in overdue:
+            self.assertTrue(now <= repository.next_due <= now + 101)
+        dues = [repository.next_due for repository in overdue]
+        self.assertEqual(dues, sorted(dues, reverse=True))
+        self.assertEqual(overdue[3].failures, 3)
+        for name in names[5:]:
+            self.assertEqual(repositories[name].next_due, now + 1000)
+
+        # the end of every cycle is recorded
+        overdue[0]._cycledone()
+        self.assertEqual(StateJournal(os.path.join(self.root, 'state.journal')).get(names[0]),
+                         overdue[0].state())
+
+
+
+class TestTrigger(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.fleet = Fleet(self.root, nrepositories=1, scheduler='loop', interval=3600)
+        self.fleet.create()
+        self.fleet.stratum0.start()
+        self.manager = serviceCLI(Options(self.fleet.conffile)).replica_manager
+        self.repository = self.manager.repositories[0]
+        # requests are kept here, instead of being queued
+        self.requests = []
+        self.manager.replicarequestqueue.put = self.requests.append
+
+    def tearDown(self):
+        stop_manager(self.manager)
+        self.fleet.stratum0.join()
+        shutil.rmtree(self.root)
+
+    def test_rejected_trigger_is_forgotten(self):
+        self.repository.trigger(1000, preempt=True)
+        # nothing new in the Stratum-0
+        self.repository.cycle(lambda repository: None)
+        self.assertEqual(self.requests, [])
+
+        self.fleet.stratum0.publish(self.repository.repositoryname)
+        self.repository.cycle(lambda repository: None)
+        req = self.requests[0]
+        self.assertEqual(req.priority, self.repository.priority)
+        self.assertFalse(req.urgent)
+
+    def test_post_done_before_queued(self):
+        events = []
+        class Post(object):
+            def wait(self):
+                time.sleep(0.1)
+                events.append('wait')
+        self.repository.postplugins = [Post()]
+        self.manager.replicarequestqueue.put = lambda req: events.append('put')
+        self.fleet.stratum0.publish(self.repository.repositoryname)
+        self.repository.cycle(lambda repository: None)
+        self.assertEqual(events, ['wait', 'put'])
+
+
+class TestMergedRequest(RepositoryTestCase):
+
+    def test_processed_once(self):
+        events = []
+        self.repository._notify_failure = lambda msg=None: events.append('report')
+        self.repository._runpost = lambda: events.append('post')
+        first = ReplicaRequest(self.repository)
+        second = ReplicaRequest(self.repository)
+        first.merge(second)
+        first.setdone(1)
+        for req in (first, second):
+            self.repository._process_request(req)
+            self.repository._cycledone(req)
+        self.assertEqual(events, ['report', 'post'])
+        self.assertEqual(self.repository.failures, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
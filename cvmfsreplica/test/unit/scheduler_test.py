@@ -0,0 +1,109 @@
+#/usr/bin/python
+
+import logging
+import threading
+import time
+import unittest
+
+
+from cvmfsreplica.scheduler import Scheduler
+
+# the TRACE level is normally added by serviceCLI
+logging.Logger.trace = lambda self, msg, *args, **kwargs: self.log(5, msg, *args, **kwargs)
+
+
+class FakeRepository(object):
+
+    def __init__(self, repositoryname, interval, cycles):
+        self.repositoryname = repositoryname
+        self.interval = interval
+        self.last_attempt = int(time.time())
+        self.stopevent = threading.Event()
+        self.cycles = cycles
+
+    def _next_due(self):
+        return self.last_attempt + self.interval
+
+    def cycle(self, callback):
+        self.cycles.append(self.repositoryname)
+        callback(self)
+
+
+class SlowRepository(FakeRepository):
+
+    def cycle(self, callback):
+        time.sleep(1)
+        FakeRepository.cycle(self, callback)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        # one thread, so the cycles run in due order
+        self.scheduler = Scheduler(None, nworkers=1)
+        self.scheduler.start()
+
+    def tearDown(self):
+        self.scheduler.join()
+
+    def test_dispatch_in_due_order(self):
+        cycles = []
+        now = int(time.time())
+        # both in the heap before the scheduler looks at it
+        self.scheduler.join()
+        self.scheduler = Scheduler(None, nworkers=1)
+        self.scheduler.schedule(FakeRepository('second', 3600, cycles), now - 10)
+        self.scheduler.schedule(FakeRepository('first', 3600, cycles), now - 20)
+        self.scheduler.start()
+        time.sleep(0.2)
+        self.assertEqual(cycles, ['first', 'second'])
+
+    def test_not_due_yet(self):
+        cycles = []
+        self.scheduler.schedule(FakeRepository('foo', 3600, cycles))
+        time.sleep(0.2)
+        self.assertEqual(cycles, [])
+
+    def test_stopped_repository(self):
+        cycles = []
+        repository = FakeRepository('foo', 3600, cycles)
+        repository.stopevent.set()
+        self.scheduler.schedule(repository, 0)
+        time.sleep(0.2)
+        self.assertEqual(cycles, [])
+
+    def test_trigger(self):
+        cycles = []
+        repository = FakeRepository('foo', 3600, cycles)
+        self.scheduler.schedule(repository)
+        self.assertEqual(self.scheduler.trigger(repository), 'scheduled')
+        time.sleep(0.2)
+        # only once, the entry for the next interval is outdated
+        self.assertEqual(cycles, ['foo'])
+        self.assertEqual(len(self.scheduler.pending), 1)
+
+    def test_trigger_while_running(self):
+        cycles = []
+        repository = FakeRepository('foo', 3600, cycles)
+        # not in the heap, as if it was running a cycle
+        self.assertEqual(self.scheduler.trigger(repository), 'pending')
+        # once the cycle is done, it is due right away
+        self.scheduler.schedule(repository)
+        time.sleep(0.2)
+        self.assertEqual(cycles, ['foo'])
+
+    def test_slow_cycle_does_not_block(self):
+        self.scheduler.join()
+        self.scheduler = Scheduler(None, nworkers=2)
+        self.scheduler.start()
+        cycles = []
+        now = int(time.time())
+        self.scheduler.schedule(SlowRepository('slow', 3600, cycles), now - 20)
+        self.scheduler.schedule(FakeRepository('fast', 3600, cycles), now - 10)
+        time.sleep(0.2)
+        self.assertEqual(cycles, ['fast'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
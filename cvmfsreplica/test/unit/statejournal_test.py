@@ -0,0 +1,53 @@
+#/usr/bin/python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from cvmfsreplica.statejournal import StateJournal
+
+
+class TestStateJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'state', 'state.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_empty(self):
+        journal = StateJournal(self.path)
+        self.assertEqual(journal.get('foo'), None)
+
+    def test_survives_restart(self):
+        journal = StateJournal(self.path)
+        journal.record('foo', {'last_attempt': 1, 'failures': 0})
+        journal.record('bar', {'last_attempt': 2, 'failures': 1})
+        journal.record('foo', {'last_attempt': 3, 'failures': 2})
+        journal = StateJournal(self.path)
+        self.assertEqual(journal.get('foo'), {'last_attempt': 3, 'failures': 2})
+        self.assertEqual(journal.get('bar'), {'last_attempt': 2, 'failures': 1})
+
+    def test_partial_line(self):
+        journal = StateJournal(self.path)
+        journal.record('foo', {'last_attempt': 1})
+        f = open(self.path, 'a')
+        f.write('{"repository": "foo", "last_att')
+        f.close()
+        journal = StateJournal(self.path)
+        self.assertEqual(journal.get('foo'), {'last_attempt': 1})
+
+    def test_compact(self):
+        journal = StateJournal(self.path, compactlines=10)
+        for i in range(25):
+            journal.record('foo', {'last_attempt': i})
+        self.assertTrue(len(open(self.path).readlines()) <= 10)
+        self.assertEqual(StateJournal(self.path).get('foo'), {'last_attempt': 24})
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#/usr/bin/python
+
+import signal
+import threading
+import time
+import unittest
+
+
+from cvmfsreplica.supervisor import MAXLINE, ProcessSupervisor
+
+
+class TestProcessSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = ProcessSupervisor(0.3)
+        self.supervisor.start()
+
+    def tearDown(self):
+        self.supervisor.join()
+
+    def test_exit(self):
+        sp = self.supervisor.submit(['sh', '-c', 'echo foo; exit 3'])
+        self.assertEqual(sp.wait(), 3)
+        self.assertEqual(sp.reason, 'exit')
+        self.assertEqual(sp.out, 'foo')
+
+    def test_concurrent(self):
+        nthreads = threading.activeCount()
+        before = time.time()
+        sps = [self.supervisor.submit('sleep 0.5') for i in range(5)]
+        self.assertEqual(threading.activeCount(), nthreads)
+        for sp in sps:
+            self.assertEqual(sp.wait(), 0)
+        self.assertTrue(time.time() - before < 2)
+
+    def test_timeout_kills_group(self):
+        # the children of the shell keep the pipes open
+        before = time.time()
+        sp = self.supervisor.submit('sleep 10 & sleep 10; wait', timeout=0.2, shell=True)
+        sp.wait()
+        self.assertTrue(time.time() - before < 2)
+        self.assertEqual(sp.reason, 'timeout')
+        self.assertEqual(sp.signal, signal.SIGTERM)
+
+    def test_escalation(self):
+        sp = self.supervisor.submit('trap "" TERM; sleep 10', timeout=0.2, shell=True)
+        sp.wait()
+        self.assertEqual(sp.reason, 'timeout')
+        self.assertEqual(sp.signal, signal.SIGKILL)
+
+    def test_long_output_without_newline(self):
+        lines = []
+        size = 3 * MAXLINE + 10
+        sp = self.supervisor.submit('head -c %s /dev/zero | tr "\\0" x' %size, 
+                                    sink=lines.append, shell=True)
+        self.assertEqual(sp.wait(), 0)
+        self.assertEqual([len(line) for line in lines], [MAXLINE, MAXLINE, MAXLINE, 10])
+
+    def test_carriage_return(self):
+        sp = self.supervisor.submit(['printf', '10%%\\r50%%\\r100%%\\r\\ndone'])
+        sp.wait()
+        self.assertEqual(sp.out, '10%\n50%\n100%\ndone')
+
+    def test_signal(self):
+        sp = self.supervisor.submit(['sh', '-c', 'kill -INT $$'])
+        sp.wait()
+        self.assertEqual(sp.reason, 'signal')
+        self.assertEqual(sp.signal, signal.SIGINT)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
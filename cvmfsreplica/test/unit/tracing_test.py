@@ -0,0 +1,60 @@
+#/usr/bin/python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+from cvmfsreplica.tracing import RequestTrace, Tracer
+
+
+class TestRequestTrace(unittest.TestCase):
+
+    def test_timeline(self):
+        trace = RequestTrace('repo')
+        trace.mark('enqueued')
+        trace.mark('dequeued')
+        span = trace.begin('trial-1')
+        trace.end(span)
+        trace.begin('post')
+        trace.status = 0
+        trace.mark('noticed')
+        out = trace.todict()
+        self.assertEqual(out['repository'], 'repo')
+        self.assertEqual(out['status'], 0)
+        self.assertEqual(sorted(out['events'].keys()), ['created', 'dequeued', 'enqueued', 'noticed'])
+        self.assertTrue(out['queuewait'] >= 0)
+        self.assertTrue(out['total'] >= out['queuewait'])
+        self.assertEqual([s['name'] for s in out['spans']], ['trial-1', 'post'])
+        self.assertTrue(out['spans'][0]['duration'] >= 0)
+        # spans not ended have no duration
+        self.assertFalse('duration' in out['spans'][1])
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_write_and_rotate(self):
+        filename = os.path.join(self.dir, 'trace', 'trace.log')
+        tracer = Tracer(filename, maxbytes=1000, backupcount=2)
+        try:
+            for i in range(20):
+                tracer.write(RequestTrace('repo%s' %i))
+        finally:
+            tracer.close()
+        lines = open(filename).readlines()
+        self.assertTrue(lines)
+        self.assertEqual(json.loads(lines[-1])['repository'], 'repo19')
+        self.assertTrue(os.path.exists(filename + '.1'))
+        self.assertFalse(os.path.exists(filename + '.3'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,10 @@
 #/usr/bin/python
 
+import threading
 import unittest
 
         
-from cvmfsreplica.utils import date2seconds, check_disk_space
+from cvmfsreplica.utils import date2seconds, check_disk_space, get_revision, TimeoutCommand, WorkerPool
 
 
 class TestDate2Seconds(unittest.TestCase):
@@ -22,6 +23,50 @@ class TestCheckDiskSpace(unittest.TestCase):
         self.assertFalse(check_disk_space('/tmp/', 1000000000000000))
 
 
+class TestGetRevision(unittest.TestCase):
+
+    def test_revision(self):
+        self.assertEqual(get_revision(['C0123', 'S42', 'T1460734339']), 42)
+    def test_signature(self):
+        self.assertEqual(get_revision(['C0123', '--', 'S42']), None)
+
+
+class TestTimeoutCommand(unittest.TestCase):
+
+    def test_output(self):
+        tcommand = TimeoutCommand('echo foo; echo bar >&2; exit 3')
+        tcommand.run()
+        self.assertEqual((tcommand.out, tcommand.err, tcommand.rc), ('foo', 'bar', 3))
+    def test_sink_and_tail(self):
+        lines = []
+        tcommand = TimeoutCommand('seq 1 100', lines.append, 2)
+        tcommand.run()
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(tcommand.out, '99\n100')
+    def test_timeout(self):
+        tcommand = TimeoutCommand('exec sleep 10')
+        tcommand.run(0.2)
+        self.assertTrue(tcommand.timedout)
+        self.assertNotEqual(tcommand.rc, 0)
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_submit(self):
+        pool = WorkerPool(2)
+        event = threading.Event()
+        pool.submit(event.set)
+        event.wait(1)
+        self.assertTrue(event.isSet())
+        pool.stop()
+
+    def test_map(self):
+        pool = WorkerPool(3)
+        self.assertEqual(pool.map(lambda x: x * 2, range(10)), range(0, 20, 2))
+        self.assertRaises(ZeroDivisionError, pool.map, lambda x: 1 / x, [1, 0, 2])
+        pool.stop()
+
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+module with the timeline of each snapshot request,
+from its creation until the repository has processed the result
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import time
+
+
+# =============================================================================
+#       CLASS REQUEST TRACE
+# =============================================================================
+
+class RequestTrace(object):
+    """
+    class to record the timeline of one ReplicaRequest:
+
+        -- events, with the time something happened:
+           created, enqueued, dequeued, done, noticed
+
+        -- spans, with the time something started and ended:
+           trial-N, backoff-N, report, post
+    """
+
+    def __init__(self, repositoryname):
+        self.repositoryname = repositoryname
+        self.events = []
+        self.spans = []
+        self.status = None
+        self.mark('created')
+
+
+    def mark(self, name):
+        '''
+        records that something happened now
+        '''
+        self.events.append((name, time.time()))
+
+
+    def begin(self, name):
+        '''
+        records that something starts now.
+        Returns the span, to be passed to end( )
+        '''
+        span = {'name': name, 'start': time.time(), 'end': None}
+        self.spans.append(span)
+        return span
+
+
+    def end(self, span):
+        '''
+        records that something started with begin( ) ends now
+        '''
+        span['end'] = time.time()
+
+
+    def todict(self):
+        events = dict(self.events)
+        spans = []
+        for span in self.spans:
+            span = dict(span)
+            if span['end'] is not None:
+                span['duration'] = span['end'] - span['start']
+            spans.append(span)
+        out = {'repository': self.repositoryname,
+               'status': self.status,
+               'events': events,
+               'spans': spans}
+        if 'enqueued' in events and 'dequeued' in events:
+            out['queuewait'] = events['dequeued'] - events['enqueued']
+        if 'noticed' in events:
+            out['total'] = events['noticed'] - events['created']
+        return out
+
+
+# =============================================================================
+#       CLASS TRACER
+# =============================================================================
+
+class Tracer(object):
+    """
+    class to write the RequestTrace objects,
+    as one JSON document per line,
+    into a file that is rotated when it gets too large.
+    """
+
+    def __init__(self, filename, maxbytes=10485760, backupcount=5):
+        """
+        filename is the trace file
+        maxbytes is the size of the file before it is rotated
+        backupcount is how many rotated files are kept
+        """
+        self.log = logging.getLogger('cvmfsreplica.tracer')
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.tracelog = logging.getLogger('cvmfsreplica.trace')
+        self.tracelog.setLevel(logging.INFO)
+        # the traces only go to the trace file
+        self.tracelog.propagate = False
+        self.handler = logging.handlers.RotatingFileHandler(filename,
+                                                            maxBytes=maxbytes,
+                                                            backupCount=backupcount)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.tracelog.addHandler(self.handler)
+
+
+    def write(self, trace):
+        try:
+            self.tracelog.info(json.dumps(trace.todict(), sort_keys=True))
+        except Exception, ex:
+            self.log.error('failed to write the trace for repository %s: %s' %(trace.repositoryname, ex))
+
+
+    def close(self):
+        self.tracelog.removeHandler(self.handler)
+        self.handler.close()
@@ -2,10 +2,17 @@
 
 import calendar
 import datetime 
+import errno
+import fcntl
+import logging
 import os
-import subprocess
+import Queue
+import select
 import threading
 import time
+# time.strptime( ) imports it the first time it is called,
+# which is not thread safe
+import _strptime
 
 
 
@@ -48,6 +55,21 @@ def date2seconds(date_str):
     return seconds
 
 
+def get_revision(lines):
+    '''
+    returns the revision number from the lines 
+    of a .cvmfspublished file, or None if not found.
+    It stops reading as soon as the revision is found,
+    or when the signature part of the file starts.
+    '''
+    for line in lines:
+        if line.startswith('S'):
+            return int(line[1:].strip())
+        if line.startswith('--'):
+            break
+    return None
+
+
 def check_disk_space(dir, minsize):
     '''
     checks if the free space in disk for the partition
@@ -62,31 +84,158 @@ def check_disk_space(dir, minsize):
 
 class TimeoutCommand(object):
     '''
-    run a subprocess, with a timeout
+    run a shell command, with a timeout.
+
+    The output is read line by line, as it arrives.
+    If sink is provided, sink(line) is called for each line,
+    both from stdout and stderr.
+    If maxlines is provided, only the last maxlines lines
+    of stdout and stderr are kept in out and err.
+    Otherwise, they contain the whole output.
+
+    On timeout, the whole process group receives SIGTERM,
+    and SIGKILL after grace seconds.
+    The command is supervised from the calling thread,
+    no other thread is created.
     '''
-    def __init__(self, cmd):
+    def __init__(self, cmd, sink=None, maxlines=None, grace=30):
         self.cmd = cmd
+        self.sink = sink
+        self.maxlines = maxlines
+        self.grace = grace
         self.out = None
         self.err = None
         self.rc = None
+        self.reason = None
+        self.timedout = False
 
     def run(self, timeout=None):
-        def target():
-            self.process = subprocess.Popen(self.cmd,  
-                                            stdout=subprocess.PIPE, 
-                                            stderr=subprocess.PIPE, 
-                                            shell=True
-                                           )
-            (self.out, self.err) = self.process.communicate()
-            self.rc = self.process.returncode
-
-        thread = threading.Thread(target=target)
-        thread.start()
-
-        thread.join(timeout)
-        if thread.is_alive():
-            self.process.terminate()
-            thread.join()
-            # NOTE: here we can raise an exception
-
+        # NOTE:
+        # imported here to avoid problems due the circular imports,
+        # as module supervisor uses this module
+        from cvmfsreplica.supervisor import ProcessSupervisor
+        supervisor = ProcessSupervisor(self.grace)
+        sp = supervisor.submit(self.cmd, timeout, self.sink, self.maxlines, shell=True)
+        supervisor.loop(sp.done)
+        supervisor.wakeuppipe.close()
+        self.out = sp.out
+        self.err = sp.err
+        self.rc = sp.rc
+        self.reason = sp.reason
+        self.timedout = sp.timedout
+
+
+class WorkerPool(object):
+    '''
+    fixed number of threads running 
+    the functions submitted to the pool.
+    Threads are daemons, so a function that never returns
+    does not prevent the service from stopping.
+    '''
+    def __init__(self, nworkers, name='workerpool'):
+        self.log = logging.getLogger('cvmfsreplica.%s' %name)
+        self.tasks = Queue.Queue()
+        self.threads = []
+        for i in range(nworkers):
+            thread = threading.Thread(target=self._work, name='%s[%s]' %(name, i))
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, function, *args):
+        '''
+        queues function(*args) to be run by one of the threads
+        '''
+        self.tasks.put((function, args))
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            function, args = task
+            try:
+                function(*args)
+            except Exception, ex:
+                self.log.error('task %s raised an exception: %s' %(function, ex))
+
+    def map(self, function, items):
+        '''
+        runs function(item) for every item, using the threads of the pool,
+        and waits for all of them.
+        Returns the list of results, in the same order than items.
+        If any call raised an exception, the first one is raised again.
+        '''
+        results = [None] * len(items)
+        errors = []
+        done = Queue.Queue()
+        def run(i, item):
+            try:
+                try:
+                    results[i] = function(item)
+                except Exception, ex:
+                    errors.append(ex)
+            finally:
+                done.put(i)
+        for i, item in enumerate(items):
+            self.submit(run, i, item)
+        for item in items:
+            done.get()
+        if errors:
+            raise errors[0]
+        return results
+
+    def stop(self, wait=False):
+        '''
+        makes all threads to finish, 
+        once the tasks already submitted are done.
+        If wait is True, it blocks until they are finished
+        '''
+        for thread in self.threads:
+            self.tasks.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+class WakeupPipe(object):
+    '''
+    to block a thread, for some time or for ever,
+    until another thread wakes it up.
+    Unlike threading.Event.wait(timeout), 
+    the waiting thread does not wake up periodically.
+    '''
+    def __init__(self):
+        self.r, self.w = os.pipe()
+        # writes are non-blocking: when the pipe is full
+        # the waiting thread will wake up anyway
+        flags = fcntl.fcntl(self.w, fcntl.F_GETFL)
+        fcntl.fcntl(self.w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self.r
+
+    def wakeup(self):
+        try:
+            os.write(self.w, 'x')
+        except OSError, ex:
+            if ex.errno != errno.EAGAIN:
+                raise
+
+    def wait(self, timeout=None):
+        '''
+        returns True if woken up, False if the timeout expired
+        '''
+        ready = select.select([self.r], [], [], timeout)[0]
+        if ready:
+            self.clear()
+            return True
+        return False
+
+    def clear(self):
+        os.read(self.r, 4096)
+
+    def close(self):
+        os.close(self.r)
+        os.close(self.w)
 
@@ -91,6 +91,7 @@ install -m 0755 etc/cvmfsreplica $RPM_BUILD_ROOT%{_initrddir}/cvmfsreplica
 
 
 mkdir -pm0755 $RPM_BUILD_ROOT%{_var}/log/cvmfsreplica
+mkdir -pm0755 $RPM_BUILD_ROOT%{_var}/lib/cvmfsreplica
 
 
 %clean
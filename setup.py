@@ -78,9 +78,13 @@ setup(
               'cvmfsreplica.plugins.repository.post',
               'cvmfsreplica.test',
               'cvmfsreplica.test.unit',
+              'cvmfsreplica.test.benchmark',
               ],
 
-    scripts = ['bin/cvmfsreplica', ],
+    scripts = ['bin/cvmfsreplica', 
+               'bin/cvmfsreplica-history',
+               'bin/cvmfsreplicactl',
+              ],
     
     data_files = choose_data_files()
 )